@@ -304,6 +304,7 @@ class GameDialog(QDialog):
 
     def closeEvent(self, a0: QtGui.QCloseEvent) -> None:
         logger.info('Closing')
+        self.hypervisor.stop()
         super(GameDialog, self).close()
 
     def update_drawing(self, svg_image):
@@ -402,7 +403,7 @@ class GameDialog(QDialog):
                 "Sorry, you used all your available hints! It's only (wo)man versus machine now!")
         else:
             logger.info('Getting Hint from AI')
-            self.HintMove = self.hypervisor.chess_engine.engine.get_best_move()
+            self.HintMove = self.hypervisor.chess_engine.get_hint()
             if self.__player_color == 'w':
                 list_HintMove = self.hypervisor.chess_engine.mirrored_play([self.HintMove])
                 self.HintMove = list_HintMove[0]
@@ -522,6 +523,7 @@ from chesster.camera.realsense import RealSenseCamera
 from chesster.master.action import Action
 from chesster.obj_recognition.chessboard import ChessBoard
 from chesster.Schach_KI.class_chess_gameplay import ChessGameplay
+from chesster.Schach_KI.transforms import compress_rows
 from chesster.Robot.UR10 import UR10Robot
 from chesster.obj_recognition.object_recognition import ObjectRecognition
 from chesster.vision_based_control.controller import VisualBasedController
@@ -604,6 +606,10 @@ class HypervisorKIGUI:
                 self.board_list.append(field)
         self.board_temp = ChessBoardGUI(self.board_list)
 
+    def stop(self):
+        # Engine an den EngineManager zurückgeben, die nächste Partie nutzt den laufenden Prozess
+        self.chess_engine.quit()
+
     def analyze_game(self, start, opp_move):
         logger.info('Analyzing game')
         self.last_move_human = [opp_move]
@@ -736,7 +742,7 @@ class HypervisorKIGUI:
         logger.info('setting Fen Position from AI to empty ("")')
         # todo: Set Fen to zero for empty image
         ## Best Thing to do with used engine since a game without two kings is illegal
-        self.chess_engine.engine.set_fen_position('4k3/8/8/8/8/8/8/4K3 w - - 0 1')
+        self.chess_engine.set_fen_position('4k3/8/8/8/8/8/8/4K3 w - - 0 1')
 
     def replace_one_field_state(self, field_str: str, new_state: str):
         logger.info(f'Replacing field {field_str} with state {new_state}')
@@ -794,14 +800,7 @@ class HypervisorKIGUI:
             if row != '1':
                 fen += '/'
         logger.info(f' temporary fen is {fen}')
-        fen = fen.replace("........", str(8))
-        fen = fen.replace(".......", str(7))
-        fen = fen.replace("......", str(6))
-        fen = fen.replace(".....", str(5))
-        fen = fen.replace("....", str(4))
-        fen = fen.replace("...", str(3))
-        fen = fen.replace("..", str(2))
-        fen = fen.replace(".", str(1))
+        fen = compress_rows(fen.split('/'))
         rochade = ''
         if King_w is True and RTower_w is True:
             rochade += 'K'
@@ -817,10 +816,10 @@ class HypervisorKIGUI:
 
         if w_King_Flag is True and b_King_Flag is True:
             if player_color == 'b':
-                self.chess_engine.engine.set_fen_position(fen)
+                self.chess_engine.set_fen_position(fen)
                 logger.info(f'Setting FEN-Position in Stockfish succeeded')
             else:
-                self.chess_engine.engine.set_fen_position(self.chess_engine.mirror_fen(midgame=True, fen=fen))
+                self.chess_engine.set_fen_position(self.chess_engine.mirror_fen(midgame=True, fen=fen))
                 logger.info(f'Setting FEN-Position in Stockfish succeeded')
         else:
             logger.info(f'Not yet a legal FEN-Position because at least one King is missing')
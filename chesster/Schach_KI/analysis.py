@@ -0,0 +1,325 @@
+import chess
+import chess.engine
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+def score_dict(score: chess.engine.PovScore) -> dict:
+    """Converts a python-chess score to the Stockfish evaluation format from the view of white
+
+    Returns:
+        {'type': 'cp', 'value': centipawns} or {'type': 'mate', 'value': moves to mate (negative if black mates)}
+    """
+    score = score.white()
+    if score.is_mate():
+        return {'type': 'mate', 'value': score.mate()}
+    return {'type': 'cp', 'value': score.score()}
+
+
+class Analysis:
+    """Result of one engine search of a position: move of the engine, evaluation, principal variation and alternatives
+
+    The move of the engine (best_move) respects the skill level of the engine, the lines are the multi-PV lines of the
+    search ordered by their evaluation, the first line is the strongest move (used for hints).
+    """
+
+    def __init__(self, fen: str, best_move: Optional[str] = None, ponder: Optional[str] = None,
+                 lines: Optional[List[dict]] = None, terminal_score: Optional[dict] = None):
+        """
+        Args:
+            fen: analysed position
+            best_move: uci-string of the move chosen by the engine, None if there is no legal move
+            ponder: uci-string of the expected reply
+            lines: multi-PV lines {'move': uci-string, 'score': evaluation (score_dict), 'pv': list of uci-strings}
+            terminal_score: evaluation of a position without legal moves (checkmate or stalemate)
+        """
+        self.fen = fen
+        self.best_move = best_move
+        self.ponder = ponder
+        self.lines = lines or []
+        self.terminal_score = terminal_score
+        # Suchzeit in Sekunden und ob die Suche wegen einer scharfen Stellung verlängert wurde
+        self.time = 0.0
+        self.extended = False
+        # Ergebnis aus der Endspieldatenbank (Syzygy) statt einer Suche
+        self.tablebase = False
+
+    @classmethod
+    def from_search(cls, board: chess.Board, best: Optional[chess.engine.BestMove], infos: List[dict]) -> 'Analysis':
+        """Builds the analysis from the result and the multi-PV infos of a python-chess search
+
+        Without a result (search still running), the analysis holds the lines of the latest depth and no engine move.
+        """
+        lines = [{'move': info['pv'][0].uci(), 'score': score_dict(info['score']),
+                  'pv': [move.uci() for move in info['pv']]} for info in infos if info.get('pv') and 'score' in info]
+        best_move = None if best is None or best.move is None else best.move.uci()
+        ponder = None if best is None or best.ponder is None else best.ponder.uci()
+        return cls(board.fen(), best_move, ponder, lines)
+
+    @classmethod
+    def terminal(cls, board: chess.Board) -> 'Analysis':
+        """Analysis of a position without legal moves, no search necessary"""
+        if board.is_checkmate():
+            # Stockfish-Format: Matt in 0, Vorzeichen nicht definiert → Seite am Zug ist matt
+            score = {'type': 'mate', 'value': 0}
+        else:
+            score = {'type': 'cp', 'value': 0}
+        return cls(board.fen(), terminal_score=score)
+
+    @property
+    def score(self) -> Optional[dict]:
+        """Evaluation of the position from the view of white (Stockfish format)"""
+        if self.lines:
+            return self.lines[0]['score']
+        return self.terminal_score
+
+    @property
+    def pv(self) -> List[str]:
+        """Principal variation (uci-strings)"""
+        return self.lines[0]['pv'] if self.lines else []
+
+    @property
+    def hint(self) -> Optional[str]:
+        """Strongest move of the position, the move of the engine if the search did not report lines"""
+        return self.lines[0]['move'] if self.lines else self.best_move
+
+    def __repr__(self):
+        return f'Analysis(best_move={self.best_move}, score={self.score}, pv={" ".join(self.pv)})'
+
+
+class PositionAnalyzer:
+    """Analyses positions with one multi-PV engine search each and keeps the results by position
+
+    Move choice, evaluation chart and hints read the same analysis, so the engine searches every position once. The
+    position is keyed without move counters (EPD). Searches are serialized, so the analyzer can be shared by threads.
+
+    A position can also be analysed in the background (start), e.g. during the turn of the player. Until the search
+    has finished, latest answers from the lines of the latest depth without waiting. A search of another position stops
+    the background analysis.
+    """
+
+    def __init__(self, engine: chess.engine.SimpleEngine, limit: chess.engine.Limit, multipv=3, cache_size=256,
+                 background_limit: Optional[chess.engine.Limit] = None, tablebase=None):
+        """
+        Args:
+            engine: UCI engine
+            limit: search limit of an analysis
+            multipv: number of lines (alternatives) of an analysis
+            cache_size: number of analysed positions kept in memory
+            background_limit: search limit of a background analysis, no background analysis if None
+            tablebase: endgame tablebase (tablebase.Tablebase), positions with few pieces are probed without a search
+        """
+        self.engine = engine
+        self.limit = limit
+        self.multipv = multipv
+        self.cache_size = cache_size
+        self.searches = 0
+        self.__lock = threading.Lock()
+        self.__cache = OrderedDict()
+        self.background_limit = background_limit
+        # Laufende Hintergrundanalyse: Stellung, Brett, Suche, Startzeit
+        self.__background = None
+        # Partie der Suchen, bei einer neuen Partie sendet python-chess ucinewgame
+        self.game = None
+        self.tablebase = tablebase
+
+    def get(self, board: chess.Board) -> Optional[Analysis]:
+        """Gets the analysis of a position without searching, None if the position was not analysed"""
+        with self.__lock:
+            analysis = self.__cache.get(board.epd())
+            if analysis is not None:
+                self.__cache.move_to_end(board.epd())
+            return analysis
+
+    def store(self, board: chess.Board, analysis: Analysis):
+        """Keeps an analysis of a position, e.g. from the pondering engine"""
+        with self.__lock:
+            self.__store(board.epd(), analysis)
+
+    def probe(self, board: chess.Board) -> Optional[Analysis]:
+        """Gets the tablebase analysis of a position without a search, None if the position is not in the tablebase"""
+        if self.tablebase is None or not self.tablebase.covers(board):
+            return None
+        key = board.epd()
+        with self.__lock:
+            analysis = self.__cache.get(key)
+            if analysis is not None and analysis.tablebase:
+                self.__cache.move_to_end(key)
+                return analysis
+        analysis = self.tablebase.probe(board, self.multipv)
+        if analysis is not None:
+            self.store(board, analysis)
+        return analysis
+
+    def __store(self, key: str, analysis: Analysis):
+        self.__cache[key] = analysis
+        self.__cache.move_to_end(key)
+        while len(self.__cache) > self.cache_size:
+            self.__cache.popitem(last=False)
+
+    def analyse(self, board: chess.Board, limit: Optional[chess.engine.Limit] = None, max_time: Optional[float] = None,
+                sharp: Optional[Callable[[chess.Board, Analysis], bool]] = None) -> Analysis:
+        """Gets the analysis of a position, searches only if the position was not analysed before
+
+        With max_time and sharp, the search may run longer than the time of limit: at the time of limit the lines are
+        checked with sharp and the search only continues (up to max_time) if the position is sharp.
+
+        Args:
+            board: position
+            limit: search limit, default limit of the analyzer
+            max_time: maximal search time of a sharp position in seconds
+            sharp: check of the lines at the time of limit (e.g. time_budget.is_sharp)
+        Returns:
+            Analysis
+        """
+        analysis = self.probe(board)
+        if analysis is not None:
+            return analysis
+        key = board.epd()
+        limit = limit or self.limit
+        with self.__lock:
+            analysis = self.__cache.get(key)
+            if analysis is not None:
+                self.__cache.move_to_end(key)
+                return analysis
+            if self.__background is not None and self.__background[0] == key:
+                # Stellung läuft bereits im Hintergrund: mindestens so lange wie eine reguläre Suche rechnen lassen
+                analysis = self.__finish_background(wait=True)
+                if analysis is not None:
+                    return analysis
+            self.__finish_background()
+            if not any(board.legal_moves):
+                analysis = Analysis.terminal(board)
+            elif max_time is not None and sharp is not None and limit.time is not None and max_time > limit.time:
+                analysis = self.__search_extended(board, limit.time, max_time, sharp)
+            else:
+                start = time.perf_counter()
+                search = self.engine.analysis(board, limit, multipv=self.multipv, game=self.game,
+                                              info=chess.engine.INFO_SCORE | chess.engine.INFO_PV)
+                best = search.wait()
+                analysis = Analysis.from_search(board, best, search.multipv)
+                analysis.time = time.perf_counter() - start
+                self.searches += 1
+            self.__store(key, analysis)
+        logger.info(f'{analysis}')
+        return analysis
+
+    def __search_extended(self, board: chess.Board, base_time: float, max_time: float,
+                          sharp: Callable[[chess.Board, Analysis], bool]) -> Analysis:
+        # Eine Suche bis max_time, die nach base_time abgebrochen wird, wenn die Stellung nicht scharf ist
+        start = time.perf_counter()
+        search = self.engine.analysis(board, chess.engine.Limit(time=max_time), multipv=self.multipv, game=self.game,
+                                      info=chess.engine.INFO_SCORE | chess.engine.INFO_PV)
+        extended = []
+
+        def check():
+            if sharp(board, Analysis.from_search(board, None, search.multipv)):
+                extended.append(True)
+                logger.info(f'Sharp position, search extended up to {max_time:.2f} s')
+            else:
+                search.stop()
+
+        timer = threading.Timer(base_time, check)
+        timer.start()
+        best = search.wait()
+        timer.cancel()
+        timer.join()
+        analysis = Analysis.from_search(board, best, search.multipv)
+        analysis.time = time.perf_counter() - start
+        analysis.extended = bool(extended)
+        self.searches += 1
+        return analysis
+
+    def latest(self, board: chess.Board, wait_for_lines=False) -> Analysis:
+        """Gets the analysis of a position without waiting for a running background analysis
+
+        Args:
+            board: position
+            wait_for_lines: if the background analysis has not reported a depth yet, wait for it (as analyse) instead
+                of answering without lines
+        Returns:
+            finished analysis, the lines of the latest depth of the background analysis (no lines and score None if the
+            search has not reported a depth yet) or a new analysis
+        """
+        key = board.epd()
+        with self.__lock:
+            analysis = self.__cache.get(key)
+            if analysis is not None:
+                self.__cache.move_to_end(key)
+                return analysis
+            if self.__background is not None and self.__background[0] == key:
+                # Hintergrundanalyse nicht abbrechen, ohne Zeilen (gerade gestartet) ist die Bewertung None
+                analysis = Analysis.from_search(board, None, self.__background[2].multipv)
+                if analysis.lines or not wait_for_lines:
+                    return analysis
+        return self.analyse(board)
+
+    def start(self, board: chess.Board):
+        """Starts the analysis of a position in the background, returns immediately
+
+        Args:
+            board: position (e.g. after the move of the robot)
+        """
+        if self.background_limit is None or self.probe(board) is not None:
+            return
+        key = board.epd()
+        with self.__lock:
+            if key in self.__cache or (self.__background is not None and self.__background[0] == key):
+                return
+            self.__finish_background()
+            if not any(board.legal_moves):
+                self.__store(key, Analysis.terminal(board))
+                return
+            search = self.engine.analysis(board, self.background_limit, multipv=self.multipv, game=self.game,
+                                          info=chess.engine.INFO_SCORE | chess.engine.INFO_PV)
+            self.__background = (key, board.copy(), search, time.perf_counter())
+        threading.Thread(target=self.__complete, args=(search,), daemon=True).start()
+        logger.info('Background analysis started')
+
+    def __complete(self, search: chess.engine.SimpleAnalysisResult):
+        # Wartet auf das Ende der Suche (background_limit) und übernimmt das Ergebnis
+        try:
+            search.wait()
+        except chess.engine.EngineError:
+            return
+        with self.__lock:
+            if self.__background is not None and self.__background[2] is search:
+                analysis = self.__finish_background()
+                logger.info(f'Background analysis finished: {analysis}')
+
+    def __finish_background(self, wait=False) -> Optional[Analysis]:
+        # Stoppt die Hintergrundanalyse und übernimmt die Zeilen der letzten Tiefe, Aufruf nur mit self.__lock
+        if self.__background is None:
+            return None
+        key, board, search, started = self.__background
+        self.__background = None
+        if wait and self.limit.time is not None:
+            remaining = self.limit.time - (time.perf_counter() - started)
+            if remaining > 0:
+                time.sleep(remaining)
+        search.stop()
+        try:
+            best = search.wait()
+        except chess.engine.EngineError:
+            return None
+        analysis = Analysis.from_search(board, best, search.multipv)
+        self.searches += 1
+        if analysis.best_move is None or not analysis.lines:
+            # Zu früh gestoppt (ohne Bewertung), die Stellung wird bei Bedarf neu gesucht
+            return None
+        self.__store(key, analysis)
+        return analysis
+
+    def stop(self):
+        """Stops the background analysis"""
+        with self.__lock:
+            self.__finish_background()
+
+    def clear(self):
+        with self.__lock:
+            self.__cache.clear()
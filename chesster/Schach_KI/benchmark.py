@@ -0,0 +1,207 @@
+from chesster.Schach_KI.class_chess_gameplay import ChessGameplay
+from chesster.Schach_KI.mock_engine import mock_engine_command
+from collections import Counter
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+import numpy as np
+import chess
+import chess.pgn
+import contextlib
+import random
+import click
+import os
+import time
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class EngineTrace(logging.Handler):
+    """Counts the UCI commands sent to the engine processes (debug log of python-chess)
+
+    Every go command is a search round trip. Used as context manager, the debug log of python-chess is only counted and
+    not passed on to the other log handlers.
+    """
+
+    def __init__(self):
+        super().__init__(logging.DEBUG)
+        self.commands = Counter()
+        self.__logger = logging.getLogger('chess.engine')
+        self.__state = None
+
+    def emit(self, record: logging.LogRecord):
+        message = record.getMessage()
+        if ': << ' in message:
+            self.commands[message.split(': << ', 1)[1].split(' ', 1)[0]] += 1
+
+    def take(self) -> Counter:
+        """Returns the commands since the last call and resets the count"""
+        commands, self.commands = self.commands, Counter()
+        return commands
+
+    def __enter__(self):
+        self.__state = self.__logger.level, self.__logger.propagate
+        self.__logger.setLevel(logging.DEBUG)
+        self.__logger.propagate = False
+        self.__logger.addHandler(self)
+        return self
+
+    def __exit__(self, *args):
+        self.__logger.removeHandler(self)
+        self.__logger.setLevel(self.__state[0])
+        self.__logger.propagate = self.__state[1]
+
+
+class ReplayField:
+    def __init__(self, state: str):
+        self.state = state
+
+
+class ReplayBoard:
+    """Field states on the tableau taken from the rules board, stands in for the object recognition in a replay"""
+
+    def __init__(self, chess_engine: ChessGameplay, player_color: str):
+        self.chess_engine = chess_engine
+        self.player_color = player_color
+
+    def return_field(self, position: str) -> ReplayField:
+        if self.player_color == 'w':
+            position = self.chess_engine.mirrored_play([position])[0]
+        piece = self.chess_engine.rules.piece_at(chess.parse_square(position))
+        return ReplayField('.' if piece is None else piece.symbol())
+
+
+def random_games(games: int, plies: int) -> Iterator[List[Tuple[str, Optional[str]]]]:
+    """Games from the start position with up to plies random moves of the player (no moves given)"""
+    for _ in range(games):
+        yield [(chess.STARTING_FEN, None)] * plies
+
+
+def pgn_positions(pgn_path: Path, player_color: str) -> Iterator[List[Tuple[str, Optional[str]]]]:
+    """Games as (position before the move of the player, move of the player) from a PGN file"""
+    player = chess.WHITE if player_color == 'w' else chess.BLACK
+    with open(pgn_path) as source:
+        while True:
+            game = chess.pgn.read_game(source)
+            if game is None:
+                break
+            board = game.board()
+            positions = []
+            for move in game.mainline_moves():
+                if board.turn == player:
+                    positions.append((board.fen(), move.uci()))
+                board.push(move)
+            yield positions
+
+
+def statistics(calls: List[Dict]) -> Dict:
+    if len(calls) == 0:
+        return {'calls': 0}
+    times = np.array([call['ms'] for call in calls], dtype=np.float64)
+    searches = np.array([call['commands'].get('go', 0) for call in calls], dtype=np.float64)
+    commands = np.array([sum(call['commands'].values()) for call in calls], dtype=np.float64)
+    return {'calls': len(calls), 'mean_ms': float(times.mean()), 'p50_ms': float(np.percentile(times, 50)),
+            'p95_ms': float(np.percentile(times, 95)), 'max_ms': float(times.max()),
+            'searches_per_call': float(searches.mean()), 'max_searches': int(searches.max()),
+            'commands_per_call': float(commands.mean())}
+
+
+def replay(chess_engine: ChessGameplay, games: Sequence[List[Tuple[str, Optional[str]]]], player_color='b',
+           seed=0) -> Dict:
+    """Replays games through play_opponent and play_ki and measures wall time and engine round trips of every call
+
+    A game is a list of (FEN, move of the player). With a move, the position is set and the move is played, without a
+    move the game continues from the current position with a random legal move of the player.
+
+    Args:
+        chess_engine: ChessGameplay
+        games: games to replay (random_games, pgn_positions)
+        player_color: color of the player, the robot plays the other color
+        seed: seed of the random moves of the player
+    Returns:
+        statistics per call (play_ki, play_opponent), all calls and the UCI commands sent
+    """
+    rng = random.Random(seed)
+    board = ReplayBoard(chess_engine, player_color)
+    player = chess.WHITE if player_color == 'w' else chess.BLACK
+    calls = []
+    total = Counter()
+    with EngineTrace() as trace:
+        def measure(name, function, *args):
+            trace.take()
+            start = time.perf_counter()
+            result = function(*args)
+            calls.append({'call': name, 'ms': (time.perf_counter() - start) * 1000, 'commands': trace.take()})
+            total.update(calls[-1]['commands'])
+            return result
+
+        for game in games:
+            chess_engine.new_game()
+            for fen, move in game:
+                if move is not None:
+                    chess_engine.set_fen_position(fen)
+                elif chess_engine.rules.is_game_over():
+                    break
+                if chess_engine.rules.turn == player:
+                    if move is None:
+                        move = rng.choice(sorted(chess_engine.rules.legal_moves, key=chess.Move.uci)).uci()
+                    # Zug des Spielers in Schachfeld-Konvention wie von der Objekterkennung
+                    move_tab = chess_engine.mirrored_play([move])[0] if player_color == 'w' else move
+                    measure('play_opponent', chess_engine.play_opponent, [move_tab], player_color)
+                if chess_engine.rules.turn != player and not chess_engine.rules.is_game_over():
+                    measure('play_ki', chess_engine.play_ki, [], player_color, board)
+    result = {name: statistics([call for call in calls if call['call'] == name])
+              for name in ('play_opponent', 'play_ki')}
+    result['commands'] = dict(total)
+    result['calls'] = [{**call, 'commands': dict(call['commands'])} for call in calls]
+    for name in ('play_opponent', 'play_ki'):
+        stats = result[name]
+        if stats['calls']:
+            logger.info(f'{name}: {stats["calls"]} calls, {stats["mean_ms"]:.1f} ms mean, {stats["p95_ms"]:.1f} ms '
+                        f'p95, {stats["searches_per_call"]:.2f} searches per call (max {stats["max_searches"]})')
+    logger.info(f'UCI commands: {dict(total)}')
+    return result
+
+
+@click.command()
+@click.option('--engine_path', default=None, help='UCI engine (default: STOCKFISH_PATH or installed Stockfish)')
+@click.option('--mock_latency', type=float, default=None, help='use the mock engine with this search latency in s')
+@click.option('--pgn_path', type=click.Path(exists=True), default=None, help='replay the player moves of a PGN file')
+@click.option('--games', type=int, default=2, help='number of games with random player moves (without PGN)')
+@click.option('--plies', type=int, default=40, help='maximum number of player moves per random game')
+@click.option('--player_color', type=click.Choice(['w', 'b']), default='b')
+@click.option('--seed', type=int, default=0)
+@click.option('--ponder/--no-ponder', default=False)
+@click.option('--background/--no-background', default=True, help='background analysis during the player turn')
+@click.option('--tablebase_path', type=click.Path(exists=True), default=None, help='directory of Syzygy tables')
+@click.option('--output_path', type=click.Path(), default=None, help='write the results as JSON')
+def main(engine_path, mock_latency, pgn_path, games, plies, player_color, seed, ponder, background, tablebase_path,
+         output_path):
+    logging.basicConfig(level=logging.INFO)
+    if mock_latency is not None:
+        engine_path = mock_engine_command(mock_latency)
+    chess_engine = ChessGameplay(engine_path=engine_path, ponder=ponder,
+                                 background_time=2.0 if background else None, tablebase_path=tablebase_path)
+    if pgn_path is not None:
+        replay_games = list(pgn_positions(Path(pgn_path), player_color))
+    else:
+        replay_games = list(random_games(games, plies))
+    # Konsolenausgabe von play_ki/play_opponent (Log und Brett) unterdrücken
+    logging.getLogger('chesster.Schach_KI.class_chess_gameplay').setLevel(logging.WARNING)
+    start = time.perf_counter()
+    try:
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            result = replay(chess_engine, replay_games, player_color, seed)
+    finally:
+        chess_engine.quit()
+    result['wall_s'] = time.perf_counter() - start
+    logger.info(f'Replay took {result["wall_s"]:.2f} s')
+    if output_path is not None:
+        with open(output_path, 'w') as dest:
+            json.dump(result, dest, indent=2)
+        logger.info(f'Wrote benchmark results to {output_path}')
+
+
+if __name__ == '__main__':
+    main()
@@ -2,43 +2,227 @@ import chess
 import chess.engine
 import chess.pgn
 import chess.svg
-import pandas as pd
 from chesster.Schach_KI.comparison import *
-from stockfish import Stockfish
+from chesster.Schach_KI.analysis import PositionAnalyzer
+from chesster.Schach_KI.engine import engine_manager, find_engine, host_options
+from chesster.Schach_KI.time_budget import is_sharp
+from chesster.Schach_KI.ponder import PonderingEngine
+from chesster.Schach_KI.move_cache import MoveCache
+from chesster.Schach_KI.opening_book import OpeningBook
+from chesster.Schach_KI.tablebase import Tablebase
+from chesster.Schach_KI.transforms import SQUARE_NAMES, fen_to_matrix, matrix_to_fen, mirror_fen, mirror_moves
 import logging
 #from dotenv import dotenv_values
 import asyncio
+import contextlib
 import os
 
 logger = logging.getLogger(__name__)
 
 
 class ChessGameplay:
-    def __init__(self, skill_level=10, elo=False, elo_rating=1350, threads=4, minimum_thinking_time=30, debug=False):
+    def __init__(self, skill_level=10, elo=False, elo_rating=1350, threads=None, minimum_thinking_time=30, debug=False,
+                 ponder=False, move_cache_path=None, book_path=None, background_time=2.0, engine_path=None,
+                 turn_budget=None, hash_size=None, engines=None, tablebase_path=None):
         if debug:
             logging.basicConfig(level=logging.DEBUG)
         logger.info(f'Starting Chess engine')
         self.board = chess.Board()
         self.last_move = ""
         self.arrow = []
-        self.dict_fen_positions = {}
-        self.overflow = ""
+        # Spielstand, beantwortet Regelfragen (Matt, Remis, Legalität) ohne Engine-Suche
+        # Die Engine erhält die Stellung mit jeder Suche
+        self.rules = chess.Board()
         self.remis = False
-        #config = dotenv_values('../../.env')
-        # config.get('STOCKFISH_PATH', '/usr/games/stockfish')
-        project_path = os.path.dirname(os.path.abspath(__file__))
-        stockfish_path = os.path.join(project_path, "stockfish_14.1_win_x64_avx2.exe")
+        # Engine-Pfad: Parameter, STOCKFISH_PATH, Stockfish neben diesem Modul oder installiertes Stockfish
+        stockfish_path = find_engine(engine_path)
         logger.info(f'Stockfish path set to: {stockfish_path}')
-        self.engine = Stockfish(stockfish_path, parameters={"Threads": threads,
-                                                            "Minimum Thinking Time": minimum_thinking_time,
-                                                            "Skill Level": skill_level})
-        self.engine.set_depth(2)
+        # Threads und Hash passend zum Rechner, wenn nicht vorgegeben (mit Pondering für zwei Engines)
+        options = host_options(2 if ponder is True else 1)
+        if threads is not None:
+            options["Threads"] = threads
+        if hash_size is not None:
+            options["Hash"] = hash_size
+        options.update({"Minimum Thinking Time": minimum_thinking_time, "Skill Level": skill_level,
+                        "UCI_LimitStrength": elo is True})
         if elo is True:
-            self.engine.set_elo_rating(elo_rating)
-        logger.info(f'Chess engine parameters are: {self.engine.get_parameters()}')
-        self.engine.set_fen_position("rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1")
+            options["UCI_Elo"] = elo_rating
+        # Endspieldatenbank auch für die Suche der Engine
+        options["SyzygyPath"] = tablebase_path if tablebase_path else "<empty>"
+        # Laufende Engine der Anwendung (EngineManager), die Partie beginnt mit ucinewgame bei der ersten Suche
+        self.engines = engines if engines is not None else engine_manager
+        self.engine = self.engines.acquire(stockfish_path, options)
+        self.game = None
+        # Eine Multi-PV-Suche pro Stellung liefert KI-Zug, Bewertung und Tipp
+        # Während des Spielerzugs wird die Stellung im Hintergrund tiefer analysiert (Tipp und Bewertungsbalken)
+        background_limit = None if background_time is None else chess.engine.Limit(time=background_time)
+        # Stellungen mit wenigen Figuren werden ohne Suche aus der Syzygy-Endspieldatenbank beantwortet
+        self.tablebase = Tablebase(tablebase_path) if tablebase_path else None
+        self.analyzer = PositionAnalyzer(self.engine, chess.engine.Limit(time=0.01), multipv=3,
+                                         background_limit=background_limit, tablebase=self.tablebase)
+        # Optional zweiter UCI-Prozess, der während der Bedenkzeit des Spielers die erwartete Antwort vorausberechnet
+        self.ponder = None
+        self.expected_reply = None
+        if ponder is True:
+            self.ponder = PonderingEngine(self.engines.acquire(stockfish_path, options), multipv=self.analyzer.multipv)
+        # Suchzeit aus dem Zeitbudget des Roboterzugs (TurnBudget), sonst feste Suchzeit von 10 ms
+        self.turn_budget = turn_budget
+        self.strength = min(max((elo_rating - 1350) / 1500, 0.0), 1.0) if elo is True else skill_level / 20
+        # Schlüssel des Zug-Caches: Züge gelten nur für gleiche Spielstärke und gleiche Suchgrenzen
+        self.engine_settings = f'elo={elo_rating}' if elo is True else f'skill={skill_level}'
+        movetime = 'adaptive' if turn_budget is not None else '10'
+        self.search_limits = f'movetime={movetime},multipv={self.analyzer.multipv},' \
+                             f'minimum_thinking_time={minimum_thinking_time}'
+        self.move_cache = MoveCache(move_cache_path) if move_cache_path else None
+        self.book = OpeningBook(book_path) if book_path else None
+        logger.info(f'Chess engine parameters are: {options}')
+        self.new_game()
         logger.info(f'Chess Engine Initialisation Completed')
 
+    def new_game(self, fen=chess.STARTING_FEN):
+        """Starts a new game on the running engine: ucinewgame with the next search and the start position
+
+        Args:
+            fen: start position (Stockfish orientation)
+        """
+        self.analyzer.stop()
+        self.game = object()
+        self.analyzer.game = self.game
+        if self.ponder is not None:
+            self.ponder.game = self.game
+        self.expected_reply = None
+        self.set_fen_position(fen)
+
+    def set_fen_position(self, fen: str):
+        """Sets a FEN-Position in the local rules board, the engine gets the position with every search
+
+        Args:
+            fen: FEN-Position (Stockfish orientation)
+        """
+        if self.ponder is not None:
+            self.ponder.cancel()
+        self.rules = chess.Board(fen)
+
+    def get_fen_position(self):
+        """Gets the current FEN-Position from the local rules board (no engine round trip)
+
+        Returns:
+            FEN-Position
+        """
+        return self.rules.fen()
+
+    @staticmethod
+    def to_uci(move: str):
+        """Normalizes a move for python-chess, promotion pieces are passed in upper case for white (e.g. e7e8Q)"""
+        return move[0:4] + move[4:].lower()
+
+    def is_move_legal(self, move: str):
+        """Checks a move (Stockfish orientation) against the rules of the current position
+
+        Args:
+            move: uci-string
+        Returns:
+            True, if the move is legal, else False
+        """
+        try:
+            return chess.Move.from_uci(self.to_uci(move)) in self.rules.legal_moves
+        except ValueError:
+            return False
+
+    def make_move(self, move: str):
+        """Plays a legal move (Stockfish orientation) in the local rules board
+
+        Args:
+            move: uci-string
+        """
+        self.rules.push_uci(self.to_uci(move))
+
+    def analyse(self):
+        """Gets the analysis of the current position (best move, evaluation, principal variation and alternatives)
+
+        The position is searched once, move choice, evaluation chart and hints share the result.
+
+        Returns:
+            Analysis
+        """
+        return self.analyzer.analyse(self.rules)
+
+    def get_hint(self):
+        """Gets the strongest move for the side to move as hint for the player, from the latest depth of the
+        background analysis if it is still running
+
+        Returns:
+            uci-string (Stockfish orientation), None if there is no legal move
+        """
+        # Ohne Zeilen der Hintergrundanalyse auf die erste Tiefe warten, sonst gäbe es keinen Tipp
+        return self.analyzer.latest(self.rules, wait_for_lines=True).hint
+
+    def search_best_move(self):
+        """Computes the KI move for the current position: opening book, endgame tablebase, move cache, ponder search or
+        analysis
+
+        Returns:
+            uci-string of the best move, None if there is no legal move
+        """
+        self.expected_reply = None
+        if self.book is not None:
+            book_move = self.book.move(self.rules)
+            if book_move is not None:
+                logger.info(f'Book move {book_move.uci()}')
+                return book_move.uci()
+        analysis = self.analyzer.probe(self.rules)
+        if analysis is not None:
+            # Perfekter Zug aus der Endspieldatenbank ohne Suche
+            self.expected_reply = chess.Move.from_uci(analysis.ponder) if analysis.ponder else None
+            return analysis.best_move
+        if self.move_cache is not None:
+            cached = self.move_cache.get(self.rules, self.engine_settings, self.search_limits)
+            if cached is not None:
+                best_move, ponder_move = cached
+                logger.info(f'Cached move {best_move}')
+                self.expected_reply = chess.Move.from_uci(ponder_move) if ponder_move else None
+                return best_move
+        analysis = None
+        if self.ponder is not None:
+            analysis = self.ponder.ponderhit(self.rules)
+            if analysis is not None:
+                self.analyzer.store(self.rules, analysis)
+        if analysis is None and self.turn_budget is not None:
+            # Basis-Suchzeit nach Spielstärke, Verlängerung nur in scharfen Stellungen, begrenzt durch das Zugbudget
+            base_time, max_time = self.turn_budget.search_time(self.strength)
+            analysis = self.analyzer.analyse(self.rules, chess.engine.Limit(time=base_time), max_time, is_sharp)
+            if analysis.extended:
+                self.turn_budget.extended()
+        if analysis is None:
+            analysis = self.analyse()
+        best_move = analysis.best_move
+        self.expected_reply = chess.Move.from_uci(analysis.ponder) if analysis.ponder else None
+        if self.move_cache is not None and best_move is not None:
+            self.move_cache.put(self.rules, self.engine_settings, self.search_limits, best_move,
+                                None if self.expected_reply is None else self.expected_reply.uci())
+        return best_move
+
+    def quit(self):
+        """Stops the searches, gives the engines back to the engine manager and closes move cache, opening book and
+        tablebase"""
+        if self.engine is not None:
+            self.analyzer.stop()
+            self.engines.release(self.engine)
+            self.engine = None
+        if self.ponder is not None:
+            self.ponder.cancel()
+            self.engines.release(self.ponder.engine)
+            self.ponder = None
+        if self.move_cache is not None:
+            self.move_cache.close()
+            self.move_cache = None
+        if self.book is not None:
+            self.book.close()
+            self.book = None
+        if self.tablebase is not None:
+            self.tablebase.close()
+            self.tablebase = None
+
     def get_drawing(self, last_move: str, proof: bool, player_color: str, hint=False, midgame=False, fen='8/8/8/8/8/8/8/8 w - - 0 1'):
         """Gets the svg-image by setting current Stockfish-FEN in a Python-Chess-Board (based on predefined orientation of object_recognition of the chess board and depending on player_color → mirrors FEN-Position before setting).
         Additionally: Highlight main move with a colored arrow and king red if in chess
@@ -61,7 +245,7 @@ class ChessGameplay:
             logger.info(f'given fen to get_drawing: {fen}')
             return chess.svg.board(self.board, flipped=True)
         else:
-            self.board = chess.Board(self.engine.get_fen_position())
+            self.board = chess.Board(self.get_fen_position())
             player_turn = self.get_player_turn_from_fen()
             if player_color == 'w':
                 self.board = chess.Board(self.mirror_fen())
@@ -97,11 +281,14 @@ class ChessGameplay:
                     value for black, value for white
                         | if type is 'mate' or abs(value) for type 'cp' is higher than a predefined value, a full advantage for one color is defined
                 """
-        evaluation = self.engine.get_evaluation()
+        evaluation = self.analyzer.latest(self.rules).score  # ohne auf die Hintergrundanalyse zu warten
         logger.info(f'{evaluation}')
         DIVIDER = 25.0
         val_w = 50.0
         val_b = 50.0
+        if evaluation is None:
+            # Hintergrundanalyse hat noch keine Zeilen geliefert → ausgeglichen anzeigen
+            return val_w, val_b
         if evaluation['type'] == 'cp':
             if evaluation['value'] == 0:
                 val_w = 50.0
@@ -181,10 +368,12 @@ class ChessGameplay:
                 logger.info(f'Backward move from player: {move_command} (on tableau)')
         else:
             # Korrektheit des Gegnerzuges prüfen
-            proof = self.engine.is_move_correct(move_opponent[0])  # Definierender Zug stets an Stelle 1 der Liste
+            proof = self.is_move_legal(move_opponent[0])  # Definierender Zug stets an Stelle 1 der Liste
             if proof is True:
-                self.engine.make_moves_from_current_position(move_opponent)  # Zug des Gegenspielers System hinzufügen
-                print(self.engine.get_board_visual())
+                self.make_move(move_opponent[0])  # Zug des Gegenspielers System hinzufügen
+                if self.ponder is not None:
+                    self.ponder.opponent_moved(self.rules)
+                print(self.rules)
                 ki_checkmate = self.proof_checkmate()
                 remis_by_half_moves, remis_by_triple_occurence, remis_by_stalemate = self.proof_remis()
                 logger.info(f'Player move {move_opponent} was correct (in operating system)')
@@ -222,7 +411,10 @@ class ChessGameplay:
         best_move_tab = []
         ki_checkmate = self.proof_checkmate()  # Fall: Start mitten im Spiel und Spielstatus Schachmatt
         remis_by_half_moves, remis_by_triple_occurence, remis_by_stalemate = self.proof_remis()
-        best_move_sys = self.engine.get_best_move_time(10)  # Zug der KI berechnen
+        best_move_sys = None
+        if any(self.rules.legal_moves):  # Matt oder Patt: kein Zug möglich, keine Suche notwendig
+            with self.turn_budget.phase('search') if self.turn_budget is not None else contextlib.nullcontext():
+                best_move_sys = self.search_best_move()  # Zug der KI berechnen
         logger.info(f'KI move uci {best_move_sys} (in operating system)')
         # before = self.compute_matrix_from_fen(player_color)  # wenn Objekte (board) der Objekterkennung nicht verfügbar
         if best_move_sys != None:
@@ -250,8 +442,11 @@ class ChessGameplay:
                 rochade_by_ki, move_command = self.proof_ki_rochade(best_move_tab, move_command)
                 promotion_by_ki, move_command, promotion_piece, = self.proof_ki_promotion(best_move_tab, move_command,
                                                                                         capture_by_ki)
-                self.engine.make_moves_from_current_position([best_move_sys])  # Zug der KI System hinzufügen
-                print(self.engine.get_board_visual())
+                self.make_move(best_move_sys)  # Zug der KI System hinzufügen
+                self.analyzer.start(self.rules)  # Tipp und Bewertung für den Spieler im Hintergrund berechnen
+                if self.ponder is not None and (self.tablebase is None or not self.tablebase.covers(self.rules)):
+                    self.ponder.start(self.rules, self.expected_reply)  # Antwort des Spielers vorausberechnen
+                print(self.rules)
                 player_checkmate = self.proof_checkmate()  # auf Schachmatt des Spielers überprüfen
                 remis_by_half_moves, remis_by_triple_occurence, remis_by_stalemate = self.proof_remis()
                 logger.info(f'Check for special moves from KI: "Capture": {capture_by_ki}, "En-Passant": {en_passant_by_ki}, "Rochade": {rochade_by_ki}, "Promotion": {promotion_by_ki}')
@@ -270,34 +465,7 @@ class ChessGameplay:
         return move_command, ki_checkmate, player_checkmate, remis_by_half_moves, remis_by_triple_occurence, remis_by_stalemate
         
     @staticmethod
-    def mirroring_matrix():
-        """Defines a DataFrame to get mirrored field positions
-
-                Returns:
-                    DataFrame with Original to Mirrored
-                """
-        #  Define matrix for mirrored_play, e.g: a8→a1
-        mirror_image = pd.DataFrame(columns=['Original', 'Mirrored'])
-        letters = {'letter': ['a', 'b', 'c', 'd', 'e', 'f', 'g', 'h']}
-        letters_df = pd.DataFrame(data=letters)
-        numbers = {'number': [8, 7, 6, 5, 4, 3, 2, 1]}
-        numbers_mirrored = {'number_mirrored': [1, 2, 3, 4, 5, 6, 7, 8]}
-        numbers_df = pd.DataFrame(data=numbers)
-        numbers_mirrored_df = pd.DataFrame(data=numbers_mirrored)
-        for l in range(0, 8):
-            for i in range(0, 8):
-                letter = letters_df['letter'][i]
-                number = numbers_df['number'][l]
-                number_str = str(number)
-                letter_number = letter+number_str
-
-                number_mirrored = numbers_mirrored_df['number_mirrored'][l]
-                number_mirrored_str = str(number_mirrored)
-                letter_number_mirrored = letter+number_mirrored_str
-                mirror_image.loc[l*8+i] = [letter_number, letter_number_mirrored]
-        return mirror_image
-
-    def mirrored_play(self, moves_to_mirror: list):
+    def mirrored_play(moves_to_mirror: list):
         """Mirrors a list of passed moves to switch between Stockfish orientation and real orientation
 
                 Args:
@@ -306,31 +474,7 @@ class ChessGameplay:
                     List of mirrored moves
                 """
         #  Mirror complete move(s) if player is white
-        mirrored_position = []
-        for n in range(len(moves_to_mirror)):
-            mirror_image = self.mirroring_matrix()
-            old_position = moves_to_mirror[n][0:2]
-            old_position_mirrored = ""
-            promotion = ""
-            if len(moves_to_mirror[n]) == 5:
-                promotion = moves_to_mirror[n][4]
-            if len(moves_to_mirror[n]) == 2:
-                new_position_mirrored = ""
-                new_position = ""
-            else:
-                new_position = moves_to_mirror[n][2:4]
-                new_position_mirrored = ""
-            for i in range(0, 64):
-                if mirror_image['Original'][i] == old_position:
-                    old_position_mirrored = mirror_image['Mirrored'][i]
-                if mirror_image['Original'][i] == new_position:
-                    new_position_mirrored = mirror_image['Mirrored'][i]
-            if old_position_mirrored == "":
-                old_position_mirrored = old_position
-            if new_position_mirrored == "":
-                new_position_mirrored = new_position
-            mirrored_position.append(old_position_mirrored + new_position_mirrored + promotion)
-        return mirrored_position
+        return mirror_moves(moves_to_mirror)
 
     @staticmethod
     def rollback(moves: list):
@@ -388,12 +532,7 @@ class ChessGameplay:
             Returns:
                 True, if state is "Checkmate", else False.
         """
-        best_move = self.engine.get_best_move()
-        if best_move is None:
-            proof = True
-        else:
-            proof = False
-        return proof
+        return self.rules.is_checkmate()
 
     @staticmethod
     def proof_ki_capture(before: list, best_move: str, move_cmd_till_now: list, board):
@@ -454,7 +593,7 @@ class ChessGameplay:
                 """
         # Check for En-Passent by KI
         listing = []
-        position = self.engine.get_fen_position()
+        position = self.get_fen_position()
         for i, n in enumerate(position):
             if n == " ":
                 listing.append(i)
@@ -545,33 +684,7 @@ class ChessGameplay:
         Returns:
             8x8 matrix, if player_color is black, white at the top, else black at top
         """
-        compute_before = str(self.engine.get_fen_position())
-        compute_before = compute_before.replace(str(8), "........")
-        compute_before = compute_before.replace(str(7), ".......")
-        compute_before = compute_before.replace(str(6), "......")
-        compute_before = compute_before.replace(str(5), ".....")
-        compute_before = compute_before.replace(str(4), "....")
-        compute_before = compute_before.replace(str(3), "...")
-        compute_before = compute_before.replace(str(2), "..")
-        compute_before = compute_before.replace(str(1), ".")
-        compute_before = compute_before.replace("/", "")
-        compute_before64 = compute_before[0:64]
-        list_black_top = [[0, 0, 0, 0, 0, 0, 0, 0], [0, 0, 0, 0, 0, 0, 0, 0], [0, 0, 0, 0, 0, 0, 0, 0], [0, 0, 0, 0, 0, 0, 0, 0],
-                 [0, 0, 0, 0, 0, 0, 0, 0], [0, 0, 0, 0, 0, 0, 0, 0], [0, 0, 0, 0, 0, 0, 0, 0], [0, 0, 0, 0, 0, 0, 0, 0]]
-        list_white_top = [[0, 0, 0, 0, 0, 0, 0, 0], [0, 0, 0, 0, 0, 0, 0, 0], [0, 0, 0, 0, 0, 0, 0, 0], [0, 0, 0, 0, 0, 0, 0, 0],
-                 [0, 0, 0, 0, 0, 0, 0, 0], [0, 0, 0, 0, 0, 0, 0, 0], [0, 0, 0, 0, 0, 0, 0, 0], [0, 0, 0, 0, 0, 0, 0, 0]]
-        for i in range(len(compute_before64)):
-            main_divider = int(i / 8)
-            rest = int(i % 8)
-            list_black_top[main_divider][rest] = compute_before64[i]
-        if player_color == 'b':
-            count = 7
-            for n in range(0, 8):
-                list_white_top[n] = list_black_top[count]
-                count = count-1
-            return list_white_top
-        else:
-            return list_black_top
+        return fen_to_matrix(self.get_fen_position(), player_color)
 
     def get_player_turn_from_fen(self):
         """Gets current color for next turn out of FEN-Position
@@ -581,7 +694,7 @@ class ChessGameplay:
         """
         # rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1
         listing = []
-        position = self.engine.get_fen_position()
+        position = self.get_fen_position()
         for i, n in enumerate(position):
             if n == " ":
                 listing.append(i)
@@ -596,38 +709,16 @@ class ChessGameplay:
             Returns:
                 True, if state is "Remis", else False (for every remis possibility ordered as above)
         """
-        # rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1
-        amount = 1
-        position = self.engine.get_fen_position()
-        remis_by_half_moves = False
-        remis_by_triple_occurence = False
-        remis_by_stalemate = False
-        listing = []
-        for i, n in enumerate(position):
-            if n == " ":
-                listing.append(i)
-        count = int(position[listing[3] + 1:listing[4]])  # get number of half moves out of fen position (index from space 4)
-        fen_to_enpass = position[0:listing[3]]  # get situation from fen position
-        if self.overflow == fen_to_enpass:
-            pass
-        else:
-            self.overflow = fen_to_enpass
-            # Dictionary zum Zählen bereits vorhandener Spielsituationen
-            if fen_to_enpass in self.dict_fen_positions:
-                amount = int(self.dict_fen_positions.get(fen_to_enpass)) + 1
-                if amount >= 3:
-                    remis_by_triple_occurence = True
-                    logger.info(f'Game Status is Remis due to triple occurence')
-            self.dict_fen_positions[fen_to_enpass] = amount
-        # Aktuelle Halbspielzüge ohne Figurschlag oder Bauernzug aus FEN-Notation
-        if count >= 50:
-            remis_by_half_moves = True
+        # 50 Züge (100 Halbzüge) ohne Figurschlag oder Bauernzug
+        remis_by_half_moves = self.rules.is_fifty_moves()
+        if remis_by_half_moves is True:
             logger.info(f'Game Status is Remis due to count of half moves')
-
-        evaluation = self.engine.get_evaluation()
-        best_move = self.engine.get_best_move()
-        if evaluation['type'] == 'cp' and evaluation['value'] == 0 and best_move is None:
-            remis_by_stalemate = True
+        # Stellung zum dritten Mal seit dem letzten Setzen der FEN-Position
+        remis_by_triple_occurence = self.rules.is_repetition(3)
+        if remis_by_triple_occurence is True:
+            logger.info(f'Game Status is Remis due to triple occurence')
+        remis_by_stalemate = self.rules.is_stalemate()
+        if remis_by_stalemate is True:
             logger.info(f'Game Status is Remis due to stalemate')
         return remis_by_half_moves, remis_by_triple_occurence, remis_by_stalemate
 
@@ -645,45 +736,9 @@ class ChessGameplay:
         if midgame is True:
             fen_old = fen
         else:
-            fen_old = str(self.engine.get_fen_position())
+            fen_old = str(self.get_fen_position())
         logger.info(f'Original FEN-Position {fen_old}')
-        listing_first = []
-        for i, n in enumerate(fen_old):
-            if n == " ":
-                listing_first.append(i)
-        board_desc = fen_old[0:listing_first[0]]
-        board_desc = board_desc.replace(str(8), "........")
-        board_desc = board_desc.replace(str(7), ".......")
-        board_desc = board_desc.replace(str(6), "......")
-        board_desc = board_desc.replace(str(5), ".....")
-        board_desc = board_desc.replace(str(4), "....")
-        board_desc = board_desc.replace(str(3), "...")
-        board_desc = board_desc.replace(str(2), "..")
-        board_desc = board_desc.replace(str(1), ".")
-        board_desc = board_desc.replace("/", "")
-        mirrored_fen = ""
-        for i in range(1, 9):
-            for j in range(1,9):
-                mirrored_fen += board_desc[63-int(8*int(i)-int(j))]
-            if i != 8:
-                mirrored_fen += '/'
-        mirrored_fen = mirrored_fen.replace("........", str(8))
-        mirrored_fen = mirrored_fen.replace(".......", str(7))
-        mirrored_fen = mirrored_fen.replace("......", str(6))
-        mirrored_fen = mirrored_fen.replace(".....", str(5))
-        mirrored_fen = mirrored_fen.replace("....", str(4))
-        mirrored_fen = mirrored_fen.replace("...", str(3))
-        mirrored_fen = mirrored_fen.replace("..", str(2))
-        mirrored_fen = mirrored_fen.replace(".", str(1))
-        mirrored_fen += fen_old[listing_first[0]:]
-        ## mirror possible en-passant
-        listing = []
-        for i, n in enumerate(mirrored_fen):
-            if n == " ":
-                listing.append(i)
-        enpass = mirrored_fen[listing[2] + 1:listing[2] + 3]  # get en passent out of fen position (index from space 3)
-        enpass_mirr = self.mirrored_play([enpass])
-        mirrored_fen = mirrored_fen.replace(enpass, enpass_mirr[0])
+        mirrored_fen = mirror_fen(fen_old)
         logger.info(f'Mirrored FEN-Position {mirrored_fen}')
         return mirrored_fen
 
@@ -691,16 +746,16 @@ class ChessGameplay:
     def start_game(self, player_color: str):
         print(player_color)
         if player_color == 'w' or player_color == 'b':
-            self.engine.set_fen_position("rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1")
+            self.set_fen_position("rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1")
             image = self.get_drawing("", True, player_color)
-            print(self.engine.get_board_visual())
+            print(self.rules)
         else:
             print('No allowed player color')
         return image
     # not useful since it just shows how close a game is to checkmate
     def proof_white_in_chess(self):
         # Check for Status "White is close to Checkmate"
-        evaluation = self.engine.get_evaluation()
+        evaluation = self.analyse().score
         if evaluation['type'] == 'mate' and evaluation['value'] > 0:
             proof = True
         else:
@@ -709,7 +764,7 @@ class ChessGameplay:
     # not useful since it just shows how close a game is to checkmate
     def proof_black_in_chess(self):
         # Check for Status "Black is close to Checkmate"
-        evaluation = self.engine.get_evaluation()
+        evaluation = self.analyse().score
         if evaluation['type'] == 'mate' and evaluation['value'] < 0:
             proof = True
         else:
@@ -718,49 +773,10 @@ class ChessGameplay:
     # not necessary since object recognition is using a backward calculation and initials a beginning
     def set_matrix_to_fen(self, matrix, player_color, player_turn):
         #  Transform Matrix to fenPosition
-        if player_color == 'b':
-            matrix_mirrored = []
-            for m in reversed(matrix):
-                matrix_mirrored.extend([m])
-            matrix = matrix_mirrored
-        fen_string = ""
-        for l in range(0, 8):
-            for i in range(0, 8):
-                fen_string += str(matrix[l][i])
-            if l != 7:
-                fen_string += str("/")
-        fen_string = fen_string.replace("........", str(8))
-        fen_string = fen_string.replace(".......", str(7))
-        fen_string = fen_string.replace("......", str(6))
-        fen_string = fen_string.replace(".....", str(5))
-        fen_string = fen_string.replace("....", str(4))
-        fen_string = fen_string.replace("...", str(3))
-        fen_string = fen_string.replace("..", str(2))
-        fen_string = fen_string.replace(".", str(1))
-        fen_string += " "
-        fen_string += player_turn
-        fen_string += " "
-        rochade = ""
-        if matrix[0][4] == "K":
-            if matrix[0][7] == "R":
-                rochade += "K"
-            if matrix[0][0] == "R":
-                rochade += "Q"
-        if matrix[7][4] == "k":
-            if matrix[7][7] == "r":
-                rochade += "k"
-            if matrix[7][0] == "r":
-                rochade += "q"
-        if rochade == "":
-            rochade += "-"
-        fen_string += rochade
-        fen_string += " - "
-        fen_string += str(0)
-        fen_string += " "
-        fen_string += str(1)
+        fen_string = matrix_to_fen(matrix, player_color, player_turn)
         print(fen_string)
-        self.engine.set_fen_position(fen_string)
-        print(self.engine.get_board_visual())
+        self.set_fen_position(fen_string)
+        print(self.rules)
         image = self.get_drawing("", True, player_color)
         #if player_color != player_turn:
         return image #fen_string
@@ -783,14 +799,9 @@ class ChessGameplay:
             else:
                 pass
 
-            move = pd.DataFrame(columns=['from', 'to'])
             move_final = []
-            alphabet = ['a', 'b', 'c', 'd', 'e', 'f', 'g', 'h']
-            #  zahlen = [8, 7, 6, 5, 4, 3, 2, 1]
-            move_from = pd.DataFrame(columns=['from'])
-            move_to = pd.DataFrame(columns=['to'])
-            count_from = 0
-            count_to = 0
+            move_from = []
+            move_to = []
             movement_detected = 0
             colorchange_detected = 0  # matrix with distinction in colors
             count_N_before = 0
@@ -828,34 +839,25 @@ class ChessGameplay:
                     #  print(i, j)
                     #  Check for MovementFromPosition
                     if after[i][j] == '.' and before[i][j] != '.':
-                        number = i + 1
-                        letter = alphabet[j]
-                        #print(str(before[i][j]) + ' von ' + str(letter) + str(number))
-                        move_from.loc[count_from] = (str(letter) + str(number))
+                        #print(str(before[i][j]) + ' von ' + SQUARE_NAMES[i][j])
+                        move_from.append(SQUARE_NAMES[i][j])
                         #print(move_from)
-                        count_from = count_from + 1
                         movement_detected = movement_detected + 1
                         #print('Changes: ' + str(movement_detected + colorchange_detected))
                     #  Check for MovementToPosition
                     if before[i][j] == '.' and after[i][j] != '.':
-                        number = i + 1
-                        letter = alphabet[j]
-                        #print(str(after[i][j]) + ' nach ' + str(letter) + str(number))
-                        move_to.loc[count_to] = (str(letter) + str(number))
+                        #print(str(after[i][j]) + ' nach ' + SQUARE_NAMES[i][j])
+                        move_to.append(SQUARE_NAMES[i][j])
                         #print(move_to)
-                        count_to = count_to + 1
                         movement_detected = movement_detected + 1
                         #print('Changes: ' + str(movement_detected + colorchange_detected))
                     #  Check for ColorChange
                     if not after[i][j] == "." and not before[i][j] == ".":
                         if (str.isupper(after[i][j]) and str.islower(before[i][j])) or (
                                 str.islower(after[i][j]) and str.isupper(before[i][j])):
-                            number = i + 1
-                            letter = alphabet[j]
-                            #print(str(after[i][j]) + ' nach ' + str(letter) + str(number))
-                            move_to.loc[count_to] = (str(letter) + str(number))
-                            beaten = [str(letter) + str(number) + 'xx']
-                            count_to = count_to + 1
+                            #print(str(after[i][j]) + ' nach ' + SQUARE_NAMES[i][j])
+                            move_to.append(SQUARE_NAMES[i][j])
+                            beaten = [SQUARE_NAMES[i][j] + 'xx']
                             #print(move_to)
                             colorchange_detected = colorchange_detected + 1
                             #print('Changes: ' + str(movement_detected + colorchange_detected))
@@ -895,47 +897,32 @@ class ChessGameplay:
                         #print('Kurze schwarze Rochade')
 
             if movement_detected + colorchange_detected == 2:
-                move.loc[0] = [move_from['from'][0], move_to['to'][0]]
-                move_final = [move['from'][0] + move['to'][0]]
+                move = move_from[0] + move_to[0]
+                move_final = [move]
                 #  Bauernumwandlung
                 if (count_Q_after > count_Q_before):
-                    move.loc[0] = [move_from['from'][0], move_to['to'][0]]
-                    move_final = [move['from'][0] + move['to'][0] + 'Q']
-                    #  if player_color == 'w':
-                    #      move_final = move['from'][0] + move['to'][0] + 'q'
+                    move_final = [move + 'Q']
                 if (count_q_after > count_q_before):
-                    move.loc[0] = [move_from['from'][0], move_to['to'][0]]
-                    move_final = [move['from'][0] + move['to'][0] + 'q']
-                    #  if player_color == 'w':
-                    #      move_final = move['from'][0] + move['to'][0] + 'Q'
+                    move_final = [move + 'q']
                 if (count_N_after > count_N_before):
-                    move.loc[0] = [move_from['from'][0], move_to['to'][0]]
-                    move_final = [move['from'][0] + move['to'][0] + 'N']
-                    #  if player_color == 'w':
-                    #      move_final = move['from'][0] + move['to'][0] + 'n'
+                    move_final = [move + 'N']
                 if (count_n_after > count_n_before):
-                    move.loc[0] = [move_from['from'][0], move_to['to'][0]]
-                    move_final = [move['from'][0] + move['to'][0] + 'n']
-                    #  if player_color == 'w':
-                    #      move_final = move['from'][0] + move['to'][0] + 'N'
+                    move_final = [move + 'n']
             #  en-passant
             if movement_detected + colorchange_detected == 3:
-                if move_to['to'][0][0:1] == move_from['from'][0][0:1]:
-                    move_final = [move_from['from'][1] + move_to['to'][0], move_from['from'][0] + "xx"]
-                if move_to['to'][0][0:1] == move_from['from'][1][0:1]:
-                    move_final = [move_from['from'][0] + move_to['to'][0], move_from['from'][1] + "xx"]
+                if move_to[0][0:1] == move_from[0][0:1]:
+                    move_final = [move_from[1] + move_to[0], move_from[0] + "xx"]
+                if move_to[0][0:1] == move_from[1][0:1]:
+                    move_final = [move_from[0] + move_to[0], move_from[1] + "xx"]
             if movement_detected + colorchange_detected < 2:
-                #  print(move)
                 move_final = 0
                 print(
                     "Zug muss wiederholt werden, keine eindeutige Zuordnung des Zuges möglich. Erkannte Teilbewegungen: " + "Züge von einem Feld weg: " +
-                    move_from['from'] + "Züge zu einem Feld: " + move_to['to'])
+                    str(move_from) + " Züge zu einem Feld: " + str(move_to))
             if movement_detected + colorchange_detected >= 4 and move_final == []:
-                move.loc[0] = [move_from['from'][0], move_to['to'][0]]
-                move.loc[1] = [move_from['from'][1], move_to['to'][1]]
                 print(
                     "Zug muss wiederholt werden, keine eindeutige Zuordnung des Zuges möglich. Erkannte Teilbewegungen: " + "Züge von einem Feld weg: " +
-                    move_from['from'] + "Züge zu einem Feld: " + move_to['to'])
+                    str(move_from) + " Züge zu einem Feld: " + str(move_to))
                 #  move_final = 'No clear move without extra if-clause'
             if colorchange_detected > 0:
                 piece_capture = True
@@ -963,7 +950,7 @@ class ChessGameplay:
             print(self.engine.get_board_visual())
 
             print(self.engine.get_evaluation())
-            print(self.engine.get_fen_position())
+            print(self.get_fen_position())
             ki_in_chess = self.proof_white_in_chess()
 
             before = self.compute_matrix_from_fen()
@@ -975,7 +962,7 @@ class ChessGameplay:
             move_command = [best_move]
 
             print(self.engine.get_evaluation())
-            print(self.engine.get_fen_position())
+            print(self.get_fen_position())
             player_in_chess = self.proof_black_in_chess()
             #  auf Schachmatt des Spielers überprüfen
             best_move_opponent = self.engine.get_best_move()
@@ -1,20 +1,16 @@
 import chess
 import chess.engine
-import pandas as pd
+from chesster.Schach_KI.transforms import SQUARE_NAMES
 #from stockfish import Stockfish
 #stockfish = Stockfish("C:\\Users\\ywoda\\PycharmProjects\\Chesster\\chesster\\stockfish_14.1_win_x64_avx2.exe",
                       #parameters={"Threads": 4, "Minimum Thinking Time":30, "Skill Level": 50})
 
 #[Zeile1],[Zeile2] etc. aus Robotersicht betrachtet !
 def Matrixvergleich(before, after):
-    Move=pd.DataFrame(columns=['from','to'])
+    Move=[]
     MoveFinal=[]
-    alphabet=['a','b','c','d','e','f','g','h']
-    #zahlen=[8,7,6,5,4,3,2,1]
-    Movefrom=pd.DataFrame(columns=['from'])
-    Moveto=pd.DataFrame(columns=['to'])
-    countFrom=0
-    countTo=0
+    Movefrom=[]
+    Moveto=[]
     movementdetected=0
     colorchangedetected=0 #matrix with distinction in colors
     for i in range(0,8):
@@ -25,31 +21,22 @@ def Matrixvergleich(before, after):
                 #print(i,j)
 #Check for MovementFromPosition
             if after[i][j] == 0 and (before[i][j] =='W' or before[i][j] =='B'):
-                iPrint= i + 1
-                jPrint= alphabet[j]
-                print('ausgehende Position ist ' +str(jPrint) + str(iPrint))
-                Movefrom.loc[countFrom]  = (str(jPrint) + str(iPrint))
-                countFrom = countFrom + 1
+                print('ausgehende Position ist ' +SQUARE_NAMES[i][j])
+                Movefrom.append(SQUARE_NAMES[i][j])
                 print(Movefrom)
                 movementdetected = movementdetected + 1
                 print('Changes: ' + str(movementdetected+colorchangedetected))
 #Check for MovementToPosition
             if before[i][j] == 0 and (after[i][j] =='W' or after[i][j] =='B'):
-                iPrint = i + 1
-                jPrint = alphabet[j]
-                print('annehmende Position ist ' +str(jPrint) + str(iPrint))
-                Moveto.loc[countTo] = (str(jPrint) + str(iPrint))
-                countTo = countTo + 1
+                print('annehmende Position ist ' +SQUARE_NAMES[i][j])
+                Moveto.append(SQUARE_NAMES[i][j])
                 print(Moveto)
                 movementdetected = movementdetected + 1
                 print('Changes: ' + str(movementdetected+colorchangedetected))
 #Check for ColorChange
             if (after[i][j] == 'W' and before[i][j] =='B') or (after[i][j] == 'B' and before[i][j] =='W'):
-                iPrint = i + 1
-                jPrint = alphabet[j]
-                print('annehmende Position ist ' + str(jPrint) + str(iPrint))
-                Moveto.loc[countTo] = (str(jPrint) + str(iPrint))
-                countTo = countTo + 1
+                print('annehmende Position ist ' + SQUARE_NAMES[i][j])
+                Moveto.append(SQUARE_NAMES[i][j])
                 print(Moveto)
                 colorchangedetected = colorchangedetected + 1
                 print('Changes: ' + str(movementdetected+colorchangedetected))
@@ -83,14 +70,13 @@ def Matrixvergleich(before, after):
                 print('Kurze schwarze Rochade')
 
     if movementdetected + colorchangedetected == 2:
-        Move.loc[0]=[Movefrom['from'][0],Moveto['to'][0]]
-        MoveFinal = Move['from'][0] + Move['to'][0]
+        Move=[(Movefrom[0],Moveto[0])]
+        MoveFinal = Move[0][0] + Move[0][1]
     if movementdetected + colorchangedetected <2:
         print(Move)
         MoveFinal = 0
     if movementdetected + colorchangedetected > 2:
-        Move.loc[0] = [Movefrom['from'][0],Moveto['to'][0]]
-        Move.loc[1] = [Movefrom['from'][1],Moveto['to'][1]]
+        Move = [(Movefrom[0],Moveto[0]), (Movefrom[1],Moveto[1])]
         #MoveFinal = 'No clear move without extra if-clause'
     if colorchangedetected > 0:
         Figurschlag = True
@@ -102,14 +88,10 @@ def Matrixvergleich(before, after):
 
 #[Zeile1],[Zeile2] etc. aus Robotersicht betrachtet !
 def FullMatrixComp(before, after,player_color):
-    Move=pd.DataFrame(columns=['from','to'])
+    Move=[]
     MoveFinal=[]
-    alphabet=['a','b','c','d','e','f','g','h']
-    #zahlen=[8,7,6,5,4,3,2,1]
-    Movefrom=pd.DataFrame(columns=['from'])
-    Moveto=pd.DataFrame(columns=['to'])
-    countFrom=0
-    countTo=0
+    Movefrom=[]
+    Moveto=[]
     movementdetected=0
     colorchangedetected=0 #matrix with distinction in colors
     countNbefore=0
@@ -147,33 +129,24 @@ def FullMatrixComp(before, after,player_color):
                 #print(i,j)
 #Check for MovementFromPosition
             if after[i][j] == 0 and (type(before[i][j]) == str) :
-                iPrint= i + 1
-                jPrint= alphabet[j]
-                print(str(before[i][j]) + ' von ' + str(jPrint) + str(iPrint))
-                Movefrom.loc[countFrom]  = (str(jPrint) + str(iPrint))
-                countFrom = countFrom + 1
+                print(str(before[i][j]) + ' von ' + SQUARE_NAMES[i][j])
+                Movefrom.append(SQUARE_NAMES[i][j])
                 print(Movefrom)
                 movementdetected = movementdetected + 1
                 print('Changes: ' + str(movementdetected+colorchangedetected))
 #Check for MovementToPosition
             if before[i][j] == 0 and (type(after[i][j]) == str):
-                iPrint = i + 1
-                jPrint = alphabet[j]
-                print(str(after[i][j]) + ' nach ' + str(jPrint) + str(iPrint))
-                Moveto.loc[countTo] = (str(jPrint) + str(iPrint))
-                countTo = countTo + 1
+                print(str(after[i][j]) + ' nach ' + SQUARE_NAMES[i][j])
+                Moveto.append(SQUARE_NAMES[i][j])
                 print(Moveto)
                 movementdetected = movementdetected + 1
                 print('Changes: ' + str(movementdetected+colorchangedetected))
 #Check for ColorChange
             if not type(after[i][j]) == int and not type(before[i][j]) == int:
                 if (str.isupper(after[i][j]) and str.islower(before[i][j])) or (str.islower(after[i][j]) and str.isupper(before[i][j])):
-                    iPrint = i + 1
-                    jPrint = alphabet[j]
-                    print(str(after[i][j]) + ' nach ' + str(jPrint) + str(iPrint))
-                    Moveto.loc[countTo] = (str(jPrint) + str(iPrint))
-                    beaten = str(jPrint) + str(iPrint) + 'xx'
-                    countTo = countTo + 1
+                    print(str(after[i][j]) + ' nach ' + SQUARE_NAMES[i][j])
+                    Moveto.append(SQUARE_NAMES[i][j])
+                    beaten = SQUARE_NAMES[i][j] + 'xx'
                     print(Moveto)
                     colorchangedetected = colorchangedetected + 1
                     print('Changes: ' + str(movementdetected+colorchangedetected))
@@ -210,41 +183,36 @@ def FullMatrixComp(before, after,player_color):
 
     #ToDo: Bauerumwandlung wenn Spieler weiß (spielt in KI als Schwarz)
     if movementdetected + colorchangedetected == 2:
-        Move.loc[0]=[Movefrom['from'][0],Moveto['to'][0]]
-        MoveFinal = Move['from'][0] + Move['to'][0]
+        Move=[(Movefrom[0],Moveto[0])]
+        MoveFinal = Move[0][0] + Move[0][1]
         if (countQafter > countQbefore):
-            Move.loc[0] = [Movefrom['from'][0], Moveto['to'][0]]
-            MoveFinal = Move['from'][0] + Move['to'][0] + 'Q'
+            MoveFinal = Move[0][0] + Move[0][1] + 'Q'
             if player_color == 'w':
-                MoveFinal = Move['from'][0] + Move['to'][0] + 'q'
+                MoveFinal = Move[0][0] + Move[0][1] + 'q'
         if (countqafter > countqbefore):
-            Move.loc[0] = [Movefrom['from'][0], Moveto['to'][0]]
-            MoveFinal = Move['from'][0] + Move['to'][0] + 'q'
+            MoveFinal = Move[0][0] + Move[0][1] + 'q'
             if player_color == 'w':
-                MoveFinal = Move['from'][0] + Move['to'][0] + 'Q'
+                MoveFinal = Move[0][0] + Move[0][1] + 'Q'
         if (countNafter > countNbefore):
-            Move.loc[0] = [Movefrom['from'][0], Moveto['to'][0]]
-            MoveFinal = Move['from'][0] + Move['to'][0] + 'N'
+            MoveFinal = Move[0][0] + Move[0][1] + 'N'
             if player_color == 'w':
-                MoveFinal = Move['from'][0] + Move['to'][0] + 'n'
+                MoveFinal = Move[0][0] + Move[0][1] + 'n'
         if (countnafter > countnbefore):
-            Move.loc[0] = [Movefrom['from'][0], Moveto['to'][0]]
-            MoveFinal = Move['from'][0] + Move['to'][0] + 'n'
+            MoveFinal = Move[0][0] + Move[0][1] + 'n'
             if player_color == 'w':
-                MoveFinal = Move['from'][0] + Move['to'][0] + 'N'
+                MoveFinal = Move[0][0] + Move[0][1] + 'N'
     if movementdetected + colorchangedetected == 3: #en-passant
-        if Moveto['to'][0][0:1] == Movefrom['from'][0][0:1]:
-            MoveFinal=[Movefrom['from'][1] + Moveto['to'][0], Movefrom['from'][0]+"xx"]
-        if Moveto['to'][0][0:1] == Movefrom['from'][1][0:1]:
-            MoveFinal=[Movefrom['from'][0] + Moveto['to'][0], Movefrom['from'][1]+"xx"]
+        if Moveto[0][0:1] == Movefrom[0][0:1]:
+            MoveFinal=[Movefrom[1] + Moveto[0], Movefrom[0]+"xx"]
+        if Moveto[0][0:1] == Movefrom[1][0:1]:
+            MoveFinal=[Movefrom[0] + Moveto[0], Movefrom[1]+"xx"]
         #else:
             #Zug wiederholen
     if movementdetected + colorchangedetected <2:
         #print(Move)
         MoveFinal = 0
     if movementdetected + colorchangedetected >= 4:
-        Move.loc[0] = [Movefrom['from'][0],Moveto['to'][0]]
-        Move.loc[1] = [Movefrom['from'][1],Moveto['to'][1]]
+        Move = [(Movefrom[0],Moveto[0]), (Movefrom[1],Moveto[1])]
         #MoveFinal = 'No clear move without extra if-clause'
     if colorchangedetected > 0:
         Figurschlag = True
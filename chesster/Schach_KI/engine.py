@@ -0,0 +1,214 @@
+import os
+import shlex
+import shutil
+import logging
+import threading
+from typing import Dict, List, Optional, Tuple, Union
+
+import chess.engine
+
+logger = logging.getLogger(__name__)
+
+# Stockfish-Binary, das neben diesem Modul abgelegt werden kann (Windows-Rechner am Roboter)
+BUNDLED_ENGINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'stockfish_14.1_win_x64_avx2.exe')
+ENGINE_NAMES = ['stockfish', 'stockfish.exe']
+ENGINE_DIRECTORIES = ['/usr/games', '/usr/local/bin', '/opt/homebrew/bin']
+
+
+def find_engine(engine_path: Optional[Union[str, List[str]]] = None) -> Union[str, List[str]]:
+    """Finds the UCI engine: given path, environment variable STOCKFISH_PATH, bundled binary, PATH, usual directories
+
+    A path (given or STOCKFISH_PATH) that is not a file is taken as command line, e.g.
+    "python -m chesster.Schach_KI.mock_engine --latency 0.05". If it cannot be found, the engine is searched as without
+    configuration.
+
+    Args:
+        engine_path: path or command (list) of the engine
+    Returns:
+        path or command of the engine for python-chess
+    """
+    if isinstance(engine_path, (list, tuple)):
+        return list(engine_path)
+    configured = engine_path or os.environ.get('STOCKFISH_PATH')
+    if configured:
+        if os.path.isfile(configured):
+            return configured
+        command = shlex.split(configured, posix=os.name != 'nt')
+        if command and shutil.which(command[0]) is not None:
+            return command if len(command) > 1 else shutil.which(command[0])
+        logger.warning(f'Chess engine {configured} not found, searching for an installed engine')
+    candidates = [BUNDLED_ENGINE] + [shutil.which(name) for name in ENGINE_NAMES] + \
+                 [os.path.join(directory, name) for directory in ENGINE_DIRECTORIES for name in ENGINE_NAMES]
+    for candidate in candidates:
+        if candidate and os.path.isfile(candidate):
+            return candidate
+    raise FileNotFoundError('No chess engine found, install Stockfish or set STOCKFISH_PATH')
+
+
+def host_memory() -> Optional[int]:
+    """Physical memory of the host in bytes, None if unknown"""
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    except (AttributeError, ValueError, OSError):
+        pass
+    try:
+        import ctypes
+
+        class MemoryStatus(ctypes.Structure):
+            _fields_ = [('dwLength', ctypes.c_ulong), ('dwMemoryLoad', ctypes.c_ulong),
+                        ('ullTotalPhys', ctypes.c_ulonglong), ('ullAvailPhys', ctypes.c_ulonglong),
+                        ('ullTotalPageFile', ctypes.c_ulonglong), ('ullAvailPageFile', ctypes.c_ulonglong),
+                        ('ullTotalVirtual', ctypes.c_ulonglong), ('ullAvailVirtual', ctypes.c_ulonglong),
+                        ('sullAvailExtendedVirtual', ctypes.c_ulonglong)]
+
+        status = MemoryStatus()
+        status.dwLength = ctypes.sizeof(MemoryStatus)
+        if ctypes.windll.kernel32.GlobalMemoryStatusEx(ctypes.byref(status)):
+            return status.ullTotalPhys
+    except (AttributeError, OSError):
+        pass
+    return None
+
+
+def host_options(engines=1) -> Dict[str, int]:
+    """Threads and Hash of an engine tuned to the host
+
+    All cores but one (vision, robot and GUI) and 1/16 of the memory (16 MB to 1024 MB) are shared by the engine
+    processes searching at the same time (e.g. 2 with pondering).
+
+    Args:
+        engines: number of engine processes searching at the same time
+    Returns:
+        {'Threads': threads, 'Hash': MB}
+    """
+    threads = max(1, ((os.cpu_count() or 2) - 1) // engines)
+    memory = host_memory()
+    hash_size = 256 if memory is None else min(max(memory // 2 ** 20 // 16, 16), 1024)
+    return {'Threads': threads, 'Hash': max(16, hash_size // engines)}
+
+
+class EngineManager:
+    """Keeps the UCI engine processes running for the life of the application and lends them to the games
+
+    Engines are kept per configuration: engine command and the options that are costly to change (Threads, Hash:
+    thread pool and hash table are allocated by the engine). The other options (e.g. Skill Level) are set every time an
+    engine is lent. A game on a lent engine starts with ucinewgame (game of the search in python-chess) and its own
+    position, so start-up, network loading and hash allocation are only paid once per configuration.
+    """
+
+    SETUP_OPTIONS = ('Threads', 'Hash')
+
+    def __init__(self):
+        self.__lock = threading.Lock()
+        # Freie Engines je Konfiguration und verliehene Engines mit ihrer Konfiguration
+        self.__idle: Dict[Tuple, List[chess.engine.SimpleEngine]] = {}
+        self.__lent: Dict[int, Tuple[Tuple, chess.engine.SimpleEngine]] = {}
+        self.__watcher: Optional[threading.Thread] = None
+        self.started = 0
+
+    @classmethod
+    def __key(cls, engine_path: Union[str, List[str]], options: Dict) -> Tuple:
+        command = tuple(engine_path) if isinstance(engine_path, (list, tuple)) else (engine_path,)
+        return command, tuple(sorted((name, options[name]) for name in cls.SETUP_OPTIONS if name in options))
+
+    @staticmethod
+    def __configure(engine: chess.engine.SimpleEngine, options: Dict):
+        # Nur bekannte und nicht von python-chess verwaltete Optionen, Zahlen auf den Bereich der Engine begrenzt
+        config = {}
+        for name, value in options.items():
+            option = engine.options.get(name)
+            if option is None or option.is_managed():
+                continue
+            if option.type == 'spin':
+                value = min(max(value, option.min), option.max)
+            config[name] = value
+        engine.configure(config)
+
+    def acquire(self, engine_path: Union[str, List[str]], options: Optional[Dict] = None) -> chess.engine.SimpleEngine:
+        """Lends a running engine of the configuration, starts one if none is free
+
+        Args:
+            engine_path: path or command of the engine (find_engine)
+            options: UCI options, e.g. {'Threads': 4, 'Hash': 256, 'Skill Level': 10}
+        Returns:
+            engine, to be given back with release
+        """
+        options = options or {}
+        key = self.__key(engine_path, options)
+        engine = None
+        while engine is None:
+            with self.__lock:
+                idle = self.__idle.get(key)
+                engine = idle.pop() if idle else None
+            if engine is None:
+                engine = chess.engine.SimpleEngine.popen_uci(engine_path)
+                self.started += 1
+                self.__close_at_exit()
+                logger.info(f'Started chess engine {engine.id.get("name", engine_path)} with {dict(key[1])}')
+                break
+            try:
+                engine.ping()
+            except chess.engine.EngineError:
+                logger.warning('Chess engine terminated, starting a new one')
+                engine = None
+        self.__configure(engine, options)
+        with self.__lock:
+            self.__lent[id(engine)] = key, engine
+        return engine
+
+    def __close_at_exit(self):
+        # Die Engine-Threads von python-chess halten das Programmende auf (atexit kommt erst danach), daher werden die
+        # Engines geschlossen, sobald der Hauptthread endet
+        with self.__lock:
+            if self.__watcher is not None:
+                return
+            self.__watcher = threading.Thread(target=self.__close_after_main, name='engine-manager', daemon=True)
+        self.__watcher.start()
+
+    def __close_after_main(self):
+        threading.main_thread().join()
+        self.close()
+
+    def release(self, engine: chess.engine.SimpleEngine):
+        """Gives a lent engine back, it stays running for the next game (no search may be running)"""
+        with self.__lock:
+            lent = self.__lent.pop(id(engine), None)
+            if lent is not None:
+                self.__idle.setdefault(lent[0], []).append(engine)
+                return
+        engine.quit()
+
+    def warm_up(self, engine_path: Optional[Union[str, List[str]]] = None, options: Optional[Dict] = None, engines=1):
+        """Starts engines of a configuration ahead of the first game, e.g. in a thread at application start
+
+        Args:
+            engine_path: path or command of the engine, found with find_engine if None
+            options: UCI options, default host_options
+            engines: number of engines (2 with pondering)
+        """
+        try:
+            engine_path = find_engine(engine_path)
+        except FileNotFoundError as error:
+            logger.warning(f'No chess engine to warm up: {error}')
+            return
+        options = options or host_options(engines)
+        lent = [self.acquire(engine_path, options) for _ in range(engines)]
+        for engine in lent:
+            self.release(engine)
+
+    def close(self):
+        """Quits all engines (also lent ones), at the end of the application"""
+        with self.__lock:
+            engines = [engine for idle in self.__idle.values() for engine in idle]
+            engines += [engine for _, engine in self.__lent.values()]
+            self.__idle.clear()
+            self.__lent.clear()
+        for engine in engines:
+            try:
+                engine.quit()
+            except chess.engine.EngineError:
+                pass
+
+
+# Engines der Anwendung, beim Beenden geschlossen
+engine_manager = EngineManager()
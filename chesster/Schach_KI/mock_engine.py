@@ -0,0 +1,182 @@
+"""Scripted UCI stand-in for Stockfish with configurable latency, for tests and benchmarks without a real engine
+
+Run as python -m chesster.Schach_KI.mock_engine [--latency SECONDS] [--depth N] [--script FILE].
+The moves are deterministic: scripted moves first (JSON file {FEN or EPD: uci-move}), then the moves ordered by a
+material count. Every search reports info lines for depth 1..N spread over the search time.
+"""
+import json
+import os
+import sys
+import threading
+import time
+from typing import Dict, List, Optional, Sequence
+
+import chess
+import click
+
+VALUES = {chess.PAWN: 100, chess.KNIGHT: 300, chess.BISHOP: 300, chess.ROOK: 500, chess.QUEEN: 900, chess.KING: 0}
+OPTIONS = ['option name Threads type spin default 1 min 1 max 512',
+           'option name Hash type spin default 16 min 1 max 33554432',
+           'option name MultiPV type spin default 1 min 1 max 500',
+           'option name Ponder type check default false',
+           'option name Skill Level type spin default 20 min 0 max 20',
+           'option name UCI_LimitStrength type check default false',
+           'option name UCI_Elo type spin default 1350 min 1350 max 2850',
+           'option name Minimum Thinking Time type spin default 20 min 0 max 5000',
+           'option name SyzygyPath type string default <empty>']
+
+
+def mock_engine_command(latency: Optional[float] = None, depth=5, script: Optional[str] = None) -> List[str]:
+    """Command line to start the mock engine, e.g. as engine path of ChessGameplay"""
+    # Start über den Dateipfad, damit das Paket nicht installiert sein und kein Arbeitsverzeichnis stimmen muss
+    command = [sys.executable, os.path.abspath(__file__), '--depth', str(depth)]
+    if latency is not None:
+        command += ['--latency', str(latency)]
+    if script is not None:
+        command += ['--script', str(script)]
+    return command
+
+
+def material(board: chess.Board, color: chess.Color) -> int:
+    return sum(VALUES[piece.piece_type] * (1 if piece.color == color else -1) for piece in board.piece_map().values())
+
+
+class MockEngine:
+    def __init__(self, latency: Optional[float] = None, depth=5, script: Optional[Dict[str, str]] = None, out=None):
+        """
+        Args:
+            latency: duration of every search in seconds, None to use movetime of the go command
+            depth: number of reported search depths
+            script: moves by position (EPD)
+            out: output stream (stdout)
+        """
+        self.latency = latency
+        self.depth = depth
+        self.script = {' '.join(key.split()[:4]): move for key, move in (script or {}).items()}
+        self.out = out or sys.stdout
+        self.options = {}
+        self.board = chess.Board()
+        self.__stop = threading.Event()
+        self.__ponderhit = threading.Event()
+        self.__search: Optional[threading.Thread] = None
+        self.__out_lock = threading.Lock()
+
+    def send(self, line: str):
+        with self.__out_lock:
+            self.out.write(line + '\n')
+            self.out.flush()
+
+    def lines(self, board: chess.Board) -> List[dict]:
+        """Ranked moves of the position: scripted move first, then by material after the move"""
+        scored = []
+        for move in board.legal_moves:
+            board.push(move)
+            if board.is_checkmate():
+                score = ('mate', 1)
+            else:
+                score = ('cp', -material(board, board.turn))
+            reply = next(iter(sorted(board.legal_moves, key=chess.Move.uci)), None)
+            board.pop()
+            scored.append({'move': move, 'score': score, 'reply': reply})
+        scripted = self.script.get(board.epd())
+        scored.sort(key=lambda line: (line['move'].uci() != scripted, line['score'][0] != 'mate',
+                                      -line['score'][1], line['move'].uci()))
+        return scored
+
+    def search(self, board: chess.Board, duration: Optional[float]):
+        lines = self.lines(board)
+        if not lines:
+            self.send('info depth 0 score mate 0' if board.is_checkmate() else 'info depth 0 score cp 0')
+            self.send('bestmove (none)')
+            return
+        multipv = int(self.options.get('multipv', 1))
+        # Unbegrenzte Suche (infinite, ponder): Tiefen im Takt der Latenz melden, dann bis stop bzw. ponderhit warten
+        step = (duration if duration is not None else (self.latency or 0.01)) / self.depth
+        start = time.perf_counter()
+        for depth in range(1, self.depth + 1):
+            if self.__stop.wait(max(0.0, start + step * depth - time.perf_counter())):
+                break
+            for rank, line in enumerate(lines[:multipv], 1):
+                pv = line['move'].uci() + ('' if line['reply'] is None else ' ' + line['reply'].uci())
+                self.send(f'info depth {depth} multipv {rank} score {line["score"][0]} {line["score"][1]} '
+                          f'nodes {1000 * depth} pv {pv}')
+        if duration is None:
+            while not self.__stop.is_set() and not self.__ponderhit.is_set():
+                self.__stop.wait(0.001)
+        best = lines[0]
+        self.send(f'bestmove {best["move"].uci()}' + ('' if best['reply'] is None else f' ponder {best["reply"].uci()}'))
+
+    def go(self, tokens: Sequence[str]):
+        self.stop()
+        self.__stop.clear()
+        self.__ponderhit.clear()
+        if 'infinite' in tokens or 'ponder' in tokens:
+            duration = None
+        elif self.latency is not None:
+            duration = self.latency
+        elif 'movetime' in tokens:
+            duration = int(tokens[tokens.index('movetime') + 1]) / 1000
+        else:
+            duration = 0.0
+        self.__search = threading.Thread(target=self.search, args=(self.board.copy(), duration), daemon=True)
+        self.__search.start()
+
+    def stop(self):
+        if self.__search is not None:
+            self.__stop.set()
+            self.__search.join()
+            self.__search = None
+
+    def position(self, tokens: Sequence[str]):
+        moves = tokens.index('moves') if 'moves' in tokens else len(tokens)
+        self.board = chess.Board() if tokens[1] == 'startpos' else chess.Board(' '.join(tokens[2:moves]))
+        for move in tokens[moves + 1:]:
+            self.board.push_uci(move)
+
+    def run(self, stream=None):
+        for line in stream or sys.stdin:
+            tokens = line.split()
+            if not tokens:
+                continue
+            command = tokens[0]
+            if command == 'uci':
+                self.send('id name Chesster Mock Engine')
+                self.send('id author Chesster')
+                for option in OPTIONS:
+                    self.send(option)
+                self.send('uciok')
+            elif command == 'isready':
+                self.send('readyok')
+            elif command == 'setoption' and 'name' in tokens:
+                value = tokens.index('value') if 'value' in tokens else len(tokens)
+                name = ' '.join(tokens[tokens.index('name') + 1:value]).lower()
+                self.options[name] = ' '.join(tokens[value + 1:])
+            elif command == 'ucinewgame':
+                self.board = chess.Board()
+            elif command == 'position':
+                self.position(tokens)
+            elif command == 'go':
+                self.go(tokens)
+            elif command == 'ponderhit':
+                self.__ponderhit.set()
+            elif command == 'stop':
+                self.stop()
+            elif command == 'quit':
+                break
+        self.stop()
+
+
+@click.command()
+@click.option('--latency', type=float, default=None, help='duration of every search in seconds (default: movetime)')
+@click.option('--depth', type=int, default=5, help='number of reported search depths')
+@click.option('--script', type=click.Path(exists=True), default=None,
+              help='JSON file with moves by position {FEN: uci-move}')
+def main(latency, depth, script):
+    if script is not None:
+        with open(script) as source:
+            script = json.load(source)
+    MockEngine(latency, depth, script).run()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+import chess
+import sqlite3
+import threading
+import time
+import logging
+from pathlib import Path
+from typing import Optional, Tuple, Union
+
+logger = logging.getLogger(__name__)
+
+
+class MoveCache:
+    """Persistent cache of engine moves keyed by position, engine settings and search limits (SQLite, LRU eviction)
+
+    The position is stored without move counters (EPD), so the same position reached in another game or by another
+    move order is a hit. If the cache grows beyond max_entries, the least recently used entries are deleted.
+    """
+
+    def __init__(self, path: Union[str, Path], max_entries=100000):
+        """
+        Args:
+            path: SQLite database file, created if missing
+            max_entries: maximum number of cached positions
+        """
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.__lock = threading.Lock()
+        self.__connection = sqlite3.connect(str(self.path), check_same_thread=False)
+        self.__connection.execute('PRAGMA journal_mode=WAL')
+        self.__connection.execute('CREATE TABLE IF NOT EXISTS moves (position TEXT, settings TEXT, limits TEXT, '
+                                  'move TEXT, ponder TEXT, last_used REAL, PRIMARY KEY (position, settings, limits))')
+        self.__connection.execute('CREATE INDEX IF NOT EXISTS moves_last_used ON moves (last_used)')
+        self.__connection.commit()
+        self.__inserts = 0
+
+    def get(self, board: chess.Board, settings: str, limits: str) -> Optional[Tuple[str, Optional[str]]]:
+        """Gets a cached move
+
+        Args:
+            board: position (engine to move)
+            settings: engine settings the move was computed with (e.g. skill level)
+            limits: search limits the move was computed with
+        Returns:
+            uci-string of the move and of the expected reply (or None), None if not cached
+        """
+        key = (board.epd(), settings, limits)
+        with self.__lock:
+            row = self.__connection.execute('SELECT move, ponder FROM moves WHERE position=? AND settings=? AND '
+                                            'limits=?', key).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.__connection.execute('UPDATE moves SET last_used=? WHERE position=? AND settings=? AND limits=?',
+                                      (time.time(), *key))
+            self.__connection.commit()
+            self.hits += 1
+        return row[0], row[1]
+
+    def put(self, board: chess.Board, settings: str, limits: str, move: str, ponder: Optional[str] = None):
+        """Stores a move computed by the engine
+
+        Args:
+            board: position (engine to move)
+            settings: engine settings the move was computed with
+            limits: search limits the move was computed with
+            move: uci-string of the move
+            ponder: uci-string of the expected reply
+        """
+        with self.__lock:
+            self.__connection.execute('INSERT OR REPLACE INTO moves VALUES (?, ?, ?, ?, ?, ?)',
+                                      (board.epd(), settings, limits, move, ponder, time.time()))
+            self.__inserts += 1
+            # Verdrängung nicht bei jedem Eintrag prüfen
+            if self.__inserts % 100 == 0:
+                self.__evict()
+            self.__connection.commit()
+
+    def __evict(self):
+        count = self.__connection.execute('SELECT COUNT(*) FROM moves').fetchone()[0]
+        if count > self.max_entries:
+            self.__connection.execute('DELETE FROM moves WHERE rowid IN (SELECT rowid FROM moves ORDER BY last_used '
+                                      'LIMIT ?)', (count - self.max_entries,))
+            logger.info(f'Evicted {count - self.max_entries} positions from the move cache')
+
+    def __len__(self):
+        with self.__lock:
+            return self.__connection.execute('SELECT COUNT(*) FROM moves').fetchone()[0]
+
+    def close(self):
+        with self.__lock:
+            self.__evict()
+            self.__connection.commit()
+            self.__connection.close()
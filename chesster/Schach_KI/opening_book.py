@@ -0,0 +1,43 @@
+import chess
+import chess.polyglot
+import random
+import logging
+from pathlib import Path
+from typing import Optional, Union
+
+logger = logging.getLogger(__name__)
+
+
+class OpeningBook:
+    """Polyglot opening book (.bin), book moves are chosen randomly by their weights for some variety"""
+
+    def __init__(self, path: Union[str, Path], max_ply=20, seed=None):
+        """
+        Args:
+            path: Polyglot book file
+            max_ply: the book is only used for the first max_ply half moves of the game
+            seed: seed of the random choice between book moves
+        """
+        self.path = Path(path)
+        self.max_ply = max_ply
+        self.reader = chess.polyglot.open_reader(str(self.path))
+        self.random = random.Random(seed)
+        logger.info(f'Opening book loaded from {self.path}')
+
+    def move(self, board: chess.Board) -> Optional[chess.Move]:
+        """Gets a book move for the position
+
+        Args:
+            board: position (engine to move)
+        Returns:
+            book move, None if the position is not in the book
+        """
+        if board.ply() >= self.max_ply:
+            return None
+        try:
+            return self.reader.weighted_choice(board, random=self.random).move
+        except IndexError:
+            return None
+
+    def close(self):
+        self.reader.close()
@@ -0,0 +1,118 @@
+import chess
+import chess.engine
+from chesster.Schach_KI.analysis import Analysis
+import logging
+import threading
+import time
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+
+class PonderingEngine:
+    """UCI engine that searches the expected reply of the human while the human thinks
+
+    After every robot move the position after the expected human reply (ponder move of the last search) is analysed in
+    the background. If the human plays this move (ponderhit), the robot answer is taken from the running or finished
+    analysis, otherwise the analysis is cancelled and the position has to be searched regularly.
+    """
+
+    def __init__(self, engine: chess.engine.SimpleEngine, move_time: float = 0.01, ponder_time: Optional[float] = None,
+                 multipv=3):
+        """
+        Args:
+            engine: second UCI engine process (e.g. Stockfish from EngineManager), configured like the main engine
+            move_time: search time of a regular search in seconds
+            ponder_time: maximum search time while pondering in seconds, the search stops earlier at a ponderhit
+            multipv: number of lines of the ponder analysis
+        """
+        self.engine = engine
+        self.move_time = move_time
+        self.ponder_time = ponder_time if ponder_time is not None else max(10 * move_time, 1.0)
+        self.multipv = multipv
+        self.__lock = threading.Lock()
+        self.__analysis: Optional[chess.engine.SimpleAnalysisResult] = None
+        self.__ponder_position = None
+        self.__ponder_start = 0.0
+        self.ponderhits = 0
+        self.misses = 0
+        # Partie der Suchen, bei einer neuen Partie sendet python-chess ucinewgame
+        self.game = None
+
+    @staticmethod
+    def __key(board: chess.Board):
+        # Stellung ohne Zugzähler, gleiche Stellung unabhängig vom Weg dorthin
+        return board.epd()
+
+    def start(self, board: chess.Board, expected_move: Optional[chess.Move]):
+        """Starts pondering on the position after the expected move of the opponent
+
+        Args:
+            board: current position (opponent to move)
+            expected_move: expected move of the opponent, no pondering if None or illegal
+        """
+        self.cancel()
+        if expected_move is None or expected_move not in board.legal_moves:
+            return
+        position = board.copy()
+        position.push(expected_move)
+        if position.is_game_over():
+            return
+        with self.__lock:
+            self.__ponder_position = self.__key(position)
+            self.__ponder_start = time.perf_counter()
+            self.__analysis = self.engine.analysis(position, chess.engine.Limit(time=self.ponder_time),
+                                                   multipv=self.multipv, game=self.game,
+                                                   info=chess.engine.INFO_SCORE | chess.engine.INFO_PV)
+        logger.info(f'Pondering on expected move {expected_move.uci()}')
+
+    def opponent_moved(self, board: chess.Board):
+        """Cancels pondering if the opponent did not play the expected move
+
+        Args:
+            board: position after the move of the opponent
+        """
+        with self.__lock:
+            expected = self.__analysis is None or self.__ponder_position == self.__key(board)
+        if not expected:
+            logger.info('Opponent did not play the expected move, pondering cancelled')
+            self.cancel()
+
+    def cancel(self):
+        """Stops a running ponder search, e.g. if the opponent played another move or a new position is set"""
+        with self.__lock:
+            analysis, self.__analysis, self.__ponder_position = self.__analysis, None, None
+        if analysis is not None:
+            analysis.stop()
+            try:
+                analysis.wait()
+            except chess.engine.AnalysisComplete:
+                pass
+
+    def ponderhit(self, board: chess.Board) -> Optional[Analysis]:
+        """Gets the analysis of the ponder search if the position was expected
+
+        Args:
+            board: current position (engine to move)
+        Returns:
+            Analysis of the position, None if the opponent did not play the expected move
+        """
+        with self.__lock:
+            analysis = self.__analysis if self.__ponder_position == self.__key(board) else None
+        if analysis is not None:
+            # Ponderhit: das Ergebnis liegt bereits vor oder die Suche läuft seit dem Zug des Roboters
+            # Mindestens so lange wie eine reguläre Suche rechnen lassen
+            remaining = self.move_time - (time.perf_counter() - self.__ponder_start)
+            if remaining > 0:
+                time.sleep(remaining)
+            analysis.stop()
+            result = analysis.wait()
+            with self.__lock:
+                self.__analysis, self.__ponder_position = None, None
+            if result.move is not None and result.move in board.legal_moves:
+                self.ponderhits += 1
+                logger.info(f'Ponderhit, best move {result.move.uci()}')
+                return Analysis.from_search(board, result, analysis.multipv)
+        self.cancel()
+        self.misses += 1
+        return None
@@ -0,0 +1,99 @@
+import chess
+import chess.syzygy
+from chesster.Schach_KI.analysis import Analysis
+import logging
+import threading
+from typing import List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Bewertung eines Tablebase-Gewinns in Centipawns (wie Stockfish), abzüglich der Halbzüge bis zum Zurücksetzen des
+# Zugzählers, ein Matt in 1 wird als Matt gemeldet
+TB_WIN = 20000
+
+
+class Tablebase:
+    """Syzygy endgame tablebases from a local directory, perfect moves for positions with few pieces without a search
+
+    The moves are ranked by their result (win, draw, loss under the 50-move rule) and the distance to zeroing (DTZ):
+    a won position is converted as fast as possible, a lost position is defended as long as possible. Positions with
+    castling rights, more pieces than the tables or without the needed table files are not probed.
+    """
+
+    def __init__(self, path: str, max_pieces: Optional[int] = None):
+        """
+        Args:
+            path: directory of the Syzygy table files (*.rtbw, *.rtbz)
+            max_pieces: maximal number of pieces (kings included) of a probed position, default largest table
+        """
+        self.tablebase = chess.syzygy.open_tablebase(path)
+        # Tabellenname wie KQvKR: Anzahl der Figuren = Buchstaben ohne "v"
+        largest = max((len(name) - 1 for name in self.tablebase.dtz), default=0)
+        self.max_pieces = largest if max_pieces is None else min(max_pieces, largest)
+        self.probes = 0
+        self.__lock = threading.Lock()
+        logger.info(f'Syzygy tablebase {path} with up to {self.max_pieces} pieces')
+
+    def covers(self, board: chess.Board) -> bool:
+        """Checks if a position can be probed (number of pieces, no castling rights)"""
+        return chess.popcount(board.occupied) <= self.max_pieces and not board.castling_rights
+
+    def __rank(self, board: chess.Board) -> List[Tuple[tuple, chess.Move, dict]]:
+        # Alle legalen Züge mit Rangschlüssel (größer ist besser) und Bewertung aus Sicht von Weiß
+        sign = 1 if board.turn == chess.WHITE else -1
+        ranked = []
+        for move in board.legal_moves:
+            board.push(move)
+            try:
+                if board.is_checkmate():
+                    key, score = (3, 0), {'type': 'mate', 'value': sign}
+                else:
+                    wdl = -self.tablebase.probe_wdl(board)
+                    # Züge bis zum Zurücksetzen des Zugzählers, ein Schlag oder Bauernzug setzt sofort zurück
+                    distance = 1 if board.halfmove_clock == 0 else abs(self.tablebase.probe_dtz(board)) + 1
+                    if wdl > 0:
+                        key = (wdl, -distance)
+                    elif wdl < 0:
+                        key = (wdl, distance)
+                    else:
+                        key = (0, 0)
+                    value = TB_WIN - distance if wdl == 2 else -(TB_WIN - distance) if wdl == -2 else 0
+                    score = {'type': 'cp', 'value': sign * value}
+            finally:
+                board.pop()
+            ranked.append((key, move, score))
+        ranked.sort(key=lambda line: (line[0], line[1].uci()), reverse=True)
+        return ranked
+
+    def probe(self, board: chess.Board, multipv=3) -> Optional[Analysis]:
+        """Gets the tablebase analysis of a position
+
+        Args:
+            board: position
+            multipv: number of lines (alternatives)
+        Returns:
+            Analysis with the perfect move and the expected reply, None if the position is not in the tablebase
+        """
+        if not self.covers(board) or not any(board.legal_moves):
+            return None
+        position = board.copy(stack=False)
+        try:
+            with self.__lock:
+                ranked = self.__rank(position)
+                best = ranked[0][1]
+                position.push(best)
+                replies = self.__rank(position) if any(position.legal_moves) else []
+                self.probes += 1
+        except KeyError:
+            # Tabelle fehlt im Verzeichnis (MissingTableError)
+            return None
+        ponder = replies[0][1].uci() if replies else None
+        lines = [{'move': move.uci(), 'score': score, 'pv': [move.uci()] + ([ponder] if move == best and ponder else [])}
+                 for _, move, score in ranked[:multipv]]
+        analysis = Analysis(board.fen(), best.uci(), ponder, lines)
+        analysis.tablebase = True
+        logger.info(f'Tablebase move {best.uci()}, score {lines[0]["score"]}')
+        return analysis
+
+    def close(self):
+        self.tablebase.close()
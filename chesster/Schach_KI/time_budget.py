@@ -0,0 +1,134 @@
+import chess
+from chesster.Schach_KI.analysis import Analysis
+import logging
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+def is_sharp(board: chess.Board, analysis: Analysis, margin=100) -> bool:
+    """Checks if a position needs a longer search: check, a mate in the lines or only one good move
+
+    Args:
+        board: position (engine to move)
+        analysis: analysis of the position at the base search time
+        margin: evaluation gap in centipawns between the best and the second best line
+    Returns:
+        True, if the search should be extended
+    """
+    if board.is_check():
+        return True
+    if any(line['score']['type'] == 'mate' for line in analysis.lines):
+        return True
+    if len(analysis.lines) >= 2:
+        return abs(analysis.lines[0]['score']['value'] - analysis.lines[1]['score']['value']) >= margin
+    return False
+
+
+class TurnBudget:
+    """Latency budget of a robot turn, split into vision, engine search and robot motion
+
+    A turn runs from the detection of the player move to the verified robot move. The engine gets the time that is left
+    after the vision already spent and the expected time of robot motion and verification (learned from the previous
+    turns). The search runs for a base time depending on the engine strength and is only extended up to the time left
+    if the position is sharp (is_sharp). Every turn is reported with the time spent per phase.
+    """
+
+    def __init__(self, turn_time=20.0, min_search=0.01, base_search=0.2, max_search=3.0, reserve_time=12.0,
+                 smoothing=0.3):
+        """
+        Args:
+            turn_time: budget of a turn in seconds
+            min_search: minimal search time in seconds, also if the budget is spent
+            base_search: search time at full engine strength in seconds
+            max_search: maximal search time of a sharp position in seconds
+            reserve_time: initial estimate of robot motion and verification after the search in seconds
+            smoothing: weight of the last turn in the estimate of robot motion and verification
+        """
+        self.turn_time = turn_time
+        self.min_search = min_search
+        self.base_search = base_search
+        self.max_search = max_search
+        self.reserve_time = reserve_time
+        self.smoothing = smoothing
+        self.reports: List[Dict] = []
+        self.__turn: Optional[Dict] = None
+
+    def start_turn(self):
+        """Starts the budget of a new turn, an unfinished turn is reported first"""
+        if self.__turn is not None:
+            self.end_turn()
+        self.__turn = {'start': time.perf_counter(), 'vision': 0.0, 'search': 0.0, 'motion': 0.0, 'search_end': None,
+                       'search_limit': None, 'extended': False}
+
+    @contextmanager
+    def phase(self, name: str):
+        """Measures a phase of the turn (vision, search or motion)"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            if self.__turn is not None:
+                self.__turn[name] += time.perf_counter() - start
+                if name == 'search':
+                    self.__turn['search_end'] = time.perf_counter()
+
+    def search_time(self, strength=1.0) -> Tuple[float, float]:
+        """Gets the search time of the current position
+
+        Args:
+            strength: engine strength between 0 (weakest) and 1 (full strength)
+        Returns:
+            base search time | maximal search time of a sharp position (seconds)
+        """
+        elapsed = 0.0 if self.__turn is None else time.perf_counter() - self.__turn['start']
+        left = self.turn_time - elapsed - self.reserve_time
+        max_time = min(max(left, self.min_search), self.max_search)
+        base_time = min(self.min_search + (self.base_search - self.min_search) * strength, max_time)
+        if self.__turn is not None:
+            self.__turn['search_limit'] = max_time
+        return base_time, max_time
+
+    def extended(self):
+        """Notes that the search of this turn was extended because the position is sharp"""
+        if self.__turn is not None:
+            self.__turn['extended'] = True
+
+    def end_turn(self) -> Optional[Dict]:
+        """Ends the turn, updates the estimate of robot motion and verification and reports the spent time
+
+        Returns:
+            report of the turn, None if no turn was started
+        """
+        turn, self.__turn = self.__turn, None
+        if turn is None:
+            return None
+        now = time.perf_counter()
+        total = now - turn['start']
+        if turn['search_end'] is not None:
+            # Zeit nach der Suche (Roboterbewegung und Kontrollaufnahme) für die nächsten Züge schätzen
+            self.reserve_time += self.smoothing * (now - turn['search_end'] - self.reserve_time)
+        spent = turn['vision'] + turn['search'] + turn['motion']
+        report = {'turn': len(self.reports) + 1, 'budget': self.turn_time, 'total': total,
+                  'vision': turn['vision'], 'search': turn['search'], 'motion': turn['motion'],
+                  'other': max(total - spent, 0.0), 'search_limit': turn['search_limit'],
+                  'extended': turn['extended'], 'over_budget': total > self.turn_time}
+        self.reports.append(report)
+        logger.info(f'Turn {report["turn"]}: {total:.2f} s of {self.turn_time:.1f} s (vision {turn["vision"]:.2f} s, '
+                    f'search {turn["search"]:.2f} s{" extended" if turn["extended"] else ""}, '
+                    f'motion {turn["motion"]:.2f} s, other {report["other"]:.2f} s)')
+        return report
+
+    def summary(self) -> Dict:
+        """Mean time per phase over all reported turns, number of turns over budget and of extended searches"""
+        if not self.reports:
+            return {'turns': 0}
+        summary = {'turns': len(self.reports)}
+        for name in ('total', 'vision', 'search', 'motion', 'other'):
+            summary[name] = sum(report[name] for report in self.reports) / len(self.reports)
+        summary['over_budget'] = sum(report['over_budget'] for report in self.reports)
+        summary['extended'] = sum(report['extended'] for report in self.reports)
+        logger.info(f'Turn budget: {summary}')
+        return summary
@@ -0,0 +1,90 @@
+import re
+from typing import Iterable, List
+
+FILES = 'abcdefgh'
+RANKS = '12345678'
+EMPTY = '.'
+# Feldname nach Matrixindex [Zeile][Spalte] aus Robotersicht, Zeile 0 = Reihe 1, z.B. SQUARE_NAMES[0][4] = 'e1'
+SQUARE_NAMES = [[file + rank for file in FILES] for rank in RANKS]
+# Spiegelung zwischen Stockfish-Orientierung und Schachfeld-Konvention (Reihe 1 ↔ 8), z.B. a8→a1
+MIRRORED_SQUARES = {file + rank: file + mirrored for rank, mirrored in zip(RANKS, reversed(RANKS)) for file in FILES}
+# Ziffern der FEN-Stellung als Folge leerer Felder
+_EXPAND = str.maketrans({str(count): EMPTY * count for count in range(1, 9)})
+_EMPTY_RUN = re.compile(r'\.+')
+
+
+def mirror_square(square: str) -> str:
+    """Mirrors a square (e.g. a8→a1), anything else (e.g. '-' or 'xx') is returned unchanged"""
+    return MIRRORED_SQUARES.get(square, square)
+
+
+def mirror_move(move: str) -> str:
+    """Mirrors a move (e.g. e7e8q→e2e1q), a single square (en-passant) or an auxiliary move of the robot (e.g. e4xx)"""
+    promotion = move[4] if len(move) == 5 else ''
+    target = '' if len(move) == 2 else move[2:4]
+    return mirror_square(move[0:2]) + mirror_square(target) + promotion
+
+
+def mirror_moves(moves: Iterable[str]) -> List[str]:
+    """Mirrors a list of moves to switch between Stockfish orientation and real orientation"""
+    return [mirror_move(move) for move in moves]
+
+
+def expand_placement(placement: str) -> str:
+    """Expands the piece placement of a FEN-Position to 64 characters (rank 8 to 1, '.' for empty squares)"""
+    return placement.translate(_EXPAND).replace('/', '')
+
+
+def compress_rows(rows: Iterable[str]) -> str:
+    """Joins rows of 8 characters ('.' for empty squares) to the piece placement of a FEN-Position"""
+    return '/'.join(_EMPTY_RUN.sub(lambda run: str(len(run.group())), row) for row in rows)
+
+
+def mirror_fen(fen: str) -> str:
+    """Mirrors a FEN-Position between Stockfish orientation and real orientation (ranks and en-passant square)
+
+    e.g. rnbqkbnr/2pppp2/8/8/8/8/2PPPP2/RNBQKBNR w KQkq - 0 1 → RNBQKBNR/2PPPP2/8/8/8/8/2pppp2/rnbqkbnr w KQkq - 0 1
+    """
+    placement, separator, rest = fen.partition(' ')
+    squares = expand_placement(placement)
+    fields = rest.split(' ')
+    if len(fields) > 2:
+        fields[2] = mirror_square(fields[2])
+    return compress_rows(squares[8 * row:8 * row + 8] for row in reversed(range(8))) + separator + ' '.join(fields)
+
+
+def fen_to_matrix(fen: str, player_color: str) -> List[List[str]]:
+    """Gets a 8x8 matrix of the pieces ('.' for empty squares) of a FEN-Position
+
+    Args:
+        fen: FEN-Position
+        player_color: 'b' → white (rank 1) in the first row, else black (rank 8) in the first row
+    Returns:
+        8x8 matrix
+    """
+    squares = expand_placement(fen.split(' ', 1)[0])
+    matrix = [list(squares[8 * row:8 * row + 8]) for row in range(8)]
+    return matrix[::-1] if player_color == 'b' else matrix
+
+
+def matrix_to_fen(matrix: List[list], player_color: str, player_turn: str) -> str:
+    """Gets the FEN-Position of a 8x8 matrix of the pieces (inverse of fen_to_matrix)
+
+    Castling rights are set if king and rook are on their starting squares, no en-passant and no move counters.
+
+    Args:
+        matrix: 8x8 matrix ('.' for empty squares)
+        player_color: orientation of the matrix as in fen_to_matrix
+        player_turn: color to move ('w' or 'b')
+    Returns:
+        FEN-Position
+    """
+    if player_color == 'b':
+        matrix = matrix[::-1]
+    placement = compress_rows(''.join(str(piece) for piece in row[:8]) for row in matrix[:8])
+    castling = ''
+    if matrix[0][4] == 'K':
+        castling += ('K' if matrix[0][7] == 'R' else '') + ('Q' if matrix[0][0] == 'R' else '')
+    if matrix[7][4] == 'k':
+        castling += ('k' if matrix[7][7] == 'r' else '') + ('q' if matrix[7][0] == 'r' else '')
+    return f'{placement} {player_turn} {castling or "-"} - 0 1'
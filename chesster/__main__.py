@@ -1,5 +1,8 @@
+import os
 import sys
+import threading
 from chesster.gui.window import Window
+from chesster.Schach_KI.engine import engine_manager
 from PyQt5.QtWidgets import QApplication
 import logging
 
@@ -8,6 +11,9 @@ logger = logging.getLogger(__name__)
 if __name__ == '__main__':
     logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(name)s: %(message)s")
     logger.info('CHESSter started!')
+    # Engine schon beim Start der Anwendung laden, die erste Partie zahlt dann keinen Engine-Start
+    threading.Thread(target=engine_manager.warm_up,
+                     kwargs={'engines': 2 if os.environ.get('ENGINE_PONDER', '0') == '1' else 1}, daemon=True).start()
     app = QApplication(sys.argv)
     window = Window()
     window.show()
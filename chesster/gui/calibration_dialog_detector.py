@@ -2,7 +2,7 @@
 from turtle import update
 from PyQt5.QtWidgets import QDialog
 from PyQt5.uic import loadUi
-from PyQt5.QtWidgets import QDialog, QLabel, QMessageBox
+from PyQt5.QtWidgets import QDialog, QLabel, QMessageBox, QComboBox, QDoubleSpinBox, QPushButton, QHBoxLayout
 from chesster.gui.utils import get_ui_resource_path
 from PyQt5 import QtGui
 import os
@@ -13,10 +13,13 @@ import threading as th
 from chesster.camera.realsense import RealSenseCamera
 import time
 from chesster.obj_recognition.object_recognition import ObjectRecognition
+from chesster.obj_recognition.chessboard_recognition import ChessboardRecognition
 import cv2 as cv
 logger = logging.getLogger(__name__)
 
 class CalibrationDetector(QDialog):
+    STATISTIC_FRAMES = 5
+
     def __init__(self, flag_debug, parent=None):
         super(CalibrationDetector, self).__init__(parent)
         self.parent = parent
@@ -36,9 +39,49 @@ class CalibrationDetector(QDialog):
             self.pushButton_cycle_right.setHidden(True)
         self.debug_images = []
         self.cycle_counter = 0
+        self.board = None
+        self.recognition = ChessboardRecognition()
+        # Aufnahme der letzten Kalibrierung, damit ein geänderter Parameter nur die späteren Stufen neu rechnet
+        self.last_capture = None
+        if flag_debug:
+            self.add_parameter_controls()
         self.label_status_main.setText('Press "Start" to start the calibration.')
         self.label_status_sub.setText('')
         
+    def add_parameter_controls(self):
+        # Zahlenparameter der Erkennungsstufen, z.B. "edges.low"
+        self.comboBox_parameter = QComboBox()
+        for stage in ChessboardRecognition.STAGES:
+            for name, value in self.recognition.parameters[stage].items():
+                if isinstance(value, (int, float)):
+                    self.comboBox_parameter.addItem(f'{stage}.{name}', (stage, name))
+        self.spinBox_parameter = QDoubleSpinBox()
+        self.spinBox_parameter.setRange(0, 1000)
+        self.pushButton_rerun = QPushButton('Re-run')
+        self.pushButton_rerun.setEnabled(False)
+        layout = QHBoxLayout()
+        layout.addWidget(self.comboBox_parameter)
+        layout.addWidget(self.spinBox_parameter)
+        layout.addWidget(self.pushButton_rerun)
+        self.verticalLayout.addLayout(layout)
+        self.comboBox_parameter.currentIndexChanged.connect(self.show_parameter)
+        self.pushButton_rerun.clicked.connect(self.rerun_T)
+        self.show_parameter()
+
+    def show_parameter(self):
+        stage, name = self.comboBox_parameter.currentData()
+        value = self.recognition.parameters[stage][name]
+        self.spinBox_parameter.setDecimals(4 if isinstance(value, float) else 0)
+        self.spinBox_parameter.setSingleStep(0.001 if isinstance(value, float) and value < 0.1 else 1)
+        self.spinBox_parameter.setValue(value)
+
+    def rerun_T(self):
+        stage, name = self.comboBox_parameter.currentData()
+        value = self.recognition.parameters[stage][name]
+        self.recognition.set_parameters(stage, **{name: type(value)(self.spinBox_parameter.value())})
+        Thread = th.Thread(target=self.recognize, args=(*self.last_capture, stage))
+        Thread.start()
+
     def cycle_debug_images(self, direction):
         if self.cycle_counter == 0 and direction == -1:
             pass
@@ -52,16 +95,38 @@ class CalibrationDetector(QDialog):
 
     @staticmethod
     def update_image(image, image_label):
-        Qtimage = QtGui.QImage(image.data, 848, 480, QtGui.QImage.Format_RGB888).rgbSwapped()
+        if image.ndim == 2:
+            image = cv.cvtColor(image, cv.COLOR_GRAY2BGR)
+        image = np.ascontiguousarray(image)
+        height, width = image.shape[:2]
+        Qtimage = QtGui.QImage(image.data, width, height, 3 * width, QtGui.QImage.Format_RGB888).rgbSwapped()
         image_label.clear()
         image_label.setPixmap(QtGui.QPixmap.fromImage(Qtimage))
 
     def calibrate_T(self):
-        Thread = th.Thread(target=self.calibrate)
+        target = self.calibrate if self.board is None else self.record_occupied
+        Thread = th.Thread(target=target)
         Thread.start()
 
+    def capture_frames(self):
+        frames = []
+        for _ in range(self.STATISTIC_FRAMES):
+            frames.append(self.__camera.capture_color())
+        return frames
+
+    def record_occupied(self):
+        self.pushButton_main.setEnabled(False)
+        self.label_status_main.setText('Recording field statistics...')
+        self.label_status_sub.setText('')
+        d_img, _ = self.__camera.capture_depth(apply_filter=True)
+        ObjectRecognition.record_occupied_statistics(self.board, self.capture_frames(), Path(os.environ['CALIBRATION_DATA_PATH']), depth=d_img)
+        self.board = None
+        self.recognition = ChessboardRecognition()
+        self.label_status_main.setText('Calibration successful! You may close this window now.')
+        self.pushButton_main.setText('Try again')
+        self.pushButton_main.setEnabled(True)
+
     def calibrate(self):
-        self.debug_images = []
         self.pushButton_main.setEnabled(False)
         self.label_status_main.setText('Calibrating Chessboard/Detector data...')
         self.label_status_sub.setText('')
@@ -69,19 +134,47 @@ class CalibrationDetector(QDialog):
         d_img, _ = self.__camera.capture_depth(apply_filter=True)
         #c_img = cv.imread('Testbild.png')
         #d_img = np.zeros((c_img.shape[0], c_img.shape[1]))
-        self.debug_images.append(c_img.copy())
-        self.update_image(self.debug_images[0], self.label_img)
+        self.update_image(c_img, self.label_img)
+        empty_images = self.capture_frames()
+        self.last_capture = (c_img, d_img, empty_images)
+        self.recognize(c_img, d_img, empty_images)
 
-        board = ObjectRecognition.create_chessboard_data(c_img.copy(), d_img, Path(os.environ['CALIBRATION_DATA_PATH']), debug=False)
+    def recognize(self, c_img, d_img, empty_images, changed_stage=None):
+        self.pushButton_main.setEnabled(False)
+        if self.flag_debug:
+            self.pushButton_rerun.setEnabled(False)
+        self.board = None
+        self.debug_images = [c_img.copy()]
+        try:
+            board = ObjectRecognition.create_chessboard_data(c_img.copy(), d_img, Path(os.environ['CALIBRATION_DATA_PATH']), debug=False, empty_images=empty_images, recognition=self.recognition)
+        except (cv.error, ValueError) as e:
+            # Ungültiger Parameter (z.B. gerade block_size), Aufnahme bleibt für einen weiteren Versuch erhalten
+            logger.error(f'Chessboard recognition failed: {e}')
+            self.label_status_main.setText(f'Calibration failed: {e}')
+            self.pushButton_main.setText('Try again')
+            self.pushButton_main.setEnabled(True)
+            if self.flag_debug:
+                self.pushButton_rerun.setEnabled(True)
+            return
+        if self.flag_debug:
+            for stage in ChessboardRecognition.STAGES:
+                self.debug_images.append(self.recognition.debug_images[stage])
         classify_image = c_img.copy()
         board.draw_fields(classify_image)
         self.debug_images.append(classify_image)
-        print(len(self.debug_images))
         n_fields = board.total_detected_fields()
         if n_fields == 64:
+            self.board = board
             self.label_status_main.setText('Calibration successful! You may close this window now.')
+            self.label_status_sub.setText('Optional: place all pieces at their start position and press "Record pieces" to tune the change thresholds and piece heights.')
+            self.pushButton_main.setText('Record pieces')
         else:
             self.label_status_main.setText(f'Calibration failed. {n_fields} fields detected.')
             self.label_status_sub.setText('Please press "try again". If this error occures again, move the board a little bit or refer to the documentation.')
-        self.pushButton_main.setText('Try again')
+            self.pushButton_main.setText('Try again')
         self.pushButton_main.setEnabled(True)
+        if self.flag_debug:
+            self.pushButton_rerun.setEnabled(True)
+        # Nach einer Parameteränderung das Bild der geänderten Stufe zeigen
+        self.cycle_counter = 1 + ChessboardRecognition.STAGES.index(changed_stage) if changed_stage else 0
+        self.update_image(self.debug_images[self.cycle_counter], self.label_img)
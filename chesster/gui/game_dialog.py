@@ -268,7 +268,7 @@ class GameDialog(QDialog):
             self.Hint_Label_Hint.setText("Sorry, you used all your available hints! It's only (wo)man versus machine now!")
         else:
             logger.info('Getting Hint from AI')
-            self.HintMove = self.hypervisor.chess_engine.engine.get_best_move()
+            self.HintMove = self.hypervisor.chess_engine.get_hint()
             logger.info('Hint: ' + self.HintMove)
             self.Hint_Label_Hint.setText('Tip from the AI: ' + self.HintMove)
             self.NoHints-=1
@@ -345,6 +345,8 @@ class GameDialog(QDialog):
     def closeEvent(self, a0: QtGui.QCloseEvent) -> None:
         logger.info('Closing')
         #self.hypervisor.stop()
+        # Engine an den EngineManager zurückgeben (nächste Partie nutzt den laufenden Prozess), Kamera und Roboter bleiben
+        self.hypervisor.chess_engine.quit()
         super(GameDialog, self).close()
 
     def update_drawing(self, svg_image):
@@ -434,7 +436,7 @@ class GameDialog(QDialog):
             self.Hint_Label_Hint.setText("Sorry, you used all your available hints! It's only (wo)man versus machine now!")
         else:
             logger.info('Getting Hint from AI')
-            self.HintMove = self.hypervisor.chess_engine.engine.get_best_move()
+            self.HintMove = self.hypervisor.chess_engine.get_hint()
             if self.__player_color == 'w':
                 list_HintMove = self.hypervisor.chess_engine.mirrored_play([self.HintMove])
                 self.HintMove = list_HintMove[0]
@@ -486,9 +488,15 @@ class GameDialog(QDialog):
         self.Button_q.clicked.connect(lambda: self.PieceButton_click('q'))
         self.Button_k.clicked.connect(lambda: self.PieceButton_click('k'))
         self.Button_empty.clicked.connect(lambda: self.PieceButton_click('.'))
+        estimate = self.hypervisor.estimate_board_state()
+        uncertain = estimate.uncertain()
+        if len(uncertain) != 0:
+            self.GameStatus_Text_Label.setText(
+                f"The position was detected automatically. Please check these fields and correct them if necessary: {', '.join(uncertain)}. Press 'Start' to begin the game at the actual position and wait for further instructions.")
+        self.read_player_turn()
+        self.update_midgame_drawing()
 
-    def PieceButton_click(self, state: str):
-        logger.info(f'Writing field {self.Input_Field.text()} with {state}..')
+    def read_player_turn(self):
         for radio_button in self.groupBox_2.findChildren(QRadioButton):
             if radio_button.isChecked():
                 next_player = radio_button.text().lower()
@@ -499,7 +507,14 @@ class GameDialog(QDialog):
                 self.player_turn = next_player[0]
                 logger.info(f'{self.player_turn}')
                 break
+
+    def PieceButton_click(self, state: str):
+        logger.info(f'Writing field {self.Input_Field.text()} with {state}..')
+        self.read_player_turn()
         self.hypervisor.replace_one_field_state(self.Input_Field.text(), state)
+        self.update_midgame_drawing()
+
+    def update_midgame_drawing(self):
         fen = self.hypervisor.compute_fen_from_detector(self.__player_color, self.player_turn)
         logger.info(f'given fen to get_drawing: {fen}')
         #TODO: Button for player_turn as it is necessary for player_turn in FEN
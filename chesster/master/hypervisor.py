@@ -3,8 +3,11 @@ from chesster.camera.realsense import RealSenseCamera
 from chesster.master.action import Action
 from chesster.obj_recognition.chessboard import ChessBoard
 from chesster.Schach_KI.class_chess_gameplay import ChessGameplay
+from chesster.Schach_KI.time_budget import TurnBudget
+from chesster.Schach_KI.transforms import compress_rows
 from chesster.Robot.UR10 import UR10Robot
 from chesster.obj_recognition.object_recognition import ObjectRecognition
+from chesster.obj_recognition.game_archive import GameRecorder
 from chesster.vision_based_control.controller import VisualBasedController
 import logging
 from pathlib import Path
@@ -22,8 +25,19 @@ class Hypervisor:
         self.camera = RealSenseCamera(auto_start=False)
         self.robot = UR10Robot(os.environ['ROBOT_ADDRESS'])
         logger.info('UR10 constructed')
-        self.detector = ObjectRecognition(promotion_dialog, os.environ['CALIBRATION_DATA_PATH'])
-        self.chess_engine = ChessGameplay(skill_level=player_skill_level, threads=4, minimum_thinking_time=30, debug=False)
+        self.detector = ObjectRecognition(promotion_dialog, os.environ['CALIBRATION_DATA_PATH'],
+                                          piece_detector_path=os.environ.get('PIECE_DETECTOR_PATH'),
+                                          piece_detector_model=os.environ.get('PIECE_DETECTOR_MODEL', 'rcnn'),
+                                          square_classifier_path=os.environ.get('SQUARE_CLASSIFIER_PATH'))
+        # Zeitbudget eines Roboterzugs (Erkennung, Suche, Bewegung), bestimmt die Suchzeit der Engine
+        self.turn_budget = TurnBudget(turn_time=float(os.environ.get('TURN_TIME_BUDGET', '20')))
+        # Engine-Prozess bleibt über die Partien hinweg bestehen (EngineManager), Threads und Hash passend zum Rechner
+        self.chess_engine = ChessGameplay(skill_level=player_skill_level, minimum_thinking_time=30, debug=False,
+                                          ponder=os.environ.get('ENGINE_PONDER', '0') == '1',
+                                          move_cache_path=os.environ.get('MOVE_CACHE_PATH'),
+                                          book_path=os.environ.get('OPENING_BOOK_PATH'),
+                                          tablebase_path=os.environ.get('SYZYGY_PATH'),
+                                          turn_budget=self.turn_budget)
         logger.info('Chess AI constructed')
         self.vision_based_controller = VisualBasedController(self.robot, os.environ['NEURAL_NETWORK_PATH'], os.environ['SCALER_PATH'])
         logger.info('Vision based controller constructed')
@@ -37,6 +51,7 @@ class Hypervisor:
         self.__previous_chessBoard = None
         self.__current_cimg = None
         self.__current_dimg = None
+        self.__current_view = None
         self.__previous_cimg = None
         self.__previous_dimg = None
         self.Checkmate = False
@@ -50,6 +65,8 @@ class Hypervisor:
         self.last_move_robot = None
         self.num_move_robot = 0
         self.debug_image = None
+        self.__archive_path = os.environ.get('GAME_ARCHIVE_PATH')
+        self.__recorder = None
 
     def start(self):
         logger.info('Hypervisor starting')
@@ -66,16 +83,23 @@ class Hypervisor:
         self.__current_chessBoard = self.detector.get_chessboard_matrix()
         self.__current_cimg = []
         self.__current_dimg = []
+        if self.__archive_path is not None:
+            self.__recorder = GameRecorder(self.__archive_path, os.environ['CALIBRATION_DATA_PATH'],
+                                           robot_color=self.__robot_color, human_color=self.__human_color)
 
     def stop(self):
         self.camera.stop()
         self.robot.stop()
+        self.turn_budget.end_turn()
+        self.turn_budget.summary()
+        self.chess_engine.quit()
             
     def analyze_game(self, start):
         logger.info('Analyzing game')
         #self.progress.setValue(10)
         if start:
             logger.info('Robot starts the game.')
+            self.turn_budget.start_turn()
             #self.progress.setValue(20)
             actions, self.Checkmate, self.Checkmate_player, self.RemisMoves, self.RemisTriple, self.RemisStale = self.chess_engine.play_ki(self.__current_chessBoard, self.__human_color, self.detector)
             if self.RemisMoves is True:
@@ -93,19 +117,22 @@ class Hypervisor:
             #self.progress.setValue(50)
         else:
             logger.info('Starting analyze_game...')
+            self.turn_budget.start_turn()
             logger.info('Making the image from last move to the previous image.')
             self.__previous_cimg = self.__current_cimg.copy()
+            self.__previous_dimg = self.__current_dimg
 
             logger.info('Taking new images')
-            self.__current_cimg = self.camera.capture_color()
-            self.__current_dimg, _ = self.camera.capture_depth(apply_filter=True)
+            with self.turn_budget.phase('vision'):
+                self.__capture_images()
 
             #self.progress.setValue(20)
             logger.info('Overriding chessboard from last move')
             self.__previous_chessBoard = self.__current_chessBoard
 
             logger.info('Determine changes caused by human move...')
-            self.__current_chessBoard, self.last_move_human, failure_flag = self.detector.determine_changes(self.__previous_cimg, self.__current_cimg, self.__human_color)
+            with self.turn_budget.phase('vision'):
+                self.__current_chessBoard, self.last_move_human, failure_flag = self.detector.determine_changes(self.__previous_cimg, self.__current_cimg, self.__human_color, self.__previous_dimg, self.__current_dimg)
             logger.info(f'Current Chess board layout after determine changes: {self.detector.get_fields()}')
             #self.progress.setValue(40)
             if failure_flag:
@@ -140,8 +167,10 @@ class Hypervisor:
                 for move in rollback_move:
                     if not('xx' in move) and not('P' in move): #only enters statement if the last move is a regular move (eg. e2e4)
                         logger.info('Last move was a regular move. Proceeding to rollback with robot...')
-                        Chesspieces = [self.detector.get_chesspiece_info(move[0:2], self.__current_dimg), self.detector.return_field(move[2:4])]
-                        self.vision_based_controller.useVBC(move, Chesspieces, self.__current_dimg, [self.__ScalingHeight, self.__ScalingWidth], lastMove=True)
+                        view = self.__current_view
+                        Chesspieces = [self.detector.get_chesspiece_info(move[0:2], self.__current_dimg, view), self.__target_info(move[2:4])]
+                        ScalingFactors = None if view is not None else [self.__ScalingHeight, self.__ScalingWidth]
+                        self.vision_based_controller.useVBC(move, Chesspieces, self.__current_dimg, ScalingFactors, lastMove=True)
                     else:
                         logger.info('invalid move contains Promotion or Capture. No rollback from robot possible. ')
                 #self.progress.setValue(90)
@@ -151,6 +180,7 @@ class Hypervisor:
                 #self.progress.setValue(100)
                 return [], "NoCheckmate", self.chess_engine.get_drawing(self.last_move_human[0], Proof, self.__human_color), Proof, failure_flag, self.Remis_state
 
+            self.__record_frame(self.last_move_human, 'human')
             logger.info('Checking whether checkmate occured...')
             if self.Checkmate is True:
                 logger.info('Checkmate! Human won. leaving analyze_game and starting winning scene...')
@@ -190,34 +220,39 @@ class Hypervisor:
     def make_move(self, actions, debug=True):
         logger.info(f'Performing moves from KI')
         if actions != []:
-            for i, move in enumerate(actions):
-                logger.info(f'Performing move {i+1}: {move}')
-                if 'x' in move:
-                    Chesspieces = [self.detector.get_chesspiece_info(move[0:2], self.__current_dimg), None]
-                elif 'P' in move:
-                    Chesspieces = [None, self.detector.return_field(move[2:])]
-                else:
-                    Chesspieces = [self.detector.get_chesspiece_info(move[0:2], self.__current_dimg), self.detector.return_field(move[2:])]
+            with self.turn_budget.phase('motion'):
+                for i, move in enumerate(actions):
+                    logger.info(f'Performing move {i+1}: {move}')
+                    view = self.__current_view
+                    if 'x' in move:
+                        Chesspieces = [self.detector.get_chesspiece_info(move[0:2], self.__current_dimg, view), None]
+                    elif 'P' in move:
+                        Chesspieces = [None, self.__target_info(move[2:4])]
+                    else:
+                        Chesspieces = [self.detector.get_chesspiece_info(move[0:2], self.__current_dimg, view), self.__target_info(move[2:4])]
 
-                if i == len(actions)-1:
-                    logger.info('Last action of move detected. Homing afterwards.')
-                    last_move = True
-                else:
-                    last_move = False
-                if debug==True:
-                    processed_debug_img = self.process_debug_image(self.debug_image)
-                self.vision_based_controller.useVBC(move, Chesspieces, self.__current_dimg, [self.__ScalingHeight, self.__ScalingWidth], last_move)
+                    if i == len(actions)-1:
+                        logger.info('Last action of move detected. Homing afterwards.')
+                        last_move = True
+                    else:
+                        last_move = False
+                    if debug==True:
+                        processed_debug_img = self.process_debug_image(self.debug_image)
+                    ScalingFactors = None if view is not None else [self.__ScalingHeight, self.__ScalingWidth]
+                    self.vision_based_controller.useVBC(move, Chesspieces, self.__current_dimg, ScalingFactors, last_move)
 
             logger.info('Overriding images from previous step')
             self.__previous_cimg = self.__current_cimg.copy()
             self.__previous_dimg = self.__current_dimg.copy()
             logger.info('Taking new images')
-            self.__current_cimg = self.camera.capture_color()
-            self.__current_dimg, _ = self.camera.capture_depth(apply_filter=True)
+            with self.turn_budget.phase('vision'):
+                self.__capture_images()
             self.debug_image = self.__current_cimg.copy()
             #self.progress.setValue(20)
             logger.info('Determining changes produced by the robot')
-            self.__current_chessBoard, self.last_move_robot, failure_flag = self.detector.determine_changes(self.__previous_cimg, self.__current_cimg, self.__robot_color)
+            with self.turn_budget.phase('vision'):
+                self.__current_chessBoard, self.last_move_robot, failure_flag = self.detector.determine_changes(self.__previous_cimg, self.__current_cimg, self.__robot_color, self.__previous_dimg, self.__current_dimg)
+            self.turn_budget.end_turn()
             logger.info(f'Current Chess board layout after determine changes: {self.detector.get_fields()}')
             #self.progress.setValue(50)
             if failure_flag:
@@ -230,6 +265,7 @@ class Hypervisor:
                 return "NoCheckmate", None, failure_flag
 
             logger.info(f'Detected move by the robot: {self.last_move_robot}')
+            self.__record_frame(self.last_move_robot, 'robot')
             self.num_move_robot = self.num_move_robot + 1
             logger.info('Checking whether checkmate occured...')
             if self.Checkmate == True: #Check for checkmate from analyze_game()
@@ -257,9 +293,8 @@ class Hypervisor:
         self.__previous_cimg = self.__current_cimg.copy()
         self.__previous_dimg = self.__current_dimg.copy()
         logger.info('Taking new images')
-        self.__current_cimg = self.camera.capture_color()
-        self.__current_dimg, _ = self.camera.capture_depth(apply_filter=True)
-        self.__current_chessBoard, self.last_move_robot, failure_flag = self.detector.determine_changes(self.__previous_cimg, self.__current_cimg, self.__robot_color)
+        self.__capture_images()
+        self.__current_chessBoard, self.last_move_robot, failure_flag = self.detector.determine_changes(self.__previous_cimg, self.__current_cimg, self.__robot_color, self.__previous_dimg, self.__current_dimg)
         if failure_flag:
             logger.info('Detection failed again.')
             logger.info('Rolling back current taken color image, chessboard matrix and board class')
@@ -280,7 +315,7 @@ class Hypervisor:
         logger.info('setting Fen Position from AI to empty ("")')
         #todo: Set Fen to zero for empty image
         ## Best Thing to do with used engine since a game without two kings is illegal
-        self.chess_engine.engine.set_fen_position('4k3/8/8/8/8/8/8/4K3 w - - 0 1')
+        self.chess_engine.set_fen_position('4k3/8/8/8/8/8/8/4K3 w - - 0 1')
     
     def replace_one_field_state(self, field_str: str, new_state: str):
         logger.info(f'Replacing field {field_str} with state {new_state}')
@@ -289,9 +324,33 @@ class Hypervisor:
                 logger.info('field found. replacing.')
                 field.state = new_state
     
-    def update_images(self):
+    def estimate_board_state(self):
+        logger.info('Estimating the board state from the current frame')
+        self.update_images()
+        return self.detector.estimate_board_state(self.__current_cimg, self.__current_dimg)
+
+    def __target_info(self, chessfield: str):
+        if self.__current_view is None:
+            return self.detector.return_field(chessfield)
+        return self.detector.get_target_info(chessfield, self.__current_view)
+
+    def __capture_images(self):
         self.__current_cimg = self.camera.capture_color()
         self.__current_dimg, _ = self.camera.capture_depth(apply_filter=True)
+        self.__current_view = self.detector.rectify(self.__current_cimg, self.__current_dimg)
+
+    def __record_frame(self, move, player: str):
+        # Frames with the verified board state become labeled training data (nn --action label)
+        if self.__recorder is None:
+            return
+        try:
+            self.__recorder.record(self.__current_cimg, self.__current_dimg, self.detector.get_fields(), move, player,
+                                   self.chess_engine.get_fen_position())
+        except Exception as e:
+            logger.warning(f'Could not record frame: {e}')
+
+    def update_images(self):
+        self.__capture_images()
         logger.info(self.__current_dimg.shape)
         self.debug_image = self.__current_cimg.copy()
 
@@ -344,14 +403,7 @@ class Hypervisor:
             if row != '1':
                 fen += '/'
         logger.info(f' temporary fen is {fen}')
-        fen = fen.replace("........", str(8))
-        fen = fen.replace(".......", str(7))
-        fen = fen.replace("......", str(6))
-        fen = fen.replace(".....", str(5))
-        fen = fen.replace("....", str(4))
-        fen = fen.replace("...", str(3))
-        fen = fen.replace("..", str(2))
-        fen = fen.replace(".", str(1))
+        fen = compress_rows(fen.split('/'))
         rochade = ''
         if King_w is True and RTower_w is True:
             rochade += 'K'
@@ -367,10 +419,10 @@ class Hypervisor:
 
         if w_King_Flag is True and b_King_Flag is True:
             if player_color == 'b':
-                self.chess_engine.engine.set_fen_position(fen)
+                self.chess_engine.set_fen_position(fen)
                 logger.info(f'Setting FEN-Position in Stockfish succeeded')
             else:
-                self.chess_engine.engine.set_fen_position(self.chess_engine.mirror_fen(midgame=True, fen=fen))
+                self.chess_engine.set_fen_position(self.chess_engine.mirror_fen(midgame=True, fen=fen))
                 logger.info(f'Setting FEN-Position in Stockfish succeeded')
         else:
             logger.info(f'Not yet a legal FEN-Position because at least one King is missing')
@@ -0,0 +1,114 @@
+from __future__ import annotations
+
+__all__ = [
+    'BoardRectifier',
+    'RectifiedBoardView'
+]
+
+import cv2 as cv
+import numpy as np
+import logging
+from typing import List, Optional, Tuple
+from chesster.obj_recognition.chessboard_field import ChessBoardField
+
+logger = logging.getLogger(__name__)
+
+FILES = 'abcdefgh'
+
+
+class RectifiedBoardView:
+    """Top-down view of the board (color and depth) on a canonical grid, a1 at the bottom left
+
+    Every square covers square_size x square_size pixels, so per square operations are plain array slices. The camera
+    pixel of every canonical pixel is looked up in the remap table of the rectifier.
+    """
+
+    def __init__(self, color: Optional[np.ndarray], depth: Optional[np.ndarray], rectifier: BoardRectifier):
+        self.color = color
+        self.depth = depth
+        self.rectifier = rectifier
+        self.square_size = rectifier.square_size
+
+    @staticmethod
+    def square_index(position: str) -> Tuple[int, int]:
+        return 8 - int(position[1]), FILES.index(position[0])
+
+    def square_slice(self, position: str, factor: float = 1.0) -> Tuple[slice, slice]:
+        row, col = self.square_index(position)
+        margin = int(round(self.square_size * (1 - factor) / 2))
+        return (slice(row * self.square_size + margin, (row + 1) * self.square_size - margin),
+                slice(col * self.square_size + margin, (col + 1) * self.square_size - margin))
+
+    def square(self, image: np.ndarray, position: str, factor: float = 1.0) -> np.ndarray:
+        rows, cols = self.square_slice(position, factor)
+        return image[rows, cols]
+
+    def square_means(self, image: np.ndarray, factor: float = 0.5) -> np.ndarray:
+        """Mean of the center region of every square as an 8x8(xC) array, row 0 is rank 8"""
+        s = self.square_size
+        margin = int(round(s * (1 - factor) / 2))
+        grid = image.reshape(8, s, 8, s, -1)[:, margin:s - margin, :, margin:s - margin]
+        means = grid.mean(axis=(1, 3))
+        return means if image.ndim == 3 else means[..., 0]
+
+    def camera_point(self, position: str) -> Tuple[int, int]:
+        """Camera pixel (x, y) of the square center"""
+        row, col = self.square_index(position)
+        x, y = self.rectifier.centers[row, col]
+        return int(round(x)), int(round(y))
+
+    def zenith(self, position: str, factor: float = 0.4) -> Optional[Tuple[float, int, int]]:
+        """Smallest depth within the square center, returned with its camera pixel (row, column)"""
+        if self.depth is None:
+            return None
+        rows, cols = self.square_slice(position, factor)
+        region = self.depth[rows, cols].astype(np.float64)
+        region[region <= 0] = np.inf
+        if np.isinf(region).all():
+            return None
+        r, c = np.unravel_index(np.argmin(region), region.shape)
+        zenith = region[r, c]
+        r, c = rows.start + r, cols.start + c
+        return zenith, int(round(self.rectifier.map_y[r, c])), int(round(self.rectifier.map_x[r, c]))
+
+
+class BoardRectifier:
+    """Maps the camera frame onto the canonical board grid with a remap table computed once per camera resolution"""
+    SQUARE_SIZE = 48
+
+    def __init__(self, fields: List[ChessBoardField], camera_shape, square_size: int = SQUARE_SIZE):
+        self.square_size = square_size
+        self.camera_shape = tuple(camera_shape[:2])
+        width, height = self.camera_shape
+        source, target = [], []
+        for field in fields:
+            ratio_x, ratio_y = field.get_ratio(width, height)
+            row, col = RectifiedBoardView.square_index(field.position)
+            source.append((field.roi[0] * ratio_x, field.roi[1] * ratio_y))
+            target.append(((col + 0.5) * square_size, (row + 0.5) * square_size))
+        self.homography, _ = cv.findHomography(np.array(target, np.float32), np.array(source, np.float32))
+        size = 8 * square_size
+        grid_x, grid_y = np.meshgrid(np.arange(size, dtype=np.float32), np.arange(size, dtype=np.float32))
+        grid = np.stack([grid_x, grid_y], axis=-1).reshape(-1, 1, 2)
+        camera = cv.perspectiveTransform(grid, self.homography).reshape(size, size, 2)
+        self.map_x = np.ascontiguousarray(camera[..., 0])
+        self.map_y = np.ascontiguousarray(camera[..., 1])
+        self.__fixed_maps = cv.convertMaps(self.map_x, self.map_y, cv.CV_16SC2)
+        centers = (np.arange(8, dtype=np.float32) + 0.5) * square_size
+        center_x, center_y = np.meshgrid(centers, centers)
+        self.centers = cv.perspectiveTransform(np.stack([center_x, center_y], axis=-1).reshape(-1, 1, 2),
+                                               self.homography).reshape(8, 8, 2)
+        logger.info(f'Board rectifier initialized for camera shape {self.camera_shape}')
+
+    @staticmethod
+    def from_board(board, camera_shape, square_size: int = SQUARE_SIZE) -> Optional[BoardRectifier]:
+        if board.total_detected_fields() != 64:
+            logger.warning(f'Cannot rectify a board with {board.total_detected_fields()} fields')
+            return None
+        return BoardRectifier(board.fields, camera_shape, square_size)
+
+    def rectify(self, color: Optional[np.ndarray], depth: Optional[np.ndarray] = None) -> RectifiedBoardView:
+        map_1, map_2 = self.__fixed_maps
+        rectified_color = None if color is None else cv.remap(color, map_1, map_2, cv.INTER_LINEAR)
+        rectified_depth = None if depth is None else cv.remap(depth, map_1, map_2, cv.INTER_NEAREST)
+        return RectifiedBoardView(rectified_color, rectified_depth, self)
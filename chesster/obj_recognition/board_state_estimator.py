@@ -0,0 +1,127 @@
+from __future__ import annotations
+
+__all__ = [
+    'BoardStateEstimate',
+    'BoardStateEstimator'
+]
+
+import numpy as np
+import logging
+from typing import Dict, List, Optional
+from chesster.obj_recognition.chessboard import ChessBoard
+from chesster.obj_recognition.change_detector import PieceDetectorStage, RoiSampler
+from chesster.obj_recognition.piece_classifier import PieceHeightClassifier
+from chesster.obj_recognition.board_rectifier import RectifiedBoardView
+
+logger = logging.getLogger(__name__)
+
+
+class BoardStateEstimate:
+    """Full board state of one frame, the state of every field with its confidence"""
+
+    def __init__(self, states: Dict[str, str], confidence: Dict[str, float]):
+        self.states = states
+        self.confidence = confidence
+
+    def uncertain(self, min_confidence: float = 0.5) -> List[str]:
+        return sorted(position for position, c in self.confidence.items() if c < min_confidence)
+
+    def __repr__(self):
+        return str({position: (state, round(self.confidence[position], 2)) for position, state in self.states.items()
+                    if state != '.'})
+
+
+class BoardStateEstimator:
+    """Estimates the full board state from one frame, e.g. to start a game from a midgame position
+
+    The cues are combined per field:
+    - occupancy: color difference to the empty field color and the height above the empty board
+    - piece color: brightness of the occupied fields, split into a light and a dark group
+    - piece type: the height profile and, if available, the labels of an obj_recognition.nn piece detector or the
+      square crop classifier on the rectified board view
+    """
+
+    def __init__(self, piece_classifier: Optional[PieceHeightClassifier] = None, piece_detector=None,
+                 square_classifier=None):
+        self.piece_classifier = piece_classifier if piece_classifier is not None else PieceHeightClassifier()
+        self.detector_stage = PieceDetectorStage(piece_detector) if piece_detector is not None else None
+        self.square_classifier = square_classifier
+        self.sampler = RoiSampler()
+
+    def estimate(self, board: ChessBoard, image: np.ndarray, depth: Optional[np.ndarray] = None,
+                 view: Optional[RectifiedBoardView] = None) -> BoardStateEstimate:
+        fields = board.fields
+        n = len(fields)
+        # cv.mean based empty colors are stored in RGB order
+        colors = self.sampler.means(fields, image)[:, ::-1]
+        empty_colors = np.array([field.empty_color for field in fields], dtype=np.float64)
+        thresholds = board.field_thresholds if board.field_thresholds is not None else \
+            np.full(n, float(ChessBoard.CHANGE_THRESHOLD))
+        ratio = np.sqrt(((colors - empty_colors) ** 2).sum(axis=1)) / thresholds
+        votes = np.where(ratio > 1, 1.0, -1.0) * np.clip(np.abs(ratio - 1), 0, 1)
+        cues = 1
+        pieces = ['p'] * n
+        type_confidence = np.zeros(n)
+        if depth is not None and board.depth_map is not None:
+            profile = self.piece_classifier.profile(fields, board.depth_map, depth)
+            occupied, occupied_confidence = self.piece_classifier.occupied(profile)
+            votes = votes + np.where(occupied, 1.0, -1.0) * occupied_confidence
+            cues += 1
+            height_pieces, type_confidence = self.piece_classifier.classify(profile)
+            pieces = [p if p != '.' else 'p' for p in height_pieces]
+        occupied = votes > 0
+        occupancy_confidence = np.abs(votes) / cues
+        is_white, color_confidence = self.__piece_colors(colors, occupied)
+        states = [(p.upper() if white else p) if occ else '.' for p, white, occ in zip(pieces, is_white, occupied)]
+        confidence = np.where(occupied, np.minimum(occupancy_confidence, np.minimum(color_confidence, type_confidence)),
+                              occupancy_confidence)
+        if self.detector_stage is not None:
+            labels, certainty = self.detector_stage.occupancy(fields, image)
+            from chesster.obj_recognition.nn.utils import CLASSES
+            for i in np.flatnonzero(certainty > confidence):
+                states[i] = CLASSES[labels[i] - 1]
+                confidence[i] = certainty[i]
+        if self.square_classifier is not None and view is not None:
+            from chesster.obj_recognition.nn.square_classifier import square_positions
+            square_states, square_confidence = self.square_classifier.classify(view.color)
+            index = {position: i for i, position in enumerate(square_positions())}
+            for i, field in enumerate(fields):
+                j = index[field.position]
+                if square_confidence[j] > confidence[i]:
+                    states[i] = square_states[j]
+                    confidence[i] = square_confidence[j]
+        self.__check_rules(fields, states, confidence)
+        estimate = BoardStateEstimate({field.position: state for field, state in zip(fields, states)},
+                                      {field.position: float(c) for field, c in zip(fields, confidence)})
+        logger.info(f'Estimated board state: {estimate}')
+        return estimate
+
+    @staticmethod
+    def __piece_colors(colors: np.ndarray, occupied: np.ndarray):
+        luminance = colors @ np.array([0.299, 0.587, 0.114])
+        values = np.sort(luminance[occupied])
+        if len(values) < 2:
+            return np.ones(len(colors), dtype=bool), np.zeros(len(colors))
+        # Otsu split of the occupied fields into dark and light pieces
+        best_split, best_variance = values[0], -1.0
+        for i in range(1, len(values)):
+            dark, light = values[:i], values[i:]
+            variance = len(dark) * len(light) * (light.mean() - dark.mean()) ** 2
+            if variance > best_variance:
+                best_split, best_variance = (dark[-1] + light[0]) / 2, variance
+        spread = max(values[values > best_split].mean() - values[values <= best_split].mean(), 1e-6) \
+            if (values > best_split).any() else 1.0
+        is_white = luminance > best_split
+        return is_white, np.clip(2 * np.abs(luminance - best_split) / spread, 0, 1)
+
+    @staticmethod
+    def __check_rules(fields, states: List[str], confidence: np.ndarray):
+        for i, field in enumerate(fields):
+            if states[i] in ('p', 'P') and field.row in (1, 8):
+                confidence[i] = 0.0
+        for king in ('K', 'k'):
+            kings = [i for i, state in enumerate(states) if state == king]
+            if len(kings) != 1:
+                logger.warning(f'Found {len(kings)} "{king}" on the board')
+            for i in sorted(kings, key=lambda k: confidence[k])[:-1]:
+                confidence[i] = 0.0
@@ -0,0 +1,299 @@
+from __future__ import annotations
+
+__all__ = [
+    'ChangeDetection',
+    'FieldStatistics',
+    'RoiSampler',
+    'DetectorStage',
+    'ColorDiffStage',
+    'DepthDeltaStage',
+    'PieceDetectorStage',
+    'CascadedChangeDetector'
+]
+
+import cv2 as cv
+import numpy as np
+import logging
+import time
+from abc import ABC, abstractmethod
+from typing import List, Optional, Tuple
+from chesster.obj_recognition.chessboard_field import ChessBoardField
+
+logger = logging.getLogger(__name__)
+
+
+class ChangeDetection:
+    """Per field change scores of one detector stage together with the confidence of the stage"""
+
+    def __init__(self, stage: str, fields: List[ChessBoardField], scores: np.ndarray, threshold: float,
+                 confidence: float, duration: float = 0.0):
+        self.stage = stage
+        self.fields = fields
+        self.scores = scores
+        self.threshold = threshold
+        self.confidence = confidence
+        self.duration = duration
+
+    @property
+    def changed(self) -> np.ndarray:
+        return np.flatnonzero(self.scores > self.threshold)
+
+    def as_changes(self) -> Tuple[List[ChessBoardField], List[float], Optional[ChessBoardField],
+                                  Optional[ChessBoardField]]:
+        changed = self.changed
+        state_changes = [self.fields[i] for i in changed]
+        distances = [float(self.scores[i]) for i in changed]
+        order = np.argsort(-self.scores, kind='stable')
+        largest_field = self.fields[order[0]] if len(order) > 0 and self.scores[order[0]] > 0 else None
+        second_largest_field = self.fields[order[1]] if len(order) > 1 and self.scores[order[1]] > 0 else None
+        return state_changes, distances, largest_field, second_largest_field
+
+    def __repr__(self):
+        return str({'stage': self.stage, 'confidence': round(self.confidence, 3),
+                    'changes': [self.fields[i].position for i in self.changed]})
+
+
+class FieldStatistics:
+    """Per field color noise and piece signal recorded at calibration, used to derive per field change thresholds
+
+    empty_samples and occupied_samples hold the mean ROI colors of several frames with the shape (frames, fields, 3).
+    occupied_mask marks the fields covered by a piece in the occupied frames, groups assigns every field to a group of
+    similar fields (e.g. light and dark squares) to estimate the signal of fields never seen occupied.
+    """
+    NOISE_SIGMAS = 4.0
+    SIGNAL_FRACTION = 0.5
+
+    def __init__(self, empty_samples: np.ndarray, occupied_samples: Optional[np.ndarray] = None,
+                 occupied_mask: Optional[np.ndarray] = None, groups: Optional[np.ndarray] = None,
+                 default_threshold: float = 43.0):
+        self.empty_samples = empty_samples
+        self.occupied_samples = occupied_samples
+        self.occupied_mask = occupied_mask
+        self.groups = groups if groups is not None else np.zeros(empty_samples.shape[1], dtype=np.int64)
+        self.default_threshold = default_threshold
+        self.noise = self.__noise_floor(empty_samples)
+        self.signal = None
+        if occupied_samples is not None and occupied_mask is not None and occupied_mask.any():
+            occupied_noise = self.__noise_floor(occupied_samples)
+            self.noise[occupied_mask] = np.maximum(self.noise[occupied_mask], occupied_noise[occupied_mask])
+            self.signal = self.__signal(empty_samples, occupied_samples, occupied_mask, self.groups)
+        if self.signal is None:
+            self.thresholds = np.maximum(self.noise, default_threshold)
+        else:
+            self.thresholds = np.maximum(self.noise, self.noise + self.SIGNAL_FRACTION * (self.signal - self.noise))
+        logger.info(f'Field thresholds: {np.round(self.thresholds, 1).tolist()}')
+
+    @staticmethod
+    def __noise_floor(samples: np.ndarray) -> np.ndarray:
+        if len(samples) < 2:
+            return np.zeros(samples.shape[1])
+        distances = np.sqrt(((samples[1:] - samples[:-1]) ** 2).sum(axis=2))
+        return distances.mean(axis=0) + FieldStatistics.NOISE_SIGMAS * distances.std(axis=0)
+
+    @staticmethod
+    def __signal(empty_samples, occupied_samples, occupied_mask, groups) -> np.ndarray:
+        signal = np.sqrt(((occupied_samples.mean(axis=0) - empty_samples.mean(axis=0)) ** 2).sum(axis=1))
+        fallback = np.median(signal[occupied_mask])
+        for group in np.unique(groups):
+            known = occupied_mask & (groups == group)
+            unknown = ~occupied_mask & (groups == group)
+            signal[unknown] = np.median(signal[known]) if known.any() else fallback
+        return signal
+
+
+class RoiSampler:
+    """Caches the pixel indices of all field ROIs per image shape, so all fields are averaged in one pass"""
+
+    def __init__(self):
+        self.__cache = {}
+
+    def __indices(self, fields: List[ChessBoardField], shape) -> Tuple[np.ndarray, np.ndarray]:
+        key = (tuple(shape[:2]), tuple((f.roi, f.radius, f.shape[:2]) for f in fields))
+        cached = self.__cache.get(key)
+        if cached is not None:
+            return cached
+        width, height = shape[:2]
+        mask = np.zeros((width, height), np.uint8)
+        indices = []
+        for field in fields:
+            ratio_x, ratio_y = field.get_ratio(width, height)
+            rescaled_roi = (int(field.roi[0] * ratio_x), int(field.roi[1] * ratio_y))
+            cv.circle(mask, rescaled_roi, field.radius, 255, -1)
+            indices.append(np.flatnonzero(mask))
+            cv.circle(mask, rescaled_roi, field.radius, 0, -1)
+        labels = np.repeat(np.arange(len(fields)), [len(i) for i in indices])
+        cached = (np.concatenate(indices) if indices else np.zeros(0, np.int64), labels)
+        self.__cache = {key: cached}
+        return cached
+
+    def sums(self, fields: List[ChessBoardField], image: np.ndarray, valid_only=False) -> \
+            Tuple[np.ndarray, np.ndarray]:
+        indices, labels = self.__indices(fields, image.shape)
+        pixels = image.reshape(image.shape[0] * image.shape[1], -1)[indices].astype(np.float64)
+        if valid_only:
+            weights = (pixels > 0).all(axis=1).astype(np.float64)
+        else:
+            weights = np.ones(len(pixels))
+        counts = np.bincount(labels, weights=weights, minlength=len(fields))
+        sums = np.stack([np.bincount(labels, weights=pixels[:, c] * weights, minlength=len(fields))
+                         for c in range(pixels.shape[1])], axis=1)
+        return sums, counts
+
+    def means(self, fields: List[ChessBoardField], image: np.ndarray, valid_only=False) -> np.ndarray:
+        sums, counts = self.sums(fields, image, valid_only)
+        return np.divide(sums, counts[:, None], out=np.zeros_like(sums), where=counts[:, None] > 0)
+
+
+class DetectorStage(ABC):
+    """A single strategy of the cascade. Stages declare their relative cost and score every field."""
+    VALID_CHANGE_COUNTS = (2, 3, 4)
+    name = 'stage'
+    cost = 1.0
+
+    def __init__(self, threshold: float, full_margin: float = 0.25):
+        self.threshold = threshold
+        self.full_margin = full_margin
+
+    @abstractmethod
+    def scores(self, fields: List[ChessBoardField], previous, current, previous_depth=None, current_depth=None) \
+            -> Optional[np.ndarray]:
+        pass
+
+    def confidence(self, scores: np.ndarray) -> float:
+        changed = scores > self.threshold
+        if int(changed.sum()) not in self.VALID_CHANGE_COUNTS:
+            return 0.0
+        lowest_changed = scores[changed].min()
+        highest_unchanged = scores[~changed].max() if (~changed).any() else 0.0
+        margin = min(lowest_changed - self.threshold, self.threshold - highest_unchanged) / self.threshold
+        return float(np.clip(margin / self.full_margin, 0.0, 1.0))
+
+    def detect(self, fields: List[ChessBoardField], previous, current, previous_depth=None, current_depth=None) \
+            -> Optional[ChangeDetection]:
+        start = time.perf_counter()
+        scores = self.scores(fields, previous, current, previous_depth, current_depth)
+        if scores is None:
+            return None
+        return ChangeDetection(self.name, fields, scores, self.threshold, self.confidence(scores),
+                               time.perf_counter() - start)
+
+
+class ColorDiffStage(DetectorStage):
+    """Euclidean distance between the mean ROI colors of both images
+
+    If per field thresholds are given, the distances are normalized to them and rescaled to the global threshold.
+    """
+    name = 'color'
+    cost = 1.0
+
+    def __init__(self, threshold: float, full_margin: float = 0.25, field_thresholds: Optional[np.ndarray] = None):
+        super().__init__(threshold, full_margin)
+        self.field_thresholds = field_thresholds
+        self.sampler = RoiSampler()
+
+    def scores(self, fields, previous, current, previous_depth=None, current_depth=None):
+        if previous is None or current is None or previous.shape != current.shape:
+            return None
+        color_previous = np.trunc(self.sampler.means(fields, previous))
+        color_current = np.trunc(self.sampler.means(fields, current))
+        distances = np.sqrt(((color_current - color_previous) ** 2).sum(axis=1))
+        if self.field_thresholds is None:
+            return distances
+        if len(self.field_thresholds) != len(fields):
+            logger.warning(f'Got {len(self.field_thresholds)} field thresholds for {len(fields)} fields. '
+                           f'Using the global threshold')
+            return distances
+        return distances * self.threshold / self.field_thresholds
+
+
+class DepthDeltaStage(DetectorStage):
+    """Absolute change of the mean ROI depth. Invalid (zero) depth pixels are ignored"""
+    name = 'depth'
+    cost = 2.0
+
+    def __init__(self, threshold: float = 15.0, full_margin: float = 0.25):
+        super().__init__(threshold, full_margin)
+        self.sampler = RoiSampler()
+
+    def scores(self, fields, previous, current, previous_depth=None, current_depth=None):
+        if not isinstance(previous_depth, np.ndarray) or not isinstance(current_depth, np.ndarray) \
+                or previous_depth.shape != current_depth.shape:
+            return None
+        sums_previous, counts_previous = self.sampler.sums(fields, previous_depth, valid_only=True)
+        sums_current, counts_current = self.sampler.sums(fields, current_depth, valid_only=True)
+        valid = (counts_previous > 0) & (counts_current > 0)
+        scores = np.zeros(len(fields))
+        scores[valid] = np.abs(sums_current[valid, 0] / counts_current[valid] -
+                               sums_previous[valid, 0] / counts_previous[valid])
+        return scores
+
+
+class PieceDetectorStage(DetectorStage):
+    """Compares the field occupancy found by an `obj_recognition.nn` piece detector in both images"""
+    name = 'piece_detector'
+    cost = 100.0
+
+    def __init__(self, detector, threshold: float = 0.5, full_margin: float = 0.25):
+        super().__init__(threshold, full_margin)
+        self.detector = detector
+
+    def occupancy(self, fields: List[ChessBoardField], image) -> Tuple[np.ndarray, np.ndarray]:
+        boxes, labels, scores = self.detector.predict(image)
+        width, height = image.shape[:2]
+        contours = [field.rescaled_contour(width, height).astype(np.float32) for field in fields]
+        occupancy = np.zeros(len(fields), dtype=np.int64)
+        certainty = np.zeros(len(fields))
+        for box, label, score in zip(boxes, labels, scores):
+            base = (float(box[0] + box[2]) / 2, float(box[1] + 0.75 * (box[3] - box[1])))
+            for i, contour in enumerate(contours):
+                if cv.pointPolygonTest(contour, base, False) >= 0:
+                    if score > certainty[i]:
+                        occupancy[i] = int(label)
+                        certainty[i] = float(score)
+                    break
+        return occupancy, certainty
+
+    def scores(self, fields, previous, current, previous_depth=None, current_depth=None):
+        if previous is None or current is None:
+            return None
+        occupancy_previous, certainty_previous = self.occupancy(fields, previous)
+        occupancy_current, certainty_current = self.occupancy(fields, current)
+        differs = occupancy_previous != occupancy_current
+        return np.where(differs, np.maximum(certainty_previous, certainty_current), 0.0)
+
+
+class CascadedChangeDetector:
+    """Runs the stages from cheapest to most expensive and stops as soon as one is confident enough"""
+
+    def __init__(self, stages: List[DetectorStage], min_confidence: float = 0.5):
+        self.stages = sorted(stages, key=lambda stage: stage.cost)
+        self.min_confidence = min_confidence
+        self.last_detection: Optional[ChangeDetection] = None
+
+    @staticmethod
+    def create(color_threshold: float, piece_detector=None, depth_threshold: float = 15.0,
+               min_confidence: float = 0.5, field_thresholds: Optional[np.ndarray] = None) -> CascadedChangeDetector:
+        stages = [ColorDiffStage(color_threshold, field_thresholds=field_thresholds), DepthDeltaStage(depth_threshold)]
+        if piece_detector is not None:
+            stages.append(PieceDetectorStage(piece_detector))
+        return CascadedChangeDetector(stages, min_confidence)
+
+    def detect(self, fields: List[ChessBoardField], previous, current, previous_depth=None, current_depth=None) \
+            -> ChangeDetection:
+        best = None
+        for stage in self.stages:
+            detection = stage.detect(fields, previous, current, previous_depth, current_depth)
+            if detection is None:
+                logger.info(f'Stage "{stage.name}" skipped, input not available')
+                continue
+            logger.info(f'Stage "{stage.name}" (cost {stage.cost}): {detection}, '
+                        f'took {detection.duration * 1000: .1f} ms')
+            if best is None or detection.confidence > best.confidence:
+                best = detection
+            if detection.confidence >= self.min_confidence:
+                break
+        if best is None:
+            raise RuntimeError('No change detector stage could process the given input')
+        logger.info(f'Using change detection of stage "{best.stage}" with confidence {best.confidence: .2f}')
+        self.last_detection = best
+        return best
@@ -7,13 +7,15 @@ __all__ = [
 
 import cv2 as cv
 import numpy as np
-from typing import List, Tuple
+from typing import List, Tuple, Optional
 import pickle
 from pathlib import Path
 from queue import PriorityQueue
 import logging
 import time
 from chesster.obj_recognition.chessboard_field import ChessBoardField
+from chesster.obj_recognition.change_detector import CascadedChangeDetector, ColorDiffStage, FieldStatistics, RoiSampler
+from chesster.obj_recognition.piece_classifier import HeightProfile, PieceHeightClassifier
 from chesster.master.game_state import PieceColor
 from matplotlib import pyplot as plt
 from io import StringIO
@@ -23,6 +25,7 @@ logger = logging.getLogger(__name__)
 
 class ChessBoard:
     CHANGE_THRESHOLD = 43
+    PIECE_CONFIDENCE = 0.5
 
     def __init__(self, fields: List[ChessBoardField], image, depth_map, chessboard_edges, scaling_factor_width,
                  scaling_factor_height) -> None:
@@ -41,7 +44,10 @@ class ChessBoard:
         self.scaling_factor_width = scaling_factor_width
         self.scaling_factor_height = scaling_factor_height
         self.color = 'w'
-        
+        self.field_statistics: Optional[FieldStatistics] = None
+        self.piece_profiles = None
+        self.mismatched_fields = []
+
 
     @property
     def edges(self):
@@ -60,6 +66,35 @@ class ChessBoard:
         for field in self.fields:
             field.draw(image)
 
+    @property
+    def field_thresholds(self) -> Optional[np.ndarray]:
+        return None if self.field_statistics is None else self.field_statistics.thresholds
+
+    def record_statistics(self, empty_images=None, occupied_images=None):
+        """Records the per field noise of several empty frames and frames with all pieces at their start position"""
+        sampler = RoiSampler()
+        previous = self.field_statistics
+        if empty_images:
+            empty_samples = np.array([np.trunc(sampler.means(self.fields, image)) for image in empty_images])
+        elif previous is not None:
+            empty_samples = previous.empty_samples
+        else:
+            raise ValueError('Field statistics need at least one set of empty frames')
+        occupied_samples = previous.occupied_samples if previous is not None else None
+        if occupied_images:
+            occupied_samples = np.array([np.trunc(sampler.means(self.fields, image)) for image in occupied_images])
+        occupied_mask = np.array([field.row in (1, 2, 7, 8) for field in self.fields])
+        groups = np.array([(ord(field.col) - ord('a') + field.row) % 2 for field in self.fields])
+        self.field_statistics = FieldStatistics(empty_samples, occupied_samples, occupied_mask, groups,
+                                                ChessBoard.CHANGE_THRESHOLD)
+
+    def learn_piece_profiles(self, depth_map, piece_classifier: PieceHeightClassifier = None):
+        """Learns the height profile of every piece type from a depth frame with all pieces at their start position"""
+        if piece_classifier is None:
+            piece_classifier = PieceHeightClassifier()
+        profile = piece_classifier.profile(self.fields, self.depth_map, depth_map)
+        self.piece_profiles = piece_classifier.learn(profile)
+
     def save(self, path: Path):
         with open(path, 'wb') as dest:
             pickle.dump(self, dest)
@@ -77,6 +112,12 @@ class ChessBoard:
         with open(path, 'rb') as src:
             board = pickle.load(src)
             logger.info(f'Successfully loaded chess data from {path}')
+        if not hasattr(board, 'field_statistics'):
+            logger.info('No field statistics recorded, using the global change threshold')
+            board.field_statistics = None
+        if not hasattr(board, 'piece_profiles'):
+            board.piece_profiles = None
+            board.mismatched_fields = []
         return board
 
     def start(self, com_color='w', used_color='w'):
@@ -110,46 +151,68 @@ class ChessBoard:
         self.board_matrix.append([x.state for x in self.fields])
         self.robot_color = used_color
 
-    def determine_changes(self, previous, current, current_player_color: str, debug=True, promotion_dialog = None):
+    def determine_changes(self, previous, current, current_player_color: str, debug=True, promotion_dialog = None,
+                          previous_depth=None, current_depth=None, change_detector: CascadedChangeDetector = None,
+                          piece_classifier: PieceHeightClassifier = None):
         self.capture = False
         self.promoting = False
         self.state_change, distances, largest_field, second_largest_field = \
-            self.__extract_changes(self.fields, previous, current)
-        return self.__extract_move(previous, current, self.state_change, distances, largest_field, second_largest_field,
-                                   current_player_color, promotion_dialog)
+            self.__extract_changes(self.fields, previous, current, previous_depth, current_depth, change_detector,
+                                   self.field_thresholds)
+        height_profile = None
+        if piece_classifier is not None and current_depth is not None and self.depth_map is not None:
+            height_profile = piece_classifier.profile(self.fields, self.depth_map, current_depth)
+        ret = self.__extract_move(previous, current, self.state_change, distances, largest_field, second_largest_field,
+                                  current_player_color, promotion_dialog, height_profile, piece_classifier)
+        if height_profile is not None:
+            self.verify_state(height_profile, piece_classifier)
+        return ret
+
+    def verify_state(self, height_profile: HeightProfile, piece_classifier: PieceHeightClassifier):
+        self.mismatched_fields = piece_classifier.mismatches(height_profile, ChessBoard.PIECE_CONFIDENCE)
+        if self.mismatched_fields:
+            logger.warning(f'Board state differs from the height profile at: '
+                           f'{[(field.position, field.state, piece) for field, piece in self.mismatched_fields]}')
+        return self.mismatched_fields
+
+    @staticmethod
+    def __resolve_by_height(field_one: ChessBoardField, field_two: ChessBoardField, height_profile: HeightProfile,
+                            piece_classifier: PieceHeightClassifier):
+        if height_profile is None:
+            return None
+        occupied, confidence = piece_classifier.occupied(height_profile)
+        one, two = height_profile.index(field_one), height_profile.index(field_two)
+        if occupied[one] == occupied[two] or min(confidence[one], confidence[two]) < ChessBoard.PIECE_CONFIDENCE:
+            return None
+        logger.info(f'Move direction resolved by height profile: {height_profile.peak[one]}, {height_profile.peak[two]}')
+        return (field_one, field_two) if occupied[one] else (field_two, field_one)
+
+    def __classified_piece(self, field: ChessBoardField, height_profile: HeightProfile,
+                           piece_classifier: PieceHeightClassifier) -> Optional[str]:
+        # Nur mit eingelernten Figurenhöhen ("Record pieces"), sonst entscheidet der Spieler im Dialog
+        if height_profile is None or self.piece_profiles is None:
+            return None
+        piece, confidence = piece_classifier.classify_field(height_profile, field)
+        if confidence < ChessBoard.PIECE_CONFIDENCE or piece in ('.', 'p', 'k'):
+            return None
+        return piece
 
     @staticmethod
-    def __extract_changes(fields: List[ChessBoardField], previous_image, current_image) -> \
+    def __extract_changes(fields: List[ChessBoardField], previous_image, current_image, previous_depth=None,
+                          current_depth=None, change_detector: CascadedChangeDetector = None,
+                          field_thresholds: Optional[np.ndarray] = None) -> \
             Tuple[List[ChessBoardField], List[float], ChessBoardField, ChessBoardField]:
-        distances = []
-        state_changes = []
-        largest_dist = 0
-        second_largest_dist = 0
-        largest_field = None
-        second_largest_field = None
-        for field in fields:
-            color_previous = field.roi_color(previous_image)
-            color_current = field.roi_color(current_image)
-            total = 0
-            for i in range(3):
-                total += (color_current[i] - color_previous[i]) ** 2
-            distance = np.sqrt(total)
-            if distance > ChessBoard.CHANGE_THRESHOLD:
-                distances.append(distance)
-                state_changes.append(field)
-            if distance > largest_dist:
-                second_largest_field = largest_field
-                second_largest_dist = largest_dist
-                largest_dist = distance
-                largest_field = field
-            elif distance > second_largest_dist:
-                second_largest_dist = distance
-                second_largest_field = field
+        if change_detector is None:
+            change_detector = CascadedChangeDetector([ColorDiffStage(ChessBoard.CHANGE_THRESHOLD,
+                                                                     field_thresholds=field_thresholds)])
+        detection = change_detector.detect(fields, previous_image, current_image, previous_depth, current_depth)
+        state_changes, distances, largest_field, second_largest_field = detection.as_changes()
         logger.info(f'Total changes found: {len(state_changes)}, States: {list(zip(state_changes, distances))}')
         return state_changes, distances, largest_field, second_largest_field
 
     def __extract_move(self, previous, current, state_change, distances, largest_field, second_largest_field,
-                       current_player_color: str, promotion_dialog= None):
+                       current_player_color: str, promotion_dialog= None, height_profile: HeightProfile = None,
+                       piece_classifier: PieceHeightClassifier = None):
         failure_flag = False
         total_changes = len(state_change)
         if total_changes == 3:
@@ -306,39 +369,36 @@ class ChessBoard:
         if total_changes == 2:
             field_one = largest_field
             field_two = second_largest_field
-            one_curr = field_one.roi_color(current)
-            two_curr = field_two.roi_color(current)
-            sum_curr1 = 0
-            sum_curr2 = 0
-            for i in range(3):
-                sum_curr1 += (one_curr[i] - field_one.empty_color[i]) ** 2
-                sum_curr2 += (two_curr[i] - field_two.empty_color[i]) ** 2
-            dist_curr1 = np.sqrt(sum_curr1)
-            dist_curr2 = np.sqrt(sum_curr2)
-            logger.info(f'Distance of field one - empty_color: {dist_curr1}')
-            logger.info(f'Distance of field two - empty_color: {dist_curr2}')
-            if current_player_color == PieceColor.WHITE:
-                if dist_curr1 < dist_curr2:
-                    self.move = self.check_piece_capture(field_two, field_one)
-                    field_two.state = field_one.state
-                    field_one.state = '.'
-                    self.move = self.check_piece_promotion(self.move, field_two, promotion_dialog)
-                else:
-                    self.move = self.check_piece_capture(field_one, field_two)
-                    field_one.state = field_two.state
-                    field_two.state = '.'
-                    self.move = self.check_piece_promotion(self.move, field_one, promotion_dialog)
+            resolved = self.__resolve_by_height(field_one, field_two, height_profile, piece_classifier)
+            if resolved is not None:
+                field_to, field_from = resolved
             else:
-                if dist_curr1 > dist_curr2:
-                    self.move = self.check_piece_capture(field_one, field_two)
-                    field_one.state = field_two.state
-                    field_two.state = '.'
-                    self.move = self.check_piece_promotion(self.move, field_one, promotion_dialog)
+                one_curr = field_one.roi_color(current)
+                two_curr = field_two.roi_color(current)
+                sum_curr1 = 0
+                sum_curr2 = 0
+                for i in range(3):
+                    sum_curr1 += (one_curr[i] - field_one.empty_color[i]) ** 2
+                    sum_curr2 += (two_curr[i] - field_two.empty_color[i]) ** 2
+                dist_curr1 = np.sqrt(sum_curr1)
+                dist_curr2 = np.sqrt(sum_curr2)
+                logger.info(f'Distance of field one - empty_color: {dist_curr1}')
+                logger.info(f'Distance of field two - empty_color: {dist_curr2}')
+                if current_player_color == PieceColor.WHITE:
+                    if dist_curr1 < dist_curr2:
+                        field_to, field_from = field_two, field_one
+                    else:
+                        field_to, field_from = field_one, field_two
                 else:
-                    self.move = self.check_piece_capture(field_two, field_one)
-                    field_two.state = field_one.state
-                    field_one.state = '.'
-                    self.move = self.check_piece_promotion(self.move, field_two, promotion_dialog)
+                    if dist_curr1 > dist_curr2:
+                        field_to, field_from = field_one, field_two
+                    else:
+                        field_to, field_from = field_two, field_one
+            self.move = self.check_piece_capture(field_to, field_from)
+            field_to.state = field_from.state
+            field_from.state = '.'
+            self.move = self.check_piece_promotion(self.move, field_to, promotion_dialog,
+                                                   self.__classified_piece(field_to, height_profile, piece_classifier))
         #if 2 > total_changes > 4:
         if total_changes > 4 or total_changes < 2:
             failure_flag = True
@@ -365,7 +425,8 @@ class ChessBoard:
             move_list = [f'{field_from.position}{field_to.position}']
         return move_list
 
-    def check_piece_promotion(self, moves: List[str], field_to: ChessBoardField, promotion_dialog_board = None):
+    def check_piece_promotion(self, moves: List[str], field_to: ChessBoardField, promotion_dialog_board = None,
+                              classified_piece: Optional[str] = None):
         self.promoting = False
         self.last_promotionfield = ""
         row_one = 8
@@ -378,12 +439,15 @@ class ChessBoard:
             self.promoting = True
             self.last_promotionfield = field_to
             self.last_promotionfield_state = self.last_promotionfield.state
-            # TODO: Get user input
-            promotion_dialog_board()
-            while self.last_promotionfield.state == self.last_promotionfield_state:
-                time.sleep(1)
-            selected_piece = self.last_promotionfield.state
-            logger.info(f'User selected piece: {selected_piece}')
+            if classified_piece is not None:
+                selected_piece = classified_piece.upper() if field_to.state.isupper() else classified_piece
+                logger.info(f'Promoted piece classified by height profile: {selected_piece}')
+            else:
+                promotion_dialog_board()
+                while self.last_promotionfield.state == self.last_promotionfield_state:
+                    time.sleep(1)
+                selected_piece = self.last_promotionfield.state
+                logger.info(f'User selected piece: {selected_piece}')
             field_to.state = selected_piece if field_to.state.isupper() else selected_piece
             if len(moves) == 2:
                 moves = [moves[0] + field_to.state, moves[1]]
@@ -102,6 +102,10 @@ class ChessBoardField:
         
         return np.amin(extracted[(mask == 255) & (extracted > 0)]), x, y, extracted, coords
 
+    def rescaled_contour(self, width, height):
+        ratio_x, ratio_y = self.get_ratio(width, height)
+        return np.array([(x[0] * ratio_x, x[1] * ratio_y) for x in self.contour])
+
     def get_ratio(self, current_width, current_height):
         return current_width / self.shape[0], current_height / self.shape[1]
 
@@ -8,6 +8,7 @@ import numpy as np
 from chesster.obj_recognition.chessboard import *
 from chesster.obj_recognition.chessboard_field import ChessBoardField
 import imutils as im
+import hashlib
 import logging
 from typing import List, Tuple
 from pathlib import Path
@@ -44,49 +45,108 @@ class Line:
 
 
 class ChessboardRecognition:
+    """Chessboard recognition pipeline, split into the stages normalize, mask, warp, edges, lines, corners and fields
+
+    Every stage caches its last result keyed by the input image, its parameters and the upstream stages, so changing
+    e.g. the Canny thresholds only recomputes edges, lines, corners and fields. The intermediate images of all stages
+    are kept in memory (debug_images) instead of being plotted.
+    """
     DEFAULT_IMAGE_SIZE = (400, 400)
     DEDUPE_CORNER_RANGE = 15
     CHESSBOARD_EDGES_OFFSET = 0
+    STAGES = ('normalize', 'mask', 'warp', 'edges', 'lines', 'corners', 'fields')
+    DEFAULT_PARAMETERS = {
+        'normalize': {'kernel_size': (5, 5), 'sigma': 1.0, 'amount': 5.0, 'threshold': 0, 'block_size': 125, 'c': 1},
+        'mask': {'epsilon': 0.05},
+        'warp': {'offset': CHESSBOARD_EDGES_OFFSET},
+        'edges': {'low': 70, 'high': 150},
+        'lines': {'rho': 1, 'theta': np.pi / 360, 'threshold': 70},
+        'corners': {'dedupe_range': DEDUPE_CORNER_RANGE},
+        'fields': {'row_tolerance': 10}
+    }
 
-    @staticmethod
-    def from_image(image, *, depth_map=None, debug=False) -> ChessBoard:
+    def __init__(self, **parameters):
+        self.parameters = {stage: dict(values) for stage, values in ChessboardRecognition.DEFAULT_PARAMETERS.items()}
+        for stage, values in parameters.items():
+            self.set_parameters(stage, **values)
+        self.__cache = {}
+        self.debug_images = {}
+
+    def set_parameters(self, stage: str, **values):
+        if stage not in self.parameters:
+            raise ValueError(f'Unknown recognition stage "{stage}", expected one of {ChessboardRecognition.STAGES}')
+        unknown = set(values) - set(self.parameters[stage])
+        if unknown:
+            raise ValueError(f'Unknown parameters {sorted(unknown)} for recognition stage "{stage}"')
+        self.parameters[stage].update(values)
+
+    def __run_stage(self, stage: str, upstream_key, function, *inputs):
+        params = self.parameters[stage]
+        key = (upstream_key, stage, tuple(sorted(params.items())))
+        cached = self.__cache.get(stage)
+        if cached is not None and cached[0] == key:
+            logger.debug(f'Using cached recognition stage "{stage}"')
+            return key, cached[1]
+        logger.debug(f'Running recognition stage "{stage}" with {params}')
+        result, debug_image = function(*inputs, **params)
+        self.__cache[stage] = (key, result)
+        self.debug_images[stage] = debug_image
+        return key, result
+
+    def recognize(self, image, depth_map=None) -> ChessBoard:
         logger.info('Started Chessboard recognition')
-        original_image = image.copy()
-        adaptive_thresh, image = ChessboardRecognition.__normalize_image(image, debug)
-        mask, chessboard_edge = ChessboardRecognition.__initialize_mask(adaptive_thresh, image, debug)
-        trans_image, trans_matrix = ChessboardRecognition.__get_transformed_image(image, chessboard_edge, debug)
-        edges, color_edges = ChessboardRecognition.__find_edges(trans_image, debug)
-        horizontal_lines, vertical_lines, line_image = ChessboardRecognition.__find_lines(edges, color_edges, trans_image, debug)
-        corners = ChessboardRecognition.__find_corners(horizontal_lines, vertical_lines, color_edges, debug)
-        fields = ChessboardRecognition.__find_fields(corners, color_edges, debug)
-        transformed_fields, retrans_image = ChessboardRecognition.__get_retransformed_image(trans_image, trans_matrix, *image.shape[:2], fields, debug=debug)
+        key = (image.shape, hashlib.blake2b(np.ascontiguousarray(image).tobytes(), digest_size=16).hexdigest())
+        key, (adaptive_thresh, normalized) = self.__run_stage('normalize', key, ChessboardRecognition.__normalize_image,
+                                                               image)
+        key, (mask, chessboard_edge) = self.__run_stage('mask', key, ChessboardRecognition.__initialize_mask,
+                                                        adaptive_thresh, normalized)
+        key, (trans_image, trans_matrix) = self.__run_stage('warp', key, ChessboardRecognition.__get_transformed_image,
+                                                            normalized, chessboard_edge)
+        key, (edges, color_edges) = self.__run_stage('edges', key, ChessboardRecognition.__find_edges, trans_image)
+        key, (horizontal_lines, vertical_lines) = self.__run_stage('lines', key, ChessboardRecognition.__find_lines,
+                                                                   edges, trans_image)
+        key, (corners, corner_image) = self.__run_stage('corners', key, ChessboardRecognition.__find_corners,
+                                                        horizontal_lines, vertical_lines, color_edges)
+        key, fields = self.__run_stage('fields', key, ChessboardRecognition.__find_fields, corners, corner_image)
+        transformed_fields, retrans_image = ChessboardRecognition.__get_retransformed_image(
+            trans_image, trans_matrix, *normalized.shape[:2], fields)
+        self.debug_images['retransform'] = retrans_image
         extracted_map = None
-        width, height = original_image.shape[:2]
-        rescaled_width, rescaled_height = image.shape[:2]
+        width, height = image.shape[:2]
+        rescaled_width, rescaled_height = normalized.shape[:2]
         scale_width, scale_height = width / rescaled_width, height / rescaled_height
         rescaled_chessboard_edges = list(
             map(lambda x: np.ceil([x[0] * scale_width, x[1] * scale_height]), chessboard_edge))
         if depth_map is not None:
-            extracted_map = ChessboardRecognition.__extract_depth(depth_map, rescaled_chessboard_edges, debug=True)
+            extracted_map = ChessboardRecognition.__extract_depth(depth_map, rescaled_chessboard_edges)
+            self.debug_images['depth'] = extracted_map
         logger.info('Chessboard recognition complete')
-        return ChessBoard(transformed_fields, image, extracted_map, chessboard_edge, scale_width, scale_height)
+        return ChessBoard(transformed_fields, normalized.copy(), extracted_map, chessboard_edge.copy(), scale_width,
+                          scale_height)
 
     @staticmethod
-    def __normalize_image(image, debug=False):
-        image = ChessboardRecognition.__unsharp_mask(image)
+    def from_image(image, *, depth_map=None, debug=False) -> ChessBoard:
+        recognition = ChessboardRecognition()
+        board = recognition.recognize(image, depth_map=depth_map)
+        if debug:
+            for stage, debug_image in recognition.debug_images.items():
+                color_map = cv.COLOR_BGR2RGB if debug_image.ndim == 3 else None
+                ChessboardRecognition.debug_plot(debug_image, color_map, stage, cmap='gray')
+        return board
+
+    @staticmethod
+    def __normalize_image(image, kernel_size, sigma, amount, threshold, block_size, c):
+        image = ChessboardRecognition.__unsharp_mask(image, kernel_size, sigma, amount, threshold)
         img = im.resize(image, width=ChessboardRecognition.DEFAULT_IMAGE_SIZE[0], height=ChessboardRecognition.DEFAULT_IMAGE_SIZE[1])
         gray = cv.cvtColor(img, cv.COLOR_BGR2GRAY)
-        adaptive_threshold = cv.adaptiveThreshold(gray, 255, cv.ADAPTIVE_THRESH_GAUSSIAN_C, cv.THRESH_BINARY, 125, 1)
-        ChessboardRecognition.__auto_debug(debug, adaptive_threshold, None, title='Adaptive Threshold', cmap='gray')
-        return adaptive_threshold, img
+        adaptive_threshold = cv.adaptiveThreshold(gray, 255, cv.ADAPTIVE_THRESH_GAUSSIAN_C, cv.THRESH_BINARY, block_size, c)
+        return (adaptive_threshold, img), adaptive_threshold
 
     @staticmethod
-    def __initialize_mask(adaptive_thresh, image, debug=False):
+    def __initialize_mask(adaptive_thresh, image, epsilon):
         contours, hierarchy = cv.findContours(adaptive_thresh, cv.RETR_TREE, cv.CHAIN_APPROX_SIMPLE)
-        img_contours = image.copy()
-        largest_ratio = largest_area = largest_perimeter = 0
+        largest_ratio = largest_perimeter = 0
         largest = None
-        largest_index = -1
         for index in range(len(contours)):
             area = cv.contourArea(contours[index])
             perimeter = cv.arcLength(contours[index], True)
@@ -96,47 +156,40 @@ class ChessboardRecognition:
                     largest = contours[index]
                     largest_ratio = ratio
                     largest_perimeter = perimeter
-                    largest_area = area
-                    largest_index = index
-        cv.drawContours(img_contours, [largest], -1, (0, 255, 255), 1)
-        epsilon = 0.05 * largest_perimeter
-        chessboard_edge = cv.approxPolyDP(largest, epsilon, True)
+        chessboard_edge = cv.approxPolyDP(largest, epsilon * largest_perimeter, True)
         mask = np.zeros(image.shape[:2]).astype(np.uint8) * 128
         cv.fillConvexPoly(mask, chessboard_edge, 255, 1)
         extracted = np.zeros_like(image)
         extracted[mask == 255] = image[mask == 255]
         extracted[np.where((extracted == [125, 125, 125]).all(axis=2))] = [0, 0, 20]
         chessboard_edge = np.array(chessboard_edge).astype(np.float32).squeeze()
-        ChessboardRecognition.__auto_debug(debug, extracted, None, title='Extracted Mask', cmap='gray')
-        return extracted, chessboard_edge
+        return (extracted, chessboard_edge), extracted
 
     @staticmethod
-    def __get_transformed_image(image, chessboard_edge, debug=False):
+    def __get_transformed_image(image, chessboard_edge, offset):
         width, height = image.shape[:2]
-        o = ChessboardRecognition.CHESSBOARD_EDGES_OFFSET
+        o = offset
         chessboard_edge = np.array([chessboard_edge[0] - [o, o], chessboard_edge[1] + [o, -o],
                                     chessboard_edge[2] + [o, o], chessboard_edge[3] + [-o, o]]).astype(np.float32)
         transformation_matrix = cv.getPerspectiveTransform(chessboard_edge, np.array([[0, 0], [width, 0],
             [width, height], [0, height]]).astype(np.float32))
         wrapped_image = cv.warpPerspective(image, transformation_matrix, (width, height))
-        ChessboardRecognition.__auto_debug(debug, wrapped_image, title='')
-        return wrapped_image, transformation_matrix
+        return (wrapped_image, transformation_matrix), wrapped_image
 
     @staticmethod
-    def __find_edges(image, debug=False):
+    def __find_edges(image, low, high):
         gray = cv.cvtColor(image, cv.COLOR_BGR2GRAY)
-        edges = cv.Canny(gray, 70, 150)
+        edges = cv.Canny(gray, low, high)
         color_edges = cv.cvtColor(edges, cv.COLOR_GRAY2BGR)
-        ChessboardRecognition.__auto_debug(debug, edges, None, title='', cmap='gray')
-        return edges, color_edges
+        return (edges, color_edges), edges
 
     @staticmethod
-    def __find_lines(edges, color_edges, image, debug=False):
-        lines = cv.HoughLines(edges, 1, np.pi / 360, 70, None, 0, 0)
+    def __find_lines(edges, image, rho, theta, threshold):
+        lines = cv.HoughLines(edges, rho, theta, threshold, None, 0, 0)
         horizontal_lines = []
         vertical_lines = []
         copy = image.copy()
-        for l in lines:
+        for l in lines if lines is not None else []:
             rho, theta = l[0][0], l[0][1]
             a, b = np.cos(theta), np.sin(theta)
             x0, y0 = a * rho, b * rho
@@ -144,12 +197,12 @@ class ChessboardRecognition:
             cv.line(copy, pt1, pt2, (255, 0, 0), 2)
             line = Line(*pt1, *pt2)
             horizontal_lines.append(line) if line.grows() else vertical_lines.append(line)
-        ChessboardRecognition.__auto_debug(debug, copy, title='Lines')
-        return horizontal_lines, vertical_lines, copy
+        return (horizontal_lines, vertical_lines), copy
 
     @staticmethod
-    def __find_corners(horizontal_lines: List[Line], vertical_lines, color_edges, debug=False):
+    def __find_corners(horizontal_lines: List[Line], vertical_lines, color_edges, dedupe_range):
         corners = []
+        color_edges = color_edges.copy()
         height, width = color_edges.shape[:2]
         for h in horizontal_lines:
             for v in vertical_lines:
@@ -162,25 +215,24 @@ class ChessboardRecognition:
                 matching_flag = True
                 break
             for d in dedupe_corners:
-                if np.sqrt((d[0]-c[0])*(d[0]-c[0]) + (d[1]-c[1])*(d[1]-c[1])) < \
-                        ChessboardRecognition.DEDUPE_CORNER_RANGE:
+                if np.sqrt((d[0]-c[0])*(d[0]-c[0]) + (d[1]-c[1])*(d[1]-c[1])) < dedupe_range:
                     matching_flag = True
                     break
             if not matching_flag:
                 dedupe_corners.append(c)
         for d in dedupe_corners:
             cv.circle(color_edges, (d[0], d[1]), 5, (0, 0, 225))
-        ChessboardRecognition.__auto_debug(debug, color_edges)
-        return dedupe_corners
+        return (dedupe_corners, color_edges), color_edges
 
     @staticmethod
-    def __find_fields(corners: List[Tuple[float, float]], color_edges, debug=False):
-        corners.sort(key=lambda x: x[1])
+    def __find_fields(corners: List[Tuple[float, float]], color_edges, row_tolerance):
+        corners = sorted(corners, key=lambda x: x[1])
+        color_edges = color_edges.copy()
         rows = []
         for corner in corners:
             matching_flag = False
             for r in rows:
-                if abs(r - corner[1]) < 10:
+                if abs(r - corner[1]) < row_tolerance:
                     matching_flag = True
                     break
             if not matching_flag:
@@ -188,7 +240,7 @@ class ChessboardRecognition:
         fields = {}
         for corner in corners:
             for r in rows:
-                if abs(corner[1] - r) < 10:
+                if abs(corner[1] - r) < row_tolerance:
                     fields.setdefault(r, [])
                     fields[r].append(corner)
         rows = fields.values()
@@ -198,6 +250,9 @@ class ChessboardRecognition:
         letters = ''.join([chr(a) for a in range(97, 123)])
         numbers = [f'{a}' for a in range(1, 26)]
         fields = []
+        if len(rows) == 0:
+            logger.error('No rows of corners found')
+            return fields, color_edges
         max_rows = len(rows) - 1
         max_cols = len(rows[0]) - 1
         logger.info(f'Rows found: {len(rows)}, cols found: {len(rows[0])}. Consistent: '
@@ -217,11 +272,10 @@ class ChessboardRecognition:
                     fields.append(new_field)
                 except Exception as e:
                     logger.exception(f'{e}, {r}, {c}, rows: {len(rows)}, cols: {len(rows[0])}')
-        ChessboardRecognition.__auto_debug(debug, color_edges)
-        return fields
+        return fields, color_edges
 
     @staticmethod
-    def __get_retransformed_image(image, transformation_matrix, width, height, fields: List[ChessBoardField], debug=False):
+    def __get_retransformed_image(image, transformation_matrix, width, height, fields: List[ChessBoardField]):
         inverse_transform = np.linalg.inv(transformation_matrix)
         unwrapped = cv.warpPerspective(image, inverse_transform, (height, width))
         ret = []
@@ -233,7 +287,6 @@ class ChessboardRecognition:
             ret.append(new_field)
             new_field.draw(temp, (0, 255, 0), 2)
             field.draw_roi(temp, (0, 255, 0), 2)
-        ChessboardRecognition.__auto_debug(debug, temp, title='unwrapped')
         return ret, temp
 
     @staticmethod
@@ -249,21 +302,14 @@ class ChessboardRecognition:
         return sharpened
 
     @staticmethod
-    def __extract_depth(depth_map, edges, debug=False):
+    def __extract_depth(depth_map, edges):
         edges = np.expand_dims(edges, axis=1).astype(np.int32)
         mask = np.zeros(depth_map.shape[:2]).astype(np.uint8)
         cv.fillConvexPoly(mask, edges, 255, 1)
         extracted = np.zeros_like(depth_map)
         extracted[mask == 255] = depth_map[mask == 255]
-        if debug:
-            np.save('extracted_depth_map', extracted)
         return extracted
 
-    @staticmethod
-    def __auto_debug(debug, img, color_map=cv.COLOR_BGR2RGB, title=None, **kwargs):
-        if debug:
-            ChessboardRecognition.debug_plot(img, color_map=color_map, title=title, **kwargs)
-
     @staticmethod
     def debug_plot(img, color_map, title, **kwargs):
         plt.axis('off')
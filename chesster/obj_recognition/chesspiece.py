@@ -1,7 +1,8 @@
 class ChessPiece:
-    def __init__(self, position, coordinate, zenith, x, y):
+    def __init__(self, position, coordinate, zenith, x, y, roi=None):
         self.position = position
         self.coordinate = coordinate
         self.zenith = zenith
         self.x_cimg = x
         self.y_cimg = y
+        self.roi = roi
@@ -0,0 +1,68 @@
+from __future__ import annotations
+
+__all__ = [
+    'GameRecorder',
+    'find_games',
+    'read_frames'
+]
+
+import cv2 as cv
+import numpy as np
+import json
+import shutil
+import logging
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional, Union
+from chesster.obj_recognition.chessboard_field import ChessBoardField
+
+logger = logging.getLogger(__name__)
+
+FRAMES_FILE = 'frames.jsonl'
+CALIBRATION_FILE = 'chessboard.pkl'
+
+
+class GameRecorder:
+    """Archives the camera frames of a game together with the board state after every verified move
+
+    Every game gets its own directory in archive_path with a copy of the calibration data (chessboard.pkl), the color
+    image (NNNN.jpg) and depth map (NNNN.npy) of every frame and one JSON line per frame in frames.jsonl holding the
+    field states, the move and the FEN. ChessPieceDatasetGenerator turns the archive into labeled samples.
+    """
+
+    def __init__(self, archive_path: Union[str, Path], calibration_path: Union[str, Path], **info):
+        self.game_path = Path(archive_path) / datetime.now().strftime('%Y_%m_%d_%H_%M_%S')
+        self.game_path.mkdir(parents=True, exist_ok=True)
+        shutil.copy(calibration_path, self.game_path / CALIBRATION_FILE)
+        with open(self.game_path / 'game.json', 'w') as dest:
+            json.dump({'calibration': str(calibration_path), **info}, dest, indent=2)
+        self.frame = 0
+        logger.info(f'Recording game to {self.game_path}')
+
+    def record(self, image: np.ndarray, depth_map: Optional[np.ndarray], fields: List[ChessBoardField], move=None,
+               player: str = '', fen: str = ''):
+        name = f'{self.frame:04d}'
+        cv.imwrite(str(self.game_path / f'{name}.jpg'), image)
+        if depth_map is not None:
+            np.save(self.game_path / f'{name}.npy', depth_map)
+        frame = {
+            'frame': self.frame,
+            'image': f'{name}.jpg',
+            'depth': f'{name}.npy' if depth_map is not None else None,
+            'player': player,
+            'move': move,
+            'fen': fen,
+            'states': {field.position: field.state for field in fields}
+        }
+        with open(self.game_path / FRAMES_FILE, 'a') as dest:
+            dest.write(json.dumps(frame) + '\n')
+        self.frame += 1
+
+
+def find_games(archive_path: Union[str, Path]) -> List[Path]:
+    return sorted(path.parent for path in Path(archive_path).glob(f'*/{FRAMES_FILE}'))
+
+
+def read_frames(game_path: Union[str, Path]) -> List[Dict]:
+    with open(Path(game_path) / FRAMES_FILE) as src:
+        return [json.loads(line) for line in src if line.strip()]
@@ -1,12 +1,21 @@
 from chesster.obj_recognition.nn.models import create_model
 from chesster.obj_recognition.nn.utils import *
-from chesster.obj_recognition.nn.datasets import ChesspieceDataset
-from torch.utils.data import DataLoader
+from chesster.obj_recognition.nn.datasets import ChesspieceDataset, ShardedChesspieceDataset, preprocess_dataset
+from chesster.obj_recognition.nn.trainer import Trainer
+from chesster.obj_recognition.nn.benchmark import benchmark, compare_variants, write_results
+from chesster.obj_recognition.nn.export import export, input_size as model_input_size, INPUT_SIZES
+from chesster.obj_recognition.nn.detect import Detect
+from chesster.obj_recognition.nn.generate import ChessPieceDatasetGenerator
+from chesster.obj_recognition.nn.synthetic import SyntheticDatasetGenerator, extract_cutouts
+from chesster.obj_recognition.nn.square_classifier import SquareClassifier, SquareClassify, SquareCropDataset, \
+    square_collate_fn, train_squares, validate_squares
+from torch.utils.data import DataLoader, random_split
 import torch
 from matplotlib import pyplot as plt
 import time
-from tqdm.auto import tqdm
 import click
+import json
+import cv2 as cv
 import logging
 import os
 from pathlib import Path
@@ -14,100 +23,182 @@ from pathlib import Path
 logger = logging.getLogger(__name__)
 
 
-def train(train_data_loader, model, criterion=None):
-    logger.info('Started Training')
-    train_itr = 1
-    train_loss_list = []
-    train_lost_hist = Averager()
-    params = [p for p in model.parameters() if p.requires_grad]
-    optimizer = torch.optim.SGD(params, lr=0.001, momentum=0.9, weight_decay=0.005)
-    progress_bar = tqdm(train_data_loader, total=len(train_data_loader))
-    for i, data in enumerate(progress_bar):
-        images, targets = data
-        images = list(image.to(DEVICE) for image in images)
-        targets = [{k: v.to(DEVICE) for k, v in t.items()} for t in targets]
-        if criterion is None:
-            loss_dict = model(images, targets)
-            losses = sum(loss for loss in loss_dict.values())
-        else:
-            pred_loc, pred_sco = model(images)
-            losses = criterion(pred_loc, pred_sco, [target['boxes'] for target in targets],
-                               [target['labels'] for target in targets])
-        loss_value = losses.item()
-        train_loss_list.append(loss_value)
-        train_lost_hist.send(loss_value)
-        losses.backward()
-        optimizer.step()
-        train_itr += 1
-        progress_bar.set_description(desc=f'Loss: {loss_value: .4f}')
-    logger.info('Completed Training')
-    return train_loss_list, train_lost_hist
-
-
-def validate(valid_data_loader, model, criterion=None):
-    logger.info('Started Validation')
-    progress_bar = tqdm(valid_data_loader, total=len(valid_data_loader))
-    val_itr = 1
-    val_loss_list = []
-    val_loss_hist = Averager()
-    for i, data in enumerate(progress_bar):
-        images, targets = data
-        images = list(image.to(DEVICE) for image in images)
-        targets = [{k: v.to(DEVICE) for k, v in t.items()} for t in targets]
-        with torch.no_grad():
-            loss_dict = model(images, targets)
-        losses = sum(loss for loss in loss_dict.values())
-        loss_value = losses.item()
-        val_loss_list.append(loss_value)
-        val_loss_hist.send(loss_value)
-        val_itr += 1
-        progress_bar.set_description(desc=f'Loss: {loss_value: .4f}')
-    logger.info('Completed Validation')
-    return val_loss_list, val_loss_hist
+def square_main(action, image_path, label_path, num_epoch, batch_size, numb_workers, state_path, model_save_dir,
+                output=None):
+    if action == 'infer':
+        classifier = SquareClassify(Path(state_path))
+        results = {}
+        for path in sorted(Path(image_path).glob('*')):
+            image = cv.imread(str(path))
+            if image is None:
+                continue
+            start = time.time()
+            states, confidence = classifier.classify(image)
+            latency = (time.time() - start) * 1000
+            results[path.name] = {'placement': SquareClassify.to_placement(states),
+                                  'min_confidence': float(confidence.min()), 'latency_ms': latency}
+            logger.info(f'{path.name}: {results[path.name]["placement"]} '
+                        f'(min. confidence {results[path.name]["min_confidence"]:.3f}, {latency:.1f} ms)')
+        if output is not None:
+            with open(output, 'w') as dest:
+                json.dump(results, dest, indent=2)
+            logger.info(f'Wrote square classifier results to {output}')
+        return
+    model = SquareClassifier().to(DEVICE)
+    if state_path is not None:
+        model.load_state_dict(torch.load(Path(state_path).absolute(), map_location=DEVICE))
+    dataset = SquareCropDataset(image_path, label_path)
+    data_loader = DataLoader(dataset, batch_size=batch_size, shuffle=action == 'train', num_workers=numb_workers,
+                             collate_fn=square_collate_fn)
+    if action == 'test':
+        validate_squares(data_loader, model)
+        return
+    optimizer = torch.optim.Adam(model.parameters(), lr=0.001)
+    for epoch in range(0, num_epoch):
+        logger.info(f'Epoch: {epoch + 1} / {num_epoch}')
+        _, loss_hist = train_squares(data_loader, model, optimizer)
+        logger.info(f'Epoch: {epoch + 1}, Loss: {loss_hist.value: 3.2f}')
+    torch.save(model.state_dict(), f'{model_save_dir}/square_classifier.pth')
 
 
 @click.command()
-@click.option('--model', type=click.Choice(['rcnn', 'yolo', 'ssd']), default='rcnn', help='Type of model to use')
-@click.option('--action', required=True, type=click.Choice(['train', 'test']), help='What is my purpose?')
+@click.option('--model', type=click.Choice(['rcnn', 'yolo', 'ssd', 'square']), default='rcnn',
+              help='Type of model to use')
+@click.option('--action', required=True, type=click.Choice(['train', 'test', 'infer', 'preprocess', 'bench', 'export',
+                                                                 'label', 'cutouts', 'synthesize']),
+              help='What is my purpose?')
 @click.option('--num_epoch', default=10, help='Maximal number of epochs')
 @click.option('--batch_size', default=5, help='Dataloader batch size')
 @click.option('--numb_workers', default=2, help='Number of threads to use')
-@click.option('--image_path', required=True, help='Image path')
-@click.option('--label_path', required=True, help='Labels path')
+@click.option('--image_path', default=None, help='Image path')
+@click.option('--label_path', default=None, help='Labels path')
+@click.option('--shard_path', default=None,
+              help='Memory-mapped dataset shards, written by preprocess and read by train/test instead of the images')
+@click.option('--state_path', default=None,
+              help='Model weights to start from (train) or to use (infer, export), comma separated artifacts for bench')
 @click.option('--width', default=300, help='Image transform width')
 @click.option('--height', default=300, help='Image transform height')
+@click.option('--input_size', default=None, type=int,
+              help='Input size of the model for bench and export, default the training resolution of the weights')
+@click.option('--accumulation_steps', default=1, help='Number of batches to accumulate gradients over per step')
+@click.option('--valid_split', default=0.0, help='Fraction of the training data held out for validation')
+@click.option('--validate_every', default=1, help='Validate every n epochs')
+@click.option('--checkpoint_dir', default=None, help='Directory of the checkpoint and the trained weights')
+@click.option('--resume', is_flag=True, help='Resume training from the last checkpoint in checkpoint_dir')
+@click.option('--batch_sizes', default='1,4,8', help='Comma separated batch sizes timed by bench')
+@click.option('--threads', default=None, type=int, help='Number of torch threads used by bench')
+@click.option('--output', default=None, help='JSON file of the bench results or of the square classifier (infer)')
+@click.option('--export_dir', default=None, help='Directory of the exported artifacts')
+@click.option('--formats', default='torchscript', help='Comma separated export formats: torchscript, onnx')
+@click.option('--quantize', type=click.Choice(['none', 'dynamic', 'static']), default='none',
+              help='Also export an int8 variant, static needs calibration images')
+@click.option('--archive_path', default=None, help='Recorded games labeled by label')
+@click.option('--square_path', default=None, help='Also write rectified boards for the square classifier (label)')
+@click.option('--calibration_path', default=None, help='Calibration data (ChessBoard pickle) used by synthesize')
+@click.option('--cutout_path', default=None, help='Piece cutouts written by cutouts and used by synthesize')
+@click.option('--samples', default=1000, help='Number of images generated by synthesize')
+@click.option('--seed', default=0, help='Seed of the first image generated by synthesize')
 @click.option('--transform', is_flag=True, help='Transform Images for data augmentation')
 @click.option('-v', '--verbose', count=True, help='Set verbosity level')
-def main(model, action, image_path, label_path, width, height, transform, verbose, num_epoch, batch_size, numb_workers):
+def main(model, action, image_path, label_path, shard_path, state_path, width, height, input_size, accumulation_steps,
+         valid_split, validate_every, checkpoint_dir, resume, batch_sizes, threads, output, export_dir, formats,
+         quantize, archive_path, square_path, calibration_path, cutout_path, samples, seed, transform, verbose,
+         num_epoch, batch_size, numb_workers):
     if verbose > 0:
         logging.basicConfig(level=logging.INFO)
-    num_classes = len(CLASSES)
-    save_mode_epoch = 5
-    model, criterion = create_model(model_name=model, num_classes=num_classes)
     # model_save_dir = os.path.dirname(__file__)
     model_save_dir = Path(__file__).parent
-    if action == 'train':
-        transformer = get_train_transform if transform else None
-        data_shuffle = True
-        action_func = train
-    elif action == 'test':
-        transformer = None
-        data_shuffle = False
-        action_func = validate
+    if action == 'label':
+        if None in (archive_path, image_path, label_path):
+            raise click.UsageError('--archive_path, --image_path and --label_path are required for action "label"')
+        ChessPieceDatasetGenerator(archive_path, image_path, label_path, square_path, numb_workers).generate()
+        return
+    if action == 'cutouts':
+        if None in (archive_path, cutout_path):
+            raise click.UsageError('--archive_path and --cutout_path are required for action "cutouts"')
+        extract_cutouts(archive_path, cutout_path)
+        return
+    if action == 'synthesize':
+        if None in (calibration_path, cutout_path, image_path, label_path):
+            raise click.UsageError('--calibration_path, --cutout_path, --image_path and --label_path are required for '
+                                   'action "synthesize"')
+        SyntheticDatasetGenerator(calibration_path, cutout_path, image_path, label_path, numb_workers,
+                                  seed).generate(samples)
+        return
+    if action == 'preprocess':
+        if None in (image_path, label_path, shard_path):
+            raise click.UsageError('--image_path, --label_path and --shard_path are required for action "preprocess"')
+        preprocess_dataset(image_path, label_path, shard_path, width, height)
+        return
+    if shard_path is None or model == 'square':
+        if image_path is None:
+            raise click.UsageError(f'--image_path is required for action "{action}"')
+        if action in ('train', 'test', 'bench') and label_path is None:
+            raise click.UsageError(f'--label_path is required for action "{action}"')
+    if model == 'square':
+        if action == 'infer' and state_path is None:
+            raise click.UsageError('--state_path is required for action "infer"')
+        return square_main(action, image_path, label_path, num_epoch, batch_size, numb_workers, state_path,
+                           model_save_dir, output)
+    if action not in ('train', 'test', 'bench', 'export'):
+        raise ValueError(f'Unsupported action type for detection models: {action}')
+    if action in ('bench', 'export') and state_path is None:
+        raise click.UsageError(f'--state_path is required for action "{action}"')
+    if action == 'export':
+        calibration_batches = None
+        if quantize == 'static':
+            if image_path is None and shard_path is None:
+                raise click.UsageError('--image_path and --label_path or --shard_path are required to calibrate')
+            dataset = ShardedChesspieceDataset(shard_path) if shard_path is not None else \
+                ChesspieceDataset(image_path, label_path, width, height, [])
+            size = input_size or model_input_size(model, Path(state_path))
+            calibration_batches = [torch.nn.functional.interpolate(torch.stack(images), size=(size, size))
+                                   for images, _ in DataLoader(dataset, batch_size=batch_size, collate_fn=collate_fn)]
+        export(model, Path(state_path), Path(export_dir or model_save_dir), formats.split(','),
+               None if quantize == 'none' else quantize, calibration_batches, input_size)
+        return
+    transformer = get_train_transform if transform and action == 'train' else None
+    transforms = transformer() if transformer else None
+    if shard_path is not None:
+        dataset = ShardedChesspieceDataset(shard_path, transforms=transforms)
     else:
-        raise ValueError(f'Unsupported action type: {action}')
-    dataset = ChesspieceDataset(image_path, label_path, width, height, [], transforms=transformer())
-    data_loader = DataLoader(dataset, batch_size=batch_size, shuffle=data_shuffle, num_workers=numb_workers,
-                             collate_fn=collate_fn)
-    for epoch in range(0, num_epoch):
-        logger.info(f'Epoch: {epoch + 1} / {num_epoch}')
-        start = time.time()
-        loss_list, lost_hist = action_func(data_loader, model, criterion)
-        logger.info(f'Epoch: {epoch + 1}, Loss: {lost_hist.value: 3.2f}')
-        end = time.time()
-        logger.info(f'Epoch: {epoch + 1}, Duration: {((end - start) / 60): 3.2f} minutes')
-        if (epoch + 1) % save_mode_epoch == 0:
-            torch.save(model.state_dict(), f'{model_save_dir}/model_{epoch + 1}.pth')
+        dataset = ChesspieceDataset(image_path, label_path, width, height, [], transforms=transforms)
+    model_name = model
+    if action == 'bench':
+        if threads is not None:
+            torch.set_num_threads(threads)
+        results = [benchmark(Detect(model_name, Path(path), input_size=input_size), dataset,
+                             [int(b) for b in batch_sizes.split(',')]) for path in state_path.split(',')]
+        write_results({'variants': results, 'comparison': compare_variants(results)},
+                      output or f'bench_{model_name}.json')
+        return
+    model, criterion = create_model(model_name=model_name, num_classes=len(CLASSES))
+    if action == 'test':
+        if state_path is not None:
+            model.load_state_dict(torch.load(Path(state_path).absolute(), map_location=DEVICE))
+        data_loader = DataLoader(dataset, batch_size=batch_size, shuffle=False, num_workers=numb_workers,
+                                 collate_fn=collate_fn)
+        stats = Trainer(model_name, model, criterion).validate(data_loader)
+        logger.info(f'Validation {stats}')
+        return
+    # yolo ist vollständig konvolutionell und läuft in Detect mit der Auflösung des Trainings
+    train_size = dataset.width if model_name == 'yolo' else INPUT_SIZES[model_name]
+    valid_data_loader = None
+    if valid_split > 0:
+        # Fixed generator, so a resumed run holds out the same images
+        valid_size = max(1, int(len(dataset) * valid_split))
+        dataset, valid_dataset = random_split(dataset, [len(dataset) - valid_size, valid_size],
+                                              generator=torch.Generator().manual_seed(0))
+        valid_data_loader = DataLoader(valid_dataset, batch_size=batch_size, shuffle=False,
+                                       num_workers=numb_workers, collate_fn=collate_fn)
+    data_loader = DataLoader(dataset, batch_size=batch_size, shuffle=True, num_workers=numb_workers,
+                             collate_fn=collate_fn, pin_memory=DEVICE.type == 'cuda',
+                             persistent_workers=numb_workers > 0)
+    trainer = Trainer(model_name, model, criterion, checkpoint_dir=Path(checkpoint_dir or model_save_dir),
+                      accumulation_steps=accumulation_steps, validate_every=validate_every, input_size=train_size)
+    if not (resume and trainer.resume()) and state_path is not None:
+        model.load_state_dict(torch.load(Path(state_path).absolute(), map_location=DEVICE))
+    trainer.fit(data_loader, num_epoch, valid_data_loader)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,152 @@
+from chesster.obj_recognition.nn.utils import DEVICE, CLASSES
+from chesster.obj_recognition.nn.detect import Detect, Detection
+from chesster.obj_recognition.nn.ssd_utils import calculate_mAP
+from chesster.obj_recognition.nn.yolo_utils import ap_per_class, get_batch_statistics
+from typing import Dict, List, Optional, Sequence
+import numpy as np
+import torch
+import time
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+LABEL_MAP = {'background': 0, **{c: i + 1 for i, c in enumerate(CLASSES)}}
+REV_LABEL_MAP = {v: k for k, v in LABEL_MAP.items()}
+
+
+def to_frame(image: torch.Tensor) -> np.ndarray:
+    """Converts a dataset image (RGB CHW float in [0, 1]) to the BGR uint8 frame Detect expects"""
+    frame = image.permute(1, 2, 0).cpu().numpy()[..., ::-1]
+    return np.ascontiguousarray(np.clip(frame * 255.0 + 0.5, 0, 255).astype(np.uint8))
+
+
+def percentiles(values: Sequence[float]) -> Dict[str, float]:
+    values = np.asarray(values, dtype=np.float64) * 1000
+    if len(values) == 0:
+        return {'p50_ms': None, 'p95_ms': None, 'mean_ms': None}
+    return {'p50_ms': float(np.percentile(values, 50)), 'p95_ms': float(np.percentile(values, 95)),
+            'mean_ms': float(values.mean())}
+
+
+def mean_average_precision(detections: List[Detection], targets, iou_threshold=0.5) -> Dict:
+    """Average precision per class of all detections, VOC 11 point (ssd_utils) and area under the curve (yolo_utils)
+
+    Both means only cover the classes present in the ground truth.
+    """
+    det_boxes = [torch.as_tensor(d.boxes, dtype=torch.float32).reshape(-1, 4).to(DEVICE) for d in detections]
+    det_labels = [torch.as_tensor(d.labels, dtype=torch.int64).to(DEVICE) for d in detections]
+    det_scores = [torch.as_tensor(d.scores, dtype=torch.float32).to(DEVICE) for d in detections]
+    true_boxes = [t['boxes'].float().reshape(-1, 4).to(DEVICE) for t in targets]
+    true_labels = [t['labels'].to(DEVICE) for t in targets]
+    difficulties = [torch.zeros_like(labels) for labels in true_labels]
+    voc_ap, _ = calculate_mAP(det_boxes, det_labels, det_scores, true_boxes, true_labels, difficulties, LABEL_MAP,
+                              REV_LABEL_MAP)
+    # yolo_utils works on (x1, y1, x2, y2, score, ..., label) rows and (image, label, x1, y1, x2, y2) targets
+    outputs = [torch.cat([b.cpu(), s.cpu()[:, None], l.cpu()[:, None].float()], dim=1)
+               for b, l, s in zip(det_boxes, det_labels, det_scores)]
+    annotations = torch.cat([torch.cat([torch.full((len(l), 1), float(i)), l.cpu()[:, None].float(), b.cpu()], dim=1)
+                             for i, (b, l) in enumerate(zip(true_boxes, true_labels))])
+    statistics = get_batch_statistics(outputs, annotations, iou_threshold)
+    gt_labels = annotations[:, 1].numpy()
+    present = sorted(set(int(c) for c in gt_labels))
+    if statistics:
+        tp, scores, labels = [np.concatenate(x, 0) for x in zip(*statistics)]
+    else:
+        tp, scores, labels = np.zeros(0), np.zeros(0), np.zeros(0)
+    _, _, ap, _, ap_classes = ap_per_class(tp, np.asarray(scores, dtype=np.float64), np.asarray(labels), gt_labels)
+    area_ap = {REV_LABEL_MAP[int(c)]: float(a) for c, a in zip(ap_classes, ap)}
+    per_class = {REV_LABEL_MAP[c]: {'ap': area_ap.get(REV_LABEL_MAP[c], 0.0), 'ap_voc11': voc_ap[REV_LABEL_MAP[c]],
+                                    'objects': int((gt_labels == c).sum())} for c in present}
+    return {
+        'map': float(np.mean([v['ap'] for v in per_class.values()])) if per_class else 0.0,
+        'map_voc11': float(np.mean([v['ap_voc11'] for v in per_class.values()])) if per_class else 0.0,
+        'per_class': per_class
+    }
+
+
+def peak_memory_mb() -> Dict[str, Optional[float]]:
+    try:
+        import resource
+    except ImportError:
+        # resource gibt es nur unter Unix (der Roboter-PC läuft unter Windows)
+        memory = {'peak_rss_mb': None}
+    else:
+        # ru_maxrss is in kilobytes on Linux
+        memory = {'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024}
+    if DEVICE.type == 'cuda':
+        memory['peak_cuda_mb'] = torch.cuda.max_memory_allocated() / 2 ** 20
+    return memory
+
+
+def benchmark(detect: Detect, dataset, batch_sizes: Sequence[int] = (1, 4, 8), warmup=2) -> Dict:
+    """Runs a detector over a held out dataset and measures its accuracy and its latency
+
+    The accuracy and the per image latency come from one pass with batch size 1, then every batch size is timed over
+    the same frames.
+    """
+    frames, targets = [], []
+    for i in range(len(dataset)):
+        image, target = dataset[i]
+        frames.append(to_frame(image))
+        targets.append(target)
+    logger.info(f'Benchmarking {detect.model_name} on {len(frames)} images')
+    for frame in frames[:warmup]:
+        detect.detect_batch([frame])
+    detections, latencies = [], []
+    for frame in frames:
+        start = time.perf_counter()
+        detections.extend(detect.detect_batch([frame]))
+        latencies.append(time.perf_counter() - start)
+    batches = {}
+    for batch_size in batch_sizes:
+        times = []
+        # Only full batches, Detect keeps its input buffer per batch shape
+        for i in range(0, len(frames) - batch_size + 1, batch_size):
+            start = time.perf_counter()
+            detect.detect_batch(frames[i:i + batch_size])
+            times.append(time.perf_counter() - start)
+        batch = percentiles(times)
+        batch['per_image_ms'] = batch['mean_ms'] / batch_size if times else None
+        batch['batches'] = len(times)
+        batches[str(batch_size)] = batch
+    result = {
+        'model': detect.model_name,
+        'variant': detect.variant,
+        'images': len(frames),
+        'device': detect.device.type,
+        'threads': torch.get_num_threads(),
+        'interop_threads': torch.get_num_interop_threads(),
+        'accuracy': mean_average_precision(detections, targets),
+        'latency_per_image': percentiles(latencies),
+        'latency_per_batch': batches,
+        'memory': peak_memory_mb()
+    }
+    latency = result['latency_per_image']
+    logger.info(f'{detect.model_name} {detect.variant}: mAP {result["accuracy"]["map"]:.3f}, '
+                f'p50 {latency["p50_ms"]:.1f} ms, p95 {latency["p95_ms"]:.1f} ms')
+    return result
+
+
+def compare_variants(results: List[Dict]) -> List[Dict]:
+    """Accuracy and latency of every variant relative to the first one, e.g. the int8 against the fp32 model"""
+    reference = results[0]
+    comparison = []
+    for result in results:
+        p50, reference_p50 = result['latency_per_image']['p50_ms'], reference['latency_per_image']['p50_ms']
+        comparison.append({
+            'variant': result['variant'],
+            'map': result['accuracy']['map'],
+            'map_delta': result['accuracy']['map'] - reference['accuracy']['map'],
+            'p50_ms': p50,
+            'speedup': reference_p50 / p50 if p50 else None
+        })
+        logger.info(f'{result["variant"]}: mAP {comparison[-1]["map"]:.3f} ({comparison[-1]["map_delta"]:+.3f}), '
+                    f'p50 {p50:.1f} ms ({comparison[-1]["speedup"]:.2f}x)')
+    return comparison
+
+
+def write_results(results: Dict, output_path):
+    with open(output_path, 'w') as dest:
+        json.dump(results, dest, indent=2)
+    logger.info(f'Wrote benchmark results to {output_path}')
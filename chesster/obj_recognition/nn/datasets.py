@@ -4,6 +4,11 @@ import torch
 import glob
 import os
 import numpy as np
+import json
+import logging
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
 
 
 class ChesspieceDataset(Dataset):
@@ -31,24 +36,102 @@ class ChesspieceDataset(Dataset):
         width, height = image_resized.shape[:2]
         annotation_filename = f'{image_name[:-4]}.txt'
         annotation_file_path = os.path.join(self.label_path, annotation_filename)
-        rows = np.loadtxt(annotation_file_path, delimiter=' ', ndmin=2)
-        labels = []
-        boxes = []
-        for row in rows:
-            box_class, x, y, w, h = row
-            labels.append(int(box_class))
-            x_min, y_min = (x - w) * width, (y - h) * height
-            x_max, y_max = (x + w) * width, (y + h) * height
-            boxes.append(np.clip([x_min, y_min, x_max, y_max], 0.0, [width, height, width, height]))
-        boxes = torch.as_tensor(np.array(boxes), dtype=torch.float32)
-        area = (boxes[:, 3] - boxes[:, 1]) * (boxes[:, 2] - boxes[:, 0])
-        labels = torch.as_tensor(labels, dtype=torch.int64)
-        iscrowd = torch.zeros((boxes.shape[0], ), dtype=torch.int64)
-        target = {'boxes': boxes, 'area': area, 'iscrowd': iscrowd, 'labels': labels}
-        if self.transforms:
-            sample = self.transforms(image=image_resized, bboxes=target['boxes'], labels=labels)
-            image_resized = sample['image']
-            target['boxes'] = torch.tensor(sample['bboxes'])
-        else:
-            image_resized = torch.as_tensor(image_resized, dtype=torch.float32).permute(2, 0, 1)
-        return image_resized, target
+        boxes, labels = load_annotation(annotation_file_path, width, height)
+        return make_sample(image_resized, boxes, labels, self.transforms)
+
+
+def load_annotation(annotation_file_path, width, height):
+    rows = np.loadtxt(annotation_file_path, delimiter=' ', ndmin=2)
+    labels = []
+    boxes = []
+    for row in rows:
+        box_class, x, y, w, h = row
+        labels.append(int(box_class))
+        x_min, y_min = (x - w) * width, (y - h) * height
+        x_max, y_max = (x + w) * width, (y + h) * height
+        boxes.append(np.clip([x_min, y_min, x_max, y_max], 0.0, [width, height, width, height]))
+    return np.array(boxes, dtype=np.float32).reshape(-1, 4), np.array(labels, dtype=np.int64)
+
+
+def make_sample(image, boxes, labels, transforms=None):
+    boxes = torch.as_tensor(boxes, dtype=torch.float32)
+    area = (boxes[:, 3] - boxes[:, 1]) * (boxes[:, 2] - boxes[:, 0])
+    labels = torch.as_tensor(labels, dtype=torch.int64)
+    iscrowd = torch.zeros((boxes.shape[0], ), dtype=torch.int64)
+    target = {'boxes': boxes, 'area': area, 'iscrowd': iscrowd, 'labels': labels}
+    if transforms:
+        sample = transforms(image=image, bboxes=target['boxes'], labels=labels)
+        image = sample['image']
+        target['boxes'] = torch.tensor(sample['bboxes'])
+    else:
+        image = torch.as_tensor(image, dtype=torch.float32).permute(2, 0, 1)
+    return image, target
+
+
+def preprocess_dataset(image_path, label_path, output_path, width, height, shard_size=1000):
+    """Decodes, resizes and parses the dataset once into memory-mapped shards read by ShardedChesspieceDataset
+
+    Every shard holds the RGB uint8 images (images_<n>.npy) and the packed boxes and labels of all its images
+    (boxes_<n>.npy, labels_<n>.npy). index.json maps every image to its shard, row and box range.
+    """
+    output_path = Path(output_path)
+    output_path.mkdir(parents=True, exist_ok=True)
+    image_names = sorted(os.path.basename(p) for p in glob.glob(f'{image_path}/*.jpg'))
+    index = {'width': width, 'height': height, 'shards': [], 'items': []}
+    for shard, start in enumerate(range(0, len(image_names), shard_size)):
+        names = image_names[start:start + shard_size]
+        images = np.lib.format.open_memmap(output_path / f'images_{shard}.npy', mode='w+', dtype=np.uint8,
+                                           shape=(len(names), height, width, 3))
+        all_boxes, all_labels = [], []
+        offset = 0
+        for row, image_name in enumerate(names):
+            image = cv.imread(os.path.join(image_path, image_name))
+            images[row] = cv.resize(cv.cvtColor(image, cv.COLOR_BGR2RGB), (width, height))
+            boxes, labels = load_annotation(os.path.join(label_path, f'{image_name[:-4]}.txt'), *images[row].shape[:2])
+            all_boxes.append(boxes)
+            all_labels.append(labels)
+            index['items'].append({'name': image_name, 'shard': shard, 'row': row, 'box_start': offset,
+                                   'box_count': len(labels)})
+            offset += len(labels)
+        images.flush()
+        del images
+        np.save(output_path / f'boxes_{shard}.npy', np.concatenate(all_boxes) if all_boxes else np.zeros((0, 4), np.float32))
+        np.save(output_path / f'labels_{shard}.npy', np.concatenate(all_labels) if all_labels else np.zeros(0, np.int64))
+        index['shards'].append(shard)
+        logger.info(f'Wrote shard {shard} with {len(names)} images')
+    with open(output_path / 'index.json', 'w') as dest:
+        json.dump(index, dest)
+    logger.info(f'Preprocessed {len(image_names)} images into {len(index["shards"])} shards at {output_path}')
+    return index
+
+
+class ShardedChesspieceDataset(Dataset):
+    """ChesspieceDataset read from the memory-mapped shards written by preprocess_dataset, without any decoding"""
+
+    def __init__(self, shard_path, transforms=None):
+        self.shard_path = Path(shard_path)
+        self.transforms = transforms
+        with open(self.shard_path / 'index.json') as src:
+            index = json.load(src)
+        self.width = index['width']
+        self.height = index['height']
+        self.items = index['items']
+        self.all_images = [item['name'] for item in self.items]
+        self.__shards = {}
+
+    def __len__(self):
+        return len(self.items)
+
+    def __shard(self, shard):
+        # Opened lazily, so every DataLoader worker maps the files itself and shares the pages
+        if shard not in self.__shards:
+            self.__shards[shard] = tuple(np.load(self.shard_path / f'{name}_{shard}.npy', mmap_mode='r')
+                                         for name in ('images', 'boxes', 'labels'))
+        return self.__shards[shard]
+
+    def __getitem__(self, item):
+        entry = self.items[item]
+        images, boxes, labels = self.__shard(entry['shard'])
+        box_range = slice(entry['box_start'], entry['box_start'] + entry['box_count'])
+        image = np.multiply(images[entry['row']], 1 / 255.0, dtype=np.float32)
+        return make_sample(image, np.array(boxes[box_range]), np.array(labels[box_range]), self.transforms)
@@ -1,6 +1,10 @@
 from chesster.obj_recognition.nn.utils import DEVICE, CLASSES
 from chesster.obj_recognition.nn.models import create_model
+from chesster.obj_recognition.nn.export import load_artifact, input_size as model_input_size
+from chesster.obj_recognition.nn.ssd import SSD
 from pathlib import Path
+from types import SimpleNamespace
+from typing import List, Optional, Sequence
 from matplotlib import pyplot as plt
 import torch
 import cv2 as cv
@@ -10,40 +14,153 @@ import logging
 logger = logging.getLogger(__name__)
 
 
+class Detection:
+    """Detections of one frame in frame pixel coordinates, labels are 1-based indices into CLASSES"""
+
+    def __init__(self, boxes: np.ndarray, labels: np.ndarray, scores: np.ndarray):
+        self.boxes = boxes
+        self.labels = labels
+        self.scores = scores
+
+    @property
+    def classes(self) -> List[str]:
+        return [CLASSES[int(label) - 1] for label in self.labels]
+
+    def __iter__(self):
+        return iter((self.boxes, self.labels, self.scores))
+
+    def __len__(self):
+        return len(self.scores)
+
+    def __repr__(self):
+        return str(list(zip(self.classes, np.round(self.scores, 3).tolist())))
+
+
 class Detect:
-    def __init__(self, model_name, state_path: Path, detection_threshold=0.6):
-        model, criterion = create_model(model_name, len(CLASSES))
-        self.model = model.to(DEVICE)
-        self.model.load_state_dict(torch.load(state_path.absolute(), map_location=DEVICE))
-        self.model.eval()
+    """Piece detector running a trained model (*.pth state dict) or an exported artifact (*.pt, *.onnx) of nn.export
+
+    Exported artifacts, e.g. the int8 variants, run on the CPU. The frames are resized to the input size of the
+    weights (the training resolution in their JSON file) unless input_size is given.
+    """
+    ARTIFACT_SUFFIXES = ('.pt', '.onnx')
+
+    def __init__(self, model_name, state_path: Path, detection_threshold=0.6, nms_threshold=0.45, top_k=200,
+                 input_size: Optional[int] = None):
+        state_path = Path(state_path)
+        self.model_name = model_name
+        self.exported = state_path.suffix in Detect.ARTIFACT_SUFFIXES
+        if self.exported:
+            self.model, meta = load_artifact(state_path)
+            if meta['model'] != model_name:
+                raise ValueError(f'{state_path} is a "{meta["model"]}" model, not "{model_name}"')
+            self.variant = f'{meta["variant"]}-{meta["format"]}'
+            self.device = torch.device('cpu')
+        else:
+            model, criterion = create_model(model_name, len(CLASSES))
+            self.model = model.to(DEVICE)
+            self.model.load_state_dict(torch.load(state_path.absolute(), map_location=DEVICE))
+            self.model.eval()
+            self.variant = 'eager'
+            self.device = DEVICE
+        self.__priors_cxcy = None
         self.detection_threshold = detection_threshold
+        self.nms_threshold = nms_threshold
+        self.top_k = top_k
+        self.input_size = input_size or model_input_size(model_name, state_path)
+        self.__buffer: Optional[torch.Tensor] = None
+
+    def __preprocess(self, frames: Sequence[np.ndarray]) -> torch.Tensor:
+        height, width = frames[0].shape[:2] if self.input_size is None else (self.input_size, self.input_size)
+        shape = (len(frames), 3, height, width)
+        if self.__buffer is None or tuple(self.__buffer.shape) != shape:
+            self.__buffer = torch.empty(shape, dtype=torch.float32, pin_memory=self.device.type == 'cuda')
+        buffer = self.__buffer.numpy()
+        for i, frame in enumerate(frames):
+            if frame.shape[:2] != (height, width):
+                frame = cv.resize(frame, (width, height))
+            # BGR HWC uint8 -> RGB CHW float32 in [0, 1], written in place
+            np.multiply(frame[..., ::-1].transpose(2, 0, 1), 1 / 255.0, out=buffer[i], casting='unsafe')
+        return self.__buffer.to(self.device, non_blocking=True)
+
+    def __ssd_head(self, scores):
+        if not self.exported:
+            return self.model
+        if self.__priors_cxcy is None:
+            self.__priors_cxcy = SSD.create_prior_boxes()
+        # The exported graph has no Python attributes, detect_objects only needs the priors and the classes
+        return SimpleNamespace(priors_cxcy=self.__priors_cxcy, n_classes=scores.size(2))
+
+    def __postprocess(self, outputs, frames: Sequence[np.ndarray]) -> List[Detection]:
+        if self.model_name == 'ssd':
+            locs, scores = (output.to(DEVICE) for output in outputs)
+            boxes, labels, scores = SSD.detect_objects(self.__ssd_head(scores), locs, scores, self.detection_threshold,
+                                                       self.nms_threshold, self.top_k)
+            outputs = [{'boxes': b, 'labels': l, 'scores': s} for b, l, s in zip(boxes, labels, scores)]
+        elif self.model_name == 'yolo':
+            from chesster.obj_recognition.nn.yolo_utils import non_max_suppression
+            predictions = non_max_suppression(outputs.to(DEVICE), self.detection_threshold, self.nms_threshold)
+            outputs = []
+            for prediction in predictions:
+                if prediction is None:
+                    prediction = torch.zeros((0, 7))
+                outputs.append({'boxes': prediction[:, :4], 'labels': prediction[:, 6].long() + 1,
+                                'scores': prediction[:, 4] * prediction[:, 5]})
+        detections = []
+        for output, frame in zip(outputs, frames):
+            boxes = output['boxes'].float().cpu().numpy().reshape(-1, 4)
+            labels = output['labels'].cpu().numpy().astype(np.int64)
+            scores = output['scores'].float().cpu().numpy()
+            keep = (scores >= self.detection_threshold) & (labels > 0)
+            boxes, labels, scores = boxes[keep], labels[keep], scores[keep]
+            if self.model_name == 'ssd':
+                boxes = boxes * np.array([frame.shape[1], frame.shape[0]] * 2, dtype=np.float32)
+            elif self.model_name == 'yolo':
+                boxes = boxes * np.array([frame.shape[1] / self.input_size, frame.shape[0] / self.input_size] * 2,
+                                         dtype=np.float32)
+            detections.append(Detection(boxes, labels, scores))
+        return detections
 
-    def classify(self, image, use_matplotlib=False):
-        orig_image = image.copy()
-        image = cv.cvtColor(image, cv.COLOR_BGR2RGB).astype(np.float)
-        image /= 255.0
-        image = np.transpose(image, (2, 0, 1)).astype(np.float)
-        image = torch.tensor(image, dtype=torch.float)
-        image = torch.unsqueeze(image, 0)
-        with torch.no_grad():
-            outputs = self.model(image)
-        outputs = [{k: v.to(DEVICE) for k, v in t.items()} for t in outputs]
-        if len(outputs[0]['boxes']) != 0:
-            boxes = outputs[0]['boxes'].data.numpy()
-            scores = outputs[0]['scores'].data.numpy()
-            boxes = boxes[scores >= self.detection_threshold].astype(np.int32)
-            draw_boxes = boxes.copy()
-            pred_classes = [CLASSES[i - 1] for i in outputs[0]['labels'].to(DEVICE).numpy()]
-            width, height = orig_image.shape[:2]
-            for j, box in enumerate(draw_boxes):
-                x_min, y_min, x_max, y_max = map(int, box)
-                cv.rectangle(orig_image, (x_min, y_min), (x_max, y_max), (0, 0, 255), 2)
-                cv.putText(orig_image, pred_classes[j], (x_min, y_min-5), cv.FONT_HERSHEY_SIMPLEX, 0.7,
-                           (0, 255, 0), 2, lineType=cv.LINE_AA)
-            if use_matplotlib:
-                plt.axis('off')
-                plt.imshow(cv.cvtColor(orig_image, cv.COLOR_BGR2RGB))
+    def detect_batch(self, frames: Sequence[np.ndarray]) -> List[Detection]:
+        """Runs the model on a batch of BGR frames of the same size and returns one Detection per frame"""
+        if len(frames) == 0:
+            return []
+        batch = self.__preprocess(frames)
+        with torch.inference_mode():
+            if self.model_name == 'rcnn':
+                outputs = self.model(list(batch))
+                # Scripted detection models return (losses, detections)
+                outputs = outputs[1] if isinstance(outputs, tuple) else outputs
             else:
-                cv.imshow('Prediction', orig_image)
-                cv.waitKey(1)
-            logger.info(f'Classification complete. Score: {list(zip(scores, pred_classes))}')
+                outputs = self.model(batch)
+            detections = self.__postprocess(outputs, frames)
+        return detections
+
+    def predict(self, image):
+        detection = self.detect_batch([image])[0]
+        return detection.boxes, detection.labels, detection.scores
+
+    @staticmethod
+    def visualize(image, detection: Detection) -> np.ndarray:
+        image = image.copy()
+        for box, name in zip(detection.boxes.astype(np.int32), detection.classes):
+            x_min, y_min, x_max, y_max = map(int, box)
+            cv.rectangle(image, (x_min, y_min), (x_max, y_max), (0, 0, 255), 2)
+            cv.putText(image, name, (x_min, y_min-5), cv.FONT_HERSHEY_SIMPLEX, 0.7,
+                       (0, 255, 0), 2, lineType=cv.LINE_AA)
+        return image
+
+    @staticmethod
+    def show(image, use_matplotlib=False):
+        if use_matplotlib:
+            plt.axis('off')
+            plt.imshow(cv.cvtColor(image, cv.COLOR_BGR2RGB))
+        else:
+            cv.imshow('Prediction', image)
+            cv.waitKey(1)
+
+    def classify(self, image, use_matplotlib=False) -> Detection:
+        detection = self.detect_batch([image])[0]
+        if len(detection) != 0:
+            self.show(self.visualize(image, detection), use_matplotlib)
+            logger.info(f'Classification complete. Score: {detection}')
+        return detection
@@ -0,0 +1,145 @@
+from chesster.obj_recognition.nn.utils import DEVICE, CLASSES
+from chesster.obj_recognition.nn.models import create_model
+from pathlib import Path
+from typing import Dict, Iterable, Optional, Sequence, Tuple
+import torch
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Default input size of the models, rcnn resizes internally and is scripted instead of traced, the input size of trained
+# weights (yolo: training resolution) is read from their JSON file, see input_size
+INPUT_SIZES = {'rcnn': None, 'ssd': 300, 'yolo': 416}
+FORMATS = ('torchscript', 'onnx')
+QUANTIZATIONS = ('dynamic', 'static')
+
+
+def meta_path(artifact_path: Path) -> Path:
+    """Every artifact has a JSON file of the same name describing it"""
+    return Path(artifact_path).with_suffix('.json')
+
+
+def load_meta(artifact_path: Path) -> Dict:
+    with open(meta_path(artifact_path)) as src:
+        return json.load(src)
+
+
+def input_size(model_name, state_path: Optional[Path] = None) -> Optional[int]:
+    """Input size of trained weights or of an artifact from its JSON file, the default of the model without one"""
+    if state_path is not None and meta_path(state_path).exists():
+        return load_meta(state_path).get('input_size') or INPUT_SIZES[model_name]
+    return INPUT_SIZES[model_name]
+
+
+def load_model(model_name, state_path: Path, device=DEVICE):
+    model, _ = create_model(model_name, len(CLASSES))
+    model.load_state_dict(torch.load(Path(state_path).absolute(), map_location=device))
+    return model.to(device).eval()
+
+
+def quantize(model_name, model, mode, calibration_batches: Optional[Iterable[torch.Tensor]] = None,
+             size: Optional[int] = None):
+    """Returns an int8 CPU copy of the model
+
+    dynamic quantizes the weights of the linear layers (the rcnn box head), static quantizes convolutions and
+    activations with ranges observed on the calibration batches (ssd only, the rcnn and yolo heads are not traceable).
+    """
+    from torch.ao.quantization import quantize_dynamic, get_default_qconfig_mapping
+    model = model.to('cpu').eval()
+    if mode == 'dynamic':
+        return quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    if mode != 'static':
+        raise ValueError(f'Invalid quantization "{mode}". Allowed: {QUANTIZATIONS}')
+    if model_name in ('rcnn', 'yolo'):
+        raise ValueError(f'Static quantization is not supported for {model_name}, use dynamic')
+    if calibration_batches is None:
+        raise ValueError('Static quantization needs calibration images')
+    from torch.ao.quantization.quantize_fx import prepare_fx, convert_fx
+    size = size or INPUT_SIZES[model_name]
+    example = torch.zeros((1, 3, size, size))
+    prepared = prepare_fx(model, get_default_qconfig_mapping('x86'), (example,))
+    with torch.inference_mode():
+        for batch in calibration_batches:
+            prepared(batch)
+    return convert_fx(prepared)
+
+
+def to_torchscript(model_name, model, path: Path, size: Optional[int] = None):
+    model = model.eval()
+    size = size or INPUT_SIZES[model_name]
+    if size is None:
+        scripted = torch.jit.script(model)
+    else:
+        with torch.inference_mode():
+            scripted = torch.jit.freeze(torch.jit.trace(model, torch.zeros((1, 3, size, size)), check_trace=False))
+    torch.jit.save(scripted, str(path))
+
+
+def to_onnx(model_name, model, path: Path, size: Optional[int] = None):
+    if INPUT_SIZES[model_name] is None:
+        raise ValueError('rcnn can only be exported to torchscript')
+    size = size or INPUT_SIZES[model_name]
+    output_names = ['locs', 'scores'] if model_name == 'ssd' else ['detections']
+    torch.onnx.export(model.eval(), (torch.zeros((1, 3, size, size)),), str(path), input_names=['images'],
+                      output_names=output_names, dynamic_axes={'images': {0: 'batch'}}, opset_version=17)
+
+
+def export(model_name, state_path: Path, export_dir: Path, formats: Sequence[str] = ('torchscript',),
+           quantization: Optional[str] = None, calibration_batches: Optional[Iterable[torch.Tensor]] = None,
+           size: Optional[int] = None) -> Dict[str, Path]:
+    """Writes the trained model as fp32 artifacts and, if quantization is given, as int8 artifacts
+
+    The artifacts are named <model>_<variant>.pt (TorchScript) or .onnx, Detect loads them by their suffix. The graphs
+    are traced at size, default the input size of the trained weights (input_size).
+    """
+    size = size or input_size(model_name, state_path)
+    export_dir = Path(export_dir)
+    export_dir.mkdir(parents=True, exist_ok=True)
+    model = load_model(model_name, state_path, torch.device('cpu'))
+    variants = [('fp32', model)]
+    if quantization is not None:
+        variants.append((f'int8-{quantization}', quantize(model_name, model, quantization, calibration_batches, size)))
+    artifacts = {}
+    for variant, variant_model in variants:
+        for export_format in formats:
+            if export_format not in FORMATS:
+                raise ValueError(f'Invalid export format "{export_format}". Allowed: {FORMATS}')
+            suffix = '.pt' if export_format == 'torchscript' else '.onnx'
+            path = export_dir / f'{model_name}_{variant}{suffix}'
+            (to_torchscript if export_format == 'torchscript' else to_onnx)(model_name, variant_model, path, size)
+            with open(meta_path(path), 'w') as dest:
+                json.dump({'model': model_name, 'variant': variant, 'format': export_format,
+                           'input_size': size, 'source': str(state_path)}, dest, indent=2)
+            artifacts[f'{variant}-{export_format}'] = path
+            logger.info(f'Exported {model_name} {variant} to {path}')
+    return artifacts
+
+
+class OnnxModel:
+    """Runs an exported ONNX graph with onnxruntime like the torch model it was exported from"""
+
+    def __init__(self, path: Path, threads: Optional[int] = None):
+        import onnxruntime
+        options = onnxruntime.SessionOptions()
+        if threads is not None:
+            options.intra_op_num_threads = threads
+        self.session = onnxruntime.InferenceSession(str(path), options, providers=['CPUExecutionProvider'])
+        self.input_name = self.session.get_inputs()[0].name
+
+    def eval(self):
+        return self
+
+    def __call__(self, batch: torch.Tensor):
+        outputs = self.session.run(None, {self.input_name: batch.cpu().numpy()})
+        outputs = tuple(torch.from_numpy(output) for output in outputs)
+        return outputs[0] if len(outputs) == 1 else outputs
+
+
+def load_artifact(path: Path) -> Tuple[object, Dict]:
+    """Loads an artifact written by export, the model runs on the CPU"""
+    path = Path(path)
+    meta = load_meta(path)
+    if path.suffix == '.onnx':
+        return OnnxModel(path), meta
+    return torch.jit.load(str(path), map_location='cpu').eval(), meta
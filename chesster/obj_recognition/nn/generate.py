@@ -1,27 +1,191 @@
-from chesster.obj_recognition.chessboard import ChessBoard
-from chesster.obj_recognition.chessboard_recognition import ChessBoardRecognition
-from chesster.camera.realSense import RealSenseCamera
+from chesster.obj_recognition.chessboard import ChessBoard, ChessBoardField
+from chesster.obj_recognition.board_rectifier import BoardRectifier
+from chesster.obj_recognition.game_archive import CALIBRATION_FILE, find_games, read_frames
+from chesster.obj_recognition.piece_classifier import PieceHeightClassifier
+from chesster.obj_recognition.nn.utils import CLASSES
+from chesster.obj_recognition.nn.square_classifier import square_positions
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
 from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+import cv2 as cv
 import logging
 
 logger = logging.getLogger(__name__)
 
 
+@lru_cache(maxsize=8)
+def load_board(calibration_path: Path) -> ChessBoard:
+    # Every worker process loads the calibration of a game once
+    return ChessBoard.load(calibration_path)
+
+
+@lru_cache(maxsize=8)
+def load_rectifier(calibration_path: Path, camera_shape: Tuple[int, int]) -> Optional[BoardRectifier]:
+    return BoardRectifier.from_board(load_board(calibration_path), camera_shape)
+
+
+def piece_mask(box, depth_map: np.ndarray, empty_depth: np.ndarray, core, min_height=PieceHeightClassifier.MIN_HEIGHT):
+    """Pixels of a box (depth map pixels) above the empty board that are connected to the core of the square
+
+    Returns the box clipped to the depth map and the mask of the piece within it, None if no piece is visible.
+    """
+    x_min, y_min, x_max, y_max = [int(round(v)) for v in box]
+    x_min, y_min = max(x_min, 0), max(y_min, 0)
+    x_max, y_max = min(x_max, depth_map.shape[1]), min(y_max, depth_map.shape[0])
+    if x_max <= x_min or y_max <= y_min:
+        return None
+    window = depth_map[y_min:y_max, x_min:x_max].astype(np.float32)
+    height = empty_depth[y_min:y_max, x_min:x_max].astype(np.float32) - window
+    mask = ((window > 0) & (height > min_height)).astype(np.uint8)
+    count, components = cv.connectedComponents(mask)
+    core_x, core_y = int(core[0]) - x_min, int(core[1]) - y_min
+    radius = max(1, min(x_max - x_min, y_max - y_min) // 6)
+    touching = np.unique(components[max(core_y - radius, 0):core_y + radius, max(core_x - radius, 0):core_x + radius])
+    touching = touching[touching > 0]
+    if count <= 1 or len(touching) == 0:
+        return None
+    return (x_min, y_min, x_max, y_max), np.isin(components, touching)
+
+
+def refine_box(box, depth_map: np.ndarray, empty_depth: np.ndarray, core, min_height=PieceHeightClassifier.MIN_HEIGHT):
+    """Shrinks a box (depth map pixels) to the pixels above the empty board connected to the core of the square"""
+    result = piece_mask(box, depth_map, empty_depth, core, min_height)
+    if result is None:
+        return None
+    (x_min, y_min, _, _), mask = result
+    rows, cols = np.nonzero(mask)
+    return x_min + cols.min(), y_min + rows.min(), x_min + cols.max() + 1, y_min + rows.max() + 1
+
+
+def square_box(field: ChessBoardField, image_shape, margin=0.15) -> Tuple[np.ndarray, List[float]]:
+    """Contour of a field in the image and its bounding box (x_min, y_min, x_max, y_max) widened by margin"""
+    width, height = image_shape[:2]
+    contour = field.rescaled_contour(width, height)
+    (x_min, y_min), (x_max, y_max) = contour.min(axis=0), contour.max(axis=0)
+    dx, dy = (x_max - x_min) * margin, (y_max - y_min) * margin
+    return contour, [x_min - dx, y_min - dy, x_max + dx, y_max + dy]
+
+
+def depth_scale(image_shape, depth_map: np.ndarray) -> np.ndarray:
+    # Depth and color frame may differ in resolution
+    scale_x, scale_y = depth_map.shape[1] / image_shape[1], depth_map.shape[0] / image_shape[0]
+    return np.array([scale_x, scale_y, scale_x, scale_y])
+
+
+def piece_boxes(board: ChessBoard, states: Dict[str, str], image_shape, depth_map: Optional[np.ndarray] = None,
+                margin=0.15) -> List[Tuple[int, List[float]]]:
+    """Bounding boxes (x_min, y_min, x_max, y_max pixels) and 1-based labels of all pieces in a frame
+
+    The box of a piece is the bounding box of its square widened by margin. With a depth map and the empty board depth
+    of the calibration, it is shrunk to the part of the piece standing above the board.
+    """
+    width, height = image_shape[:2]
+    boxes = []
+    for field in board.fields:
+        state = states.get(field.position, '')
+        if state not in CLASSES:
+            continue
+        contour, box = square_box(field, image_shape, margin)
+        if depth_map is not None and board.depth_map is not None and depth_map.shape == board.depth_map.shape:
+            scale = depth_scale(image_shape, depth_map)
+            refined = refine_box(np.array(box) * scale, depth_map, board.depth_map, contour.mean(axis=0) * scale[:2])
+            if refined is not None:
+                box = list(np.array(refined) / scale)
+        box = np.clip(box, 0, [height, width, height, width])
+        if box[2] > box[0] and box[3] > box[1]:
+            boxes.append((CLASSES.index(state) + 1, [float(v) for v in box]))
+    return boxes
+
+
+def write_annotation(path: Path, boxes: List[Tuple[int, List[float]]], image_shape):
+    """Writes boxes as ChesspieceDataset annotation rows: label, center and half size as fractions of the image"""
+    rows, cols = image_shape[:2]
+    with open(path, 'w') as dest:
+        for label, (x_min, y_min, x_max, y_max) in boxes:
+            dest.write(f'{label} {(x_min + x_max) / 2 / cols:.6f} {(y_min + y_max) / 2 / rows:.6f} '
+                       f'{(x_max - x_min) / 2 / cols:.6f} {(y_max - y_min) / 2 / rows:.6f}\n')
+
+
+def board_placement(states: Dict[str, str]) -> str:
+    """FEN piece placement of the field states, the label format of SquareCropDataset"""
+    ranks = []
+    for rank in range(8):
+        placement, empty = '', 0
+        for position in square_positions()[rank * 8:(rank + 1) * 8]:
+            state = states.get(position, '')
+            if state in CLASSES:
+                placement += (str(empty) if empty else '') + state
+                empty = 0
+            else:
+                empty += 1
+        ranks.append(placement + (str(empty) if empty else ''))
+    return '/'.join(ranks)
+
+
+def label_frame(game_path: Path, frame: Dict, image_path: Path, label_path: Path, square_path: Optional[Path] = None,
+                margin=0.15) -> int:
+    """Writes the labeled sample(s) of one recorded frame, returns the number of labeled pieces"""
+    image = cv.imread(str(game_path / frame['image']))
+    if image is None:
+        logger.warning(f'Cannot read {game_path / frame["image"]}')
+        return 0
+    depth_map = np.load(game_path / frame['depth']) if frame.get('depth') else None
+    calibration_path = game_path / CALIBRATION_FILE
+    board = load_board(calibration_path)
+    name = f'{game_path.name}_{frame["frame"]:04d}'
+    boxes = piece_boxes(board, frame['states'], image.shape, depth_map, margin)
+    cv.imwrite(str(image_path / f'{name}.jpg'), image)
+    write_annotation(label_path / f'{name}.txt', boxes, image.shape)
+    if square_path is not None:
+        rectifier = load_rectifier(calibration_path, image.shape[:2])
+        if rectifier is not None:
+            cv.imwrite(str(square_path / 'images' / f'{name}.jpg'), rectifier.rectify(image).color)
+            with open(square_path / 'labels' / f'{name}.txt', 'w') as dest:
+                dest.write(board_placement(frame['states']) + '\n')
+    return len(boxes)
+
+
+def _label_frame(args) -> int:
+    return label_frame(*args)
+
+
 class ChessPieceDatasetGenerator:
-    def __init__(self, dest: Path, camera: RealSenseCamera, debug=True):
-        if debug:
-            logging.basicConfig(level=logging.INFO)
-        self.dest = dest
-        self.camera = camera
-        self.previous_image = self.get_image()
-        self.board = ChessBoardRecognition.from_image(self.previous_image)
-
-    def generate(self):
-        image = self.get_image()
-        self.board.determine_changes(self.previous_image, image)
-
-    def get_image(self):
-        image = self.camera.capture_color()
-        if image is None:
-            raise RuntimeError('No image available')
-        return image
+    """Labels the frames of recorded games (GameRecorder) for the piece detector
+
+    The board state of every frame is known from the verified moves, so the calibrated square geometry gives the box of
+    every piece. The samples are written as <game>_<frame>.jpg with a ChesspieceDataset annotation of the same name.
+    With square_path, the rectified board and its FEN placement are also written for SquareCropDataset
+    (square_path/images, square_path/labels). The frames are labeled by a pool of worker processes.
+    """
+
+    def __init__(self, archive_path: Path, image_path: Path, label_path: Path, square_path: Optional[Path] = None,
+                 workers: Optional[int] = None, margin=0.15):
+        self.archive_path = Path(archive_path)
+        self.image_path = Path(image_path)
+        self.label_path = Path(label_path)
+        self.square_path = None if square_path is None else Path(square_path)
+        self.workers = workers
+        self.margin = margin
+
+    def tasks(self):
+        for game_path in find_games(self.archive_path):
+            for frame in read_frames(game_path):
+                yield game_path, frame, self.image_path, self.label_path, self.square_path, self.margin
+
+    def generate(self) -> int:
+        self.image_path.mkdir(parents=True, exist_ok=True)
+        self.label_path.mkdir(parents=True, exist_ok=True)
+        if self.square_path is not None:
+            (self.square_path / 'images').mkdir(parents=True, exist_ok=True)
+            (self.square_path / 'labels').mkdir(parents=True, exist_ok=True)
+        tasks = list(self.tasks())
+        logger.info(f'Labeling {len(tasks)} frames of {self.archive_path}')
+        if self.workers == 0:
+            pieces = [_label_frame(task) for task in tasks]
+        else:
+            with ProcessPoolExecutor(max_workers=self.workers) as executor:
+                pieces = list(executor.map(_label_frame, tasks, chunksize=8))
+        logger.info(f'Labeled {sum(pieces)} pieces in {len(tasks)} frames')
+        return len(tasks)
@@ -0,0 +1,80 @@
+import torch
+from torchvision import ops
+
+
+def box_iou(boxes_1: torch.Tensor, boxes_2: torch.Tensor, pixel_coordinates=False) -> torch.Tensor:
+    """Pairwise IoU of (..., n, 4) and (..., m, 4) boundary coordinate boxes, a tensor of size (..., n, m)
+
+    With pixel_coordinates the boxes include their last pixel, as in yolo_utils.bbox_iou, otherwise the overlap is
+    computed like ssd_utils.find_jaccard_overlap.
+    """
+    offset = 1 if pixel_coordinates else 0
+    lower = torch.max(boxes_1[..., :, None, :2], boxes_2[..., None, :, :2])
+    upper = torch.min(boxes_1[..., :, None, 2:], boxes_2[..., None, :, 2:])
+    size = torch.clamp(upper - lower + offset, min=0)
+    intersection = size[..., 0] * size[..., 1]
+    area_1 = (boxes_1[..., 2] - boxes_1[..., 0] + offset) * (boxes_1[..., 3] - boxes_1[..., 1] + offset)
+    area_2 = (boxes_2[..., 2] - boxes_2[..., 0] + offset) * (boxes_2[..., 3] - boxes_2[..., 1] + offset)
+    union = area_1[..., :, None] + area_2[..., None, :] - intersection
+    return intersection / (union + 1e-16) if pixel_coordinates else intersection / union
+
+
+def batched_nms(boxes: torch.Tensor, scores: torch.Tensor, groups: torch.Tensor, iou_threshold: float,
+                pixel_coordinates=False) -> torch.Tensor:
+    """Greedy non-maximum suppression of all groups (e.g. image and class) in one call
+
+    Boxes of different groups never suppress each other. torchvision shifts every group into its own coordinate range
+    for one NMS pass, or runs one pass per group for large inputs.
+    :param boxes: boxes in boundary coordinates, a tensor of size (n, 4)
+    :param scores: scores of the boxes, a tensor of size (n)
+    :param groups: group index of every box, a tensor of size (n)
+    :return: indices of the kept boxes by decreasing score
+    """
+    if boxes.size(0) == 0:
+        return torch.zeros(0, dtype=torch.long, device=boxes.device)
+    # Double precision keeps the shifted coordinates exact enough for the overlap thresholds
+    boxes = boxes.double()
+    if pixel_coordinates:
+        # Including the last pixel is the same as extending the box by one pixel
+        boxes = boxes + boxes.new_tensor([0, 0, 1, 1])
+    return ops.batched_nms(boxes, scores.double(), groups, iou_threshold)
+
+
+def nms_assignment(boxes: torch.Tensor, groups: torch.Tensor, keep: torch.Tensor, iou_threshold: float,
+                   pixel_coordinates=False) -> torch.Tensor:
+    """Index of the kept box that suppressed every box (itself if kept), e.g. to merge the suppressed boxes
+
+    A box is suppressed by the highest scoring kept box of its group that overlaps it. The boxes are padded per group,
+    so only boxes of the same group are compared.
+    """
+    n = boxes.size(0)
+    device = boxes.device
+    if keep.size(0) == 0:
+        return torch.zeros(0, dtype=torch.long, device=device)
+    unique_groups, group_index = torch.unique(groups, return_inverse=True)
+    g = unique_groups.size(0)
+    is_kept = torch.zeros(n, dtype=torch.bool, device=device)
+    is_kept[keep] = True
+
+    def pad(index):
+        # Position of every box within its group, in the order of index
+        index_groups = group_index[index]
+        order = torch.sort(index_groups, stable=True)[1]
+        index, index_groups = index[order], index_groups[order]
+        counts = torch.bincount(index_groups, minlength=g)
+        starts = torch.cumsum(counts, 0) - counts
+        position = torch.arange(index.size(0), device=device) - starts[index_groups]
+        padded = torch.full((g, max(int(counts.max()), 1)), -1, dtype=torch.long, device=device)
+        padded[index_groups, position] = index
+        return padded
+
+    kept = pad(keep)  # (g, k), by decreasing score within every group
+    members = pad(torch.arange(n, device=device))  # (g, m)
+    overlap = box_iou(boxes[kept.clamp(min=0)], boxes[members.clamp(min=0)], pixel_coordinates) > iou_threshold
+    overlap |= kept[:, :, None] == members[:, None, :]
+    overlap &= (kept >= 0)[:, :, None]
+    first = torch.argmax(overlap.to(torch.uint8), dim=1)  # (g, m)
+    assignment = torch.empty(n, dtype=torch.long, device=device)
+    valid = members >= 0
+    assignment[members[valid]] = torch.gather(kept, 1, first)[valid]
+    return assignment
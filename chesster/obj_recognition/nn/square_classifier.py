@@ -0,0 +1,165 @@
+from chesster.obj_recognition.nn.utils import DEVICE, CLASSES, Averager
+from torch.utils.data import Dataset
+from tqdm.auto import tqdm
+from pathlib import Path
+from typing import List, Tuple
+import torch
+import torch.nn as nn
+import cv2 as cv
+import numpy as np
+import glob
+import os
+import logging
+
+logger = logging.getLogger(__name__)
+
+FILES = 'abcdefgh'
+# Label 0 is the empty field, labels 1..12 follow CLASSES like the detector labels
+SQUARE_CLASSES = ['.'] + CLASSES
+
+
+def square_positions() -> List[str]:
+    """Positions of the crops returned by crop_squares, rank 8 first, file a first"""
+    return [f'{FILES[col]}{8 - row}' for row in range(8) for col in range(8)]
+
+
+def crop_squares(board_image: np.ndarray) -> np.ndarray:
+    """Cuts the 64 squares of a rectified BGR board image into one (64, 3, S, S) RGB uint8 array"""
+    size = board_image.shape[0] // 8
+    board_image = board_image[:8 * size, :8 * size]
+    grid = board_image.reshape(8, size, 8, size, 3)[..., ::-1]
+    return grid.transpose(0, 2, 4, 1, 3).reshape(64, 3, size, size)
+
+
+def board_labels(placement: str) -> np.ndarray:
+    """Labels of the 64 squares (crop_squares order) from the piece placement field of a FEN"""
+    labels = []
+    for rank in placement.split(' ')[0].split('/'):
+        for char in rank:
+            if char.isdigit():
+                labels.extend([0] * int(char))
+            else:
+                labels.append(SQUARE_CLASSES.index(char))
+    if len(labels) != 64:
+        raise ValueError(f'Invalid piece placement "{placement}"')
+    return np.array(labels, dtype=np.int64)
+
+
+class SquareClassifier(nn.Module):
+    """Small CNN classifying one square crop as empty or one of CLASSES"""
+
+    def __init__(self, num_classes=len(SQUARE_CLASSES)):
+        super().__init__()
+
+        def block(in_channels, out_channels):
+            return nn.Sequential(nn.Conv2d(in_channels, out_channels, 3, padding=1, bias=False),
+                                 nn.BatchNorm2d(out_channels), nn.ReLU(inplace=True), nn.MaxPool2d(2))
+        self.features = nn.Sequential(block(3, 16), block(16, 32), block(32, 64), nn.AdaptiveAvgPool2d(1))
+        self.classifier = nn.Linear(64, num_classes)
+
+    def forward(self, x):
+        return self.classifier(torch.flatten(self.features(x), 1))
+
+
+class SquareCropDataset(Dataset):
+    """Rectified board images (*.jpg/*.png) with a text file of the same name holding the FEN piece placement
+
+    Every board image yields its 64 square crops, so an item is a (64, 3, S, S) tensor with 64 labels.
+    """
+
+    def __init__(self, image_path, label_path, size=48, transforms=None):
+        self.image_path = image_path
+        self.label_path = label_path
+        self.size = size
+        self.transforms = transforms
+        self.all_images = sorted(os.path.basename(p) for p in glob.glob(f'{image_path}/*.jpg') +
+                                 glob.glob(f'{image_path}/*.png'))
+
+    def __len__(self):
+        return len(self.all_images)
+
+    def __getitem__(self, item):
+        image_name = self.all_images[item]
+        image = cv.imread(os.path.join(self.image_path, image_name))
+        image = cv.resize(image, (8 * self.size, 8 * self.size))
+        with open(os.path.join(self.label_path, f'{os.path.splitext(image_name)[0]}.txt')) as src:
+            labels = board_labels(src.read().strip())
+        crops = torch.from_numpy(np.ascontiguousarray(crop_squares(image))).float() / 255.0
+        if self.transforms:
+            crops = self.transforms(crops)
+        return crops, torch.from_numpy(labels)
+
+
+def square_collate_fn(batch):
+    crops, labels = zip(*batch)
+    return torch.cat(crops), torch.cat(labels)
+
+
+def train_squares(train_data_loader, model, optimizer, criterion=nn.CrossEntropyLoss()):
+    logger.info('Started Training')
+    train_loss_list = []
+    train_loss_hist = Averager()
+    model.train()
+    progress_bar = tqdm(train_data_loader, total=len(train_data_loader))
+    for crops, labels in progress_bar:
+        crops, labels = crops.to(DEVICE), labels.to(DEVICE)
+        optimizer.zero_grad()
+        loss = criterion(model(crops), labels)
+        loss.backward()
+        optimizer.step()
+        train_loss_list.append(loss.item())
+        train_loss_hist.send(loss.item())
+        progress_bar.set_description(desc=f'Loss: {loss.item(): .4f}')
+    logger.info('Completed Training')
+    return train_loss_list, train_loss_hist
+
+
+def validate_squares(valid_data_loader, model, criterion=nn.CrossEntropyLoss()):
+    logger.info('Started Validation')
+    val_loss_hist = Averager()
+    correct = total = 0
+    model.eval()
+    with torch.inference_mode():
+        for crops, labels in tqdm(valid_data_loader, total=len(valid_data_loader)):
+            crops, labels = crops.to(DEVICE), labels.to(DEVICE)
+            outputs = model(crops)
+            val_loss_hist.send(criterion(outputs, labels).item())
+            correct += (outputs.argmax(1) == labels).sum().item()
+            total += len(labels)
+    logger.info(f'Completed Validation. Accuracy: {correct / max(total, 1):.4f}')
+    return val_loss_hist, correct / max(total, 1)
+
+
+class SquareClassify:
+    """Inference of a trained SquareClassifier on the 64 squares of a rectified board image"""
+
+    def __init__(self, state_path: Path, size=48):
+        self.size = size
+        self.model = SquareClassifier().to(DEVICE)
+        self.model.load_state_dict(torch.load(Path(state_path).absolute(), map_location=DEVICE))
+        self.model.eval()
+        self.__buffer = torch.empty((64, 3, size, size), dtype=torch.float32)
+
+    def classify(self, board_image: np.ndarray) -> Tuple[List[str], np.ndarray]:
+        """Returns the state of every square in square_positions() order with its softmax confidence"""
+        if board_image.shape[0] != 8 * self.size:
+            board_image = cv.resize(board_image, (8 * self.size, 8 * self.size))
+        np.multiply(crop_squares(board_image), 1 / 255.0, out=self.__buffer.numpy(), casting='unsafe')
+        with torch.inference_mode():
+            probabilities = torch.softmax(self.model(self.__buffer.to(DEVICE)), dim=1).cpu().numpy()
+        labels = probabilities.argmax(axis=1)
+        return [SQUARE_CLASSES[label] for label in labels], probabilities[np.arange(64), labels]
+
+    @staticmethod
+    def to_placement(states: List[str]) -> str:
+        ranks = []
+        for row in range(8):
+            rank, empty = '', 0
+            for state in states[row * 8:(row + 1) * 8]:
+                if state == '.':
+                    empty += 1
+                    continue
+                rank += (str(empty) if empty else '') + state
+                empty = 0
+            ranks.append(rank + (str(empty) if empty else ''))
+        return '/'.join(ranks)
@@ -15,6 +15,7 @@ import os
 from math import sqrt
 from chesster.obj_recognition.nn.ssd_utils import *
 from chesster.obj_recognition.nn.utils import DEVICE
+from chesster.obj_recognition.nn.nms import batched_nms
 
 
 class VGGBase(nn.Module):
@@ -324,7 +325,8 @@ class SSD(nn.Module):
 
         return locs, classes_scores
 
-    def create_prior_boxes(self):
+    @staticmethod
+    def create_prior_boxes():
         """
         Create the 8732 prior (default) boxes for the SSD300, as defined in the paper.
         :return: prior boxes in center-size coordinates, a tensor of dimensions (8732, 4)
@@ -391,94 +393,42 @@ class SSD(nn.Module):
         """
         batch_size = predicted_locs.size(0)
         n_priors = self.priors_cxcy.size(0)
-        #         print(n_priors)
         predicted_scores = F.softmax(predicted_scores, dim=2)  # (N, 8732, n_classes)
 
+        assert n_priors == predicted_locs.size(1) == predicted_scores.size(1)
+
+        # Decode the boxes of all images at once, fractional pt. coordinates
+        priors_cxcy = self.priors_cxcy.repeat(batch_size, 1)
+        decoded_locs = cxcy_to_xy(gcxgcy_to_cxcy(predicted_locs.reshape(-1, 4), priors_cxcy))
+        decoded_locs = decoded_locs.view(batch_size, n_priors, 4)  # (N, 8732, 4)
+
+        # Every (image, prior, class) above the minimum score is a candidate, suppressed per image and class
+        candidates = (predicted_scores[:, :, 1:] > min_score).nonzero()  # (n_qualified, 3)
+        images, priors, classes = candidates[:, 0], candidates[:, 1], candidates[:, 2] + 1
+        candidate_boxes = decoded_locs[images, priors]  # (n_qualified, 4)
+        candidate_scores = predicted_scores[images, priors, classes]  # (n_qualified)
+        keep = batched_nms(candidate_boxes, candidate_scores, images * self.n_classes + classes, max_overlap)
+
         # Lists to store final predicted boxes, labels, and scores for all images
         all_images_boxes = list()
         all_images_labels = list()
         all_images_scores = list()
-
-        assert n_priors == predicted_locs.size(1) == predicted_scores.size(1)
-
         for i in range(batch_size):
-            # Decode object coordinates from the form we regressed predicted boxes to
-            decoded_locs = cxcy_to_xy(
-                gcxgcy_to_cxcy(predicted_locs[i], self.priors_cxcy))  # (8732, 4), these are fractional pt. coordinates
-
-            # Lists to store boxes and scores for this image
-            image_boxes = list()
-            image_labels = list()
-            image_scores = list()
-
-            max_scores, best_label = predicted_scores[i].max(dim=1)  # (8732)
-
-            # Check for each class
-            for c in range(1, self.n_classes):
-                # Keep only predicted boxes and scores where scores for this class are above the minimum score
-                class_scores = predicted_scores[i][:, c]  # (8732)
-                score_above_min_score = class_scores > min_score  # torch.uint8 (byte) tensor, for indexing
-                n_above_min_score = score_above_min_score.sum().item()
-                if n_above_min_score == 0:
-                    continue
-                class_scores = class_scores[score_above_min_score]  # (n_qualified), n_min_score <= 8732
-                class_decoded_locs = decoded_locs[score_above_min_score]  # (n_qualified, 4)
-
-                # Sort predicted boxes and scores by scores
-                class_scores, sort_ind = class_scores.sort(dim=0, descending=True)  # (n_qualified), (n_min_score)
-                class_decoded_locs = class_decoded_locs[sort_ind]  # (n_min_score, 4)
-
-                # Find the overlap between predicted boxes
-                overlap = find_jaccard_overlap(class_decoded_locs, class_decoded_locs)  # (n_qualified, n_min_score)
-
-                # Non-Maximum Suppression (NMS)
-
-                # A torch.uint8 (byte) tensor to keep track of which predicted boxes to suppress
-                # 1 implies suppress, 0 implies don't suppress
-                suppress = torch.zeros((n_above_min_score), dtype=torch.uint8).to(DEVICE)  # (n_qualified)
-
-                # Consider each box in order of decreasing scores
-                for box in range(class_decoded_locs.size(0)):
-                    # If this box is already marked for suppression
-                    if suppress[box] == 1:
-                        continue
-
-                    # Suppress boxes whose overlaps (with this box) are greater than maximum overlap
-                    # Find such boxes and update suppress indices
-                    suppress = torch.max(suppress, overlap[box] > max_overlap)
-                    # The max operation retains previously suppressed boxes, like an 'OR' operation
-
-                    # Don't suppress this box, even though it has an overlap of 1 with itself
-                    suppress[box] = 0
-
-                # Store only unsuppressed boxes for this class
-                image_boxes.append(class_decoded_locs[1 - suppress])
-                image_labels.append(torch.LongTensor((1 - suppress).sum().item() * [c]).to(DEVICE))
-                image_scores.append(class_scores[1 - suppress])
-
+            image_keep = keep[images[keep] == i]  # by decreasing score
             # If no object in any class is found, store a placeholder for 'background'
-            if len(image_boxes) == 0:
-                image_boxes.append(torch.FloatTensor([[0., 0., 1., 1.]]).to(DEVICE))
-                image_labels.append(torch.LongTensor([0]).to(DEVICE))
-                image_scores.append(torch.FloatTensor([0.]).to(DEVICE))
-
-            # Concatenate into single tensors
-            image_boxes = torch.cat(image_boxes, dim=0)  # (n_objects, 4)
-            image_labels = torch.cat(image_labels, dim=0)  # (n_objects)
-            image_scores = torch.cat(image_scores, dim=0)  # (n_objects)
-            n_objects = image_scores.size(0)
-
-            # Keep only the top k objects
-            if n_objects > top_k:
-                image_scores, sort_ind = image_scores.sort(dim=0, descending=True)
-                image_scores = image_scores[:top_k]  # (top_k)
-                image_boxes = image_boxes[sort_ind][:top_k]  # (top_k, 4)
-                image_labels = image_labels[sort_ind][:top_k]  # (top_k)
-
-            # Append to lists that store predicted boxes and scores for all images
-            all_images_boxes.append(image_boxes)
-            all_images_labels.append(image_labels)
-            all_images_scores.append(image_scores)
+            if image_keep.size(0) == 0:
+                all_images_boxes.append(torch.FloatTensor([[0., 0., 1., 1.]]).to(DEVICE))
+                all_images_labels.append(torch.LongTensor([0]).to(DEVICE))
+                all_images_scores.append(torch.FloatTensor([0.]).to(DEVICE))
+                continue
+            # Keep only the top k objects, otherwise the objects are ordered by class
+            if image_keep.size(0) > top_k:
+                image_keep = image_keep[:top_k]
+            else:
+                image_keep = image_keep[torch.sort(classes[image_keep], stable=True)[1]]
+            all_images_boxes.append(candidate_boxes[image_keep])
+            all_images_labels.append(classes[image_keep])
+            all_images_scores.append(candidate_scores[image_keep])
 
         return all_images_boxes, all_images_labels, all_images_scores  # lists of length batch_size
 
@@ -0,0 +1,213 @@
+from chesster.obj_recognition.game_archive import CALIBRATION_FILE, find_games, read_frames
+from chesster.obj_recognition.nn.generate import load_board, square_box, depth_scale, piece_mask, write_annotation
+from chesster.obj_recognition.nn.utils import CLASSES
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+import albumentations as A
+import numpy as np
+import cv2 as cv
+import chess
+import random
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Cutouts are stored at a scale where the square they stood on is CUTOUT_SQUARE pixels wide
+CUTOUT_SQUARE = 64
+
+
+def cutout_name(piece: str) -> str:
+    """Directory of the cutouts of a piece, w/b and the piece type, as file names may be case insensitive"""
+    return ('w' if piece.isupper() else 'b') + piece.lower()
+
+
+def get_lighting_transform():
+    return A.Compose([
+        A.RandomBrightnessContrast(brightness_limit=0.3, contrast_limit=0.3, p=0.8),
+        A.RandomGamma(p=0.3),
+        A.HueSaturationValue(hue_shift_limit=5, sat_shift_limit=15, val_shift_limit=10, p=0.3),
+        A.OneOf([A.MotionBlur(blur_limit=5), A.GaussianBlur(blur_limit=(3, 5)), A.Blur(blur_limit=3)], p=0.5),
+        A.GaussNoise(p=0.3)
+    ])
+
+
+def extract_cutouts(archive_path: Path, cutout_path: Path, margin=0.3) -> int:
+    """Segments the pieces of recorded games (GameRecorder) with their depth maps into BGRA cutouts
+
+    A cutout keeps the pixels standing above the empty board and is saved as cutout_path/<cutout_name>/<name>.png.
+    """
+    count = 0
+    for game_path in find_games(archive_path):
+        board = load_board(game_path / CALIBRATION_FILE)
+        for frame in read_frames(game_path):
+            if not frame.get('depth') or board.depth_map is None:
+                continue
+            image = cv.imread(str(game_path / frame['image']))
+            depth_map = np.load(game_path / frame['depth'])
+            if image is None or depth_map.shape != board.depth_map.shape:
+                continue
+            scale = depth_scale(image.shape, depth_map)
+            for field in board.fields:
+                state = frame['states'].get(field.position, '')
+                if state not in CLASSES:
+                    continue
+                contour, box = square_box(field, image.shape, margin)
+                core = contour.mean(axis=0) * scale[:2]
+                result = piece_mask(np.array(box) * scale, depth_map, board.depth_map, core)
+                if result is None:
+                    continue
+                window, mask = result
+                x_min, y_min, x_max, y_max = [int(round(v)) for v in np.array(window) / scale]
+                x_max, y_max = min(x_max, image.shape[1]), min(y_max, image.shape[0])
+                if x_max - x_min < 2 or y_max - y_min < 2:
+                    continue
+                alpha = cv.resize(mask.astype(np.uint8) * 255, (x_max - x_min, y_max - y_min),
+                                  interpolation=cv.INTER_NEAREST)
+                cutout = np.dstack([image[y_min:y_max, x_min:x_max], alpha])
+                factor = CUTOUT_SQUARE / (contour[:, 0].max() - contour[:, 0].min())
+                cutout = cv.resize(cutout, None, fx=factor, fy=factor, interpolation=cv.INTER_LINEAR)
+                path = Path(cutout_path) / cutout_name(state)
+                path.mkdir(parents=True, exist_ok=True)
+                cv.imwrite(str(path / f'{game_path.name}_{frame["frame"]:04d}_{field.position}.png'), cutout)
+                count += 1
+    logger.info(f'Extracted {count} cutouts to {cutout_path}')
+    return count
+
+
+@lru_cache(maxsize=4)
+def load_cutouts(cutout_path: Path) -> Dict[str, List[np.ndarray]]:
+    cutouts = {}
+    for piece in CLASSES:
+        paths = sorted((Path(cutout_path) / cutout_name(piece)).glob('*.png'))
+        images = [cv.imread(str(path), cv.IMREAD_UNCHANGED) for path in paths]
+        cutouts[piece] = [image for image in images if image is not None and image.ndim == 3 and image.shape[2] == 4]
+    missing = [piece for piece, images in cutouts.items() if not images]
+    if missing:
+        logger.warning(f'No cutouts for {missing}, these pieces are left out of the synthetic images')
+    return cutouts
+
+
+def random_position(rng: random.Random, max_plies=80) -> chess.Board:
+    """Legal position reached by random moves from the start position"""
+    position = chess.Board()
+    for _ in range(rng.randint(0, max_plies)):
+        moves = list(position.legal_moves)
+        if not moves:
+            break
+        position.push(rng.choice(moves))
+    return position
+
+
+def paste(image: np.ndarray, cutout: np.ndarray, center) -> Optional[List[float]]:
+    """Alpha blends a BGRA cutout centered on center into image, returns the box of its visible pixels"""
+    h, w = cutout.shape[:2]
+    x, y = int(round(center[0] - w / 2)), int(round(center[1] - h / 2))
+    x_0, y_0 = max(x, 0), max(y, 0)
+    x_1, y_1 = min(x + w, image.shape[1]), min(y + h, image.shape[0])
+    if x_1 <= x_0 or y_1 <= y_0:
+        return None
+    part = cutout[y_0 - y:y_1 - y, x_0 - x:x_1 - x]
+    alpha = part[..., 3:].astype(np.float32) / 255.0
+    region = image[y_0:y_1, x_0:x_1]
+    region[...] = (alpha * part[..., :3] + (1 - alpha) * region).astype(np.uint8)
+    rows, cols = np.nonzero(part[..., 3] > 127)
+    if len(rows) == 0:
+        return None
+    return [float(x_0 + cols.min()), float(y_0 + rows.min()), float(x_0 + cols.max() + 1), float(y_0 + rows.max() + 1)]
+
+
+def illuminate(image: np.ndarray, rng: random.Random, strength=0.25) -> np.ndarray:
+    """Uneven lighting, a linear brightness gradient in a random direction"""
+    angle = rng.uniform(0, 2 * np.pi)
+    rows, cols = np.mgrid[0:image.shape[0], 0:image.shape[1]].astype(np.float32)
+    ramp = np.cos(angle) * cols / image.shape[1] + np.sin(angle) * rows / image.shape[0]
+    ramp = 1 + rng.uniform(0, strength) * (ramp - ramp.mean()) / max(float(np.ptp(ramp)), 1e-6) * 2
+    return np.clip(image * ramp[..., None], 0, 255).astype(np.uint8)
+
+
+def synthesize(calibration_path: Path, cutout_path: Path, seed: int, transform=None, jitter=0.1) \
+        -> Tuple[np.ndarray, List[Tuple[int, List[float]]]]:
+    """Composites a random legal position onto the empty board image of the calibration
+
+    Returns the BGR image and the label and box of every pasted piece. The pieces are pasted from the back rank of the
+    image to the front, so nearer pieces cover farther ones like on the real board.
+    """
+    rng = random.Random(seed)
+    board = load_board(calibration_path)
+    cutouts = load_cutouts(cutout_path)
+    position = random_position(rng)
+    image = board.image.copy()
+    width, height = image.shape[:2]
+    pieces = []
+    for field in board.fields:
+        piece = position.piece_at(chess.parse_square(field.position))
+        if piece is None or not cutouts[piece.symbol()]:
+            continue
+        contour = field.rescaled_contour(width, height)
+        pieces.append((contour.mean(axis=0), contour[:, 0].max() - contour[:, 0].min(), piece.symbol()))
+    boxes = []
+    for center, size, piece in sorted(pieces, key=lambda p: p[0][1]):
+        cutout = rng.choice(cutouts[piece])
+        factor = size / CUTOUT_SQUARE * rng.uniform(0.9, 1.1)
+        cutout = cv.resize(cutout, None, fx=factor, fy=factor, interpolation=cv.INTER_LINEAR)
+        if rng.random() < 0.5:
+            cutout = cv.flip(cutout, 1)
+        center = center + np.array([rng.uniform(-jitter, jitter), rng.uniform(-jitter, jitter)]) * size
+        box = paste(image, cutout, center)
+        if box is not None:
+            boxes.append((CLASSES.index(piece) + 1, box))
+    image = illuminate(image, rng)
+    if transform is not None:
+        image = transform(image=image)['image']
+    return image, boxes
+
+
+@lru_cache(maxsize=1)
+def _transform():
+    return get_lighting_transform()
+
+
+def _synthesize_range(args) -> int:
+    calibration_path, cutout_path, image_path, label_path, seed, start, stop = args
+    pieces = 0
+    for index in range(start, stop):
+        image, boxes = synthesize(calibration_path, cutout_path, seed + index, _transform())
+        cv.imwrite(str(image_path / f'synthetic_{index:06d}.jpg'), image)
+        write_annotation(label_path / f'synthetic_{index:06d}.txt', boxes, image.shape)
+        pieces += len(boxes)
+    return pieces
+
+
+class SyntheticDatasetGenerator:
+    """Writes composited images of random legal positions with exact labels in the ChesspieceDataset format
+
+    The empty board image and the field geometry come from the calibration data (ChessBoard pickle), the pieces from a
+    cutout library (extract_cutouts or hand segmented BGRA images in cutout_path/<cutout_name>/). Sample i is generated
+    from seed + i, so a run can be reproduced or extended. The samples are split in chunks over worker processes.
+    """
+
+    def __init__(self, calibration_path: Path, cutout_path: Path, image_path: Path, label_path: Path,
+                 workers: Optional[int] = None, seed=0, chunk_size=64):
+        self.calibration_path = Path(calibration_path)
+        self.cutout_path = Path(cutout_path)
+        self.image_path = Path(image_path)
+        self.label_path = Path(label_path)
+        self.workers = workers
+        self.seed = seed
+        self.chunk_size = chunk_size
+
+    def generate(self, samples: int, start=0) -> int:
+        self.image_path.mkdir(parents=True, exist_ok=True)
+        self.label_path.mkdir(parents=True, exist_ok=True)
+        tasks = [(self.calibration_path, self.cutout_path, self.image_path, self.label_path, self.seed, i,
+                  min(i + self.chunk_size, start + samples)) for i in range(start, start + samples, self.chunk_size)]
+        logger.info(f'Generating {samples} synthetic images from {self.calibration_path}')
+        if self.workers == 0:
+            pieces = [_synthesize_range(task) for task in tasks]
+        else:
+            with ProcessPoolExecutor(max_workers=self.workers) as executor:
+                pieces = list(executor.map(_synthesize_range, tasks))
+        logger.info(f'Generated {samples} images with {sum(pieces)} pieces')
+        return samples
@@ -0,0 +1,208 @@
+from chesster.obj_recognition.nn.utils import DEVICE, Averager
+from chesster.obj_recognition.nn.export import meta_path
+from pathlib import Path
+from typing import List, Optional
+from tqdm.auto import tqdm
+import numpy as np
+import random
+import torch
+import time
+import json
+import os
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def yolo_targets(targets, image_size) -> torch.Tensor:
+    """Converts detection targets (pascal_voc boxes, 1-based labels) to the yolo (image, class, cx, cy, w, h) rows"""
+    rows = []
+    for i, target in enumerate(targets):
+        boxes = target['boxes'].reshape(-1, 4) / image_size
+        rows.append(torch.cat([torch.full((len(boxes), 1), float(i), device=boxes.device),
+                               (target['labels'].reshape(-1, 1) - 1).float(),
+                               (boxes[:, :2] + boxes[:, 2:]) / 2, boxes[:, 2:] - boxes[:, :2]], dim=1))
+    return torch.cat(rows) if rows else torch.zeros((0, 6))
+
+
+class EpochStats:
+    """Loss and throughput of one pass over a data loader"""
+
+    def __init__(self):
+        self.loss = Averager()
+        self.images = 0
+        self.data_time = 0.0
+        self.compute_time = 0.0
+
+    @property
+    def images_per_second(self) -> float:
+        total = self.data_time + self.compute_time
+        return self.images / total if total > 0 else 0.0
+
+    def __repr__(self):
+        return f'Loss: {self.loss.value: .4f}, {self.images_per_second:.1f} images/s, ' \
+               f'data wait: {self.data_time:.1f} s, compute: {self.compute_time:.1f} s'
+
+
+class Trainer:
+    """Trains a detector of obj_recognition.nn.models with checkpoints that can be resumed
+
+    The checkpoint ({model_name}_last.pth in checkpoint_dir) holds the model, the optimizer, the epoch and the random
+    number generator states, so a resumed run continues with the same data order. The weights with the lowest
+    validation loss (or of the last epoch without validation) are saved as {model_name}.pth for Detect, with a JSON file
+    of the same name holding the input size the model was trained at.
+    """
+
+    def __init__(self, model_name, model, criterion=None, optimizer=None, checkpoint_dir: Path = Path('.'),
+                 accumulation_steps=1, validate_every=1, input_size: Optional[int] = None):
+        self.model_name = model_name
+        self.model = model.to(DEVICE)
+        self.criterion = criterion
+        if optimizer is None:
+            params = [p for p in self.model.parameters() if p.requires_grad]
+            optimizer = torch.optim.SGD(params, lr=0.001, momentum=0.9, weight_decay=0.005)
+        self.optimizer = optimizer
+        self.checkpoint_dir = Path(checkpoint_dir)
+        self.accumulation_steps = max(1, accumulation_steps)
+        self.validate_every = validate_every
+        self.input_size = input_size
+        self.epoch = 0
+        self.best_loss = float('inf')
+
+    @property
+    def checkpoint_path(self) -> Path:
+        return self.checkpoint_dir / f'{self.model_name}_last.pth'
+
+    @property
+    def weights_path(self) -> Path:
+        return self.checkpoint_dir / f'{self.model_name}.pth'
+
+    def compute_loss(self, images: List[torch.Tensor], targets) -> torch.Tensor:
+        if self.criterion is not None:
+            # MultiBoxLoss matches the boxes to the priors in fractional coordinates
+            batch = torch.stack(images)
+            scale = torch.tensor([batch.shape[3], batch.shape[2]] * 2, dtype=torch.float32, device=batch.device)
+            pred_loc, pred_sco = self.model(batch)
+            return self.criterion(pred_loc, pred_sco, [target['boxes'] / scale for target in targets],
+                                  [target['labels'] for target in targets])
+        if self.model_name == 'yolo':
+            batch = torch.stack(images)
+            loss, _ = self.model(batch, yolo_targets(targets, batch.shape[-1]).to(DEVICE))
+            return loss
+        loss_dict = self.model(images, targets)
+        return sum(loss for loss in loss_dict.values())
+
+    @staticmethod
+    def __to_device(data):
+        images, targets = data
+        images = [image.to(DEVICE, non_blocking=True) for image in images]
+        targets = [{k: v.to(DEVICE, non_blocking=True) for k, v in t.items()} for t in targets]
+        return images, targets
+
+    @staticmethod
+    def __synchronize():
+        if DEVICE.type == 'cuda':
+            torch.cuda.synchronize()
+
+    def train_epoch(self, data_loader) -> EpochStats:
+        stats = EpochStats()
+        self.model.train()
+        self.optimizer.zero_grad(set_to_none=True)
+        progress_bar = tqdm(data_loader, total=len(data_loader))
+        start = time.perf_counter()
+        for i, data in enumerate(progress_bar):
+            loaded = time.perf_counter()
+            images, targets = self.__to_device(data)
+            loss = self.compute_loss(images, targets)
+            (loss / self.accumulation_steps).backward()
+            if (i + 1) % self.accumulation_steps == 0 or i + 1 == len(data_loader):
+                self.optimizer.step()
+                self.optimizer.zero_grad(set_to_none=True)
+            self.__synchronize()
+            end = time.perf_counter()
+            stats.data_time += loaded - start
+            stats.compute_time += end - loaded
+            stats.images += len(images)
+            stats.loss.send(loss.item())
+            progress_bar.set_description(desc=f'Loss: {loss.item(): .4f}')
+            start = end
+        return stats
+
+    def validate(self, data_loader) -> EpochStats:
+        stats = EpochStats()
+        # Faster R-CNN only returns its losses in training mode, its batch norm layers are frozen anyway
+        self.model.train(self.model_name == 'rcnn')
+        start = time.perf_counter()
+        with torch.no_grad():
+            for data in tqdm(data_loader, total=len(data_loader)):
+                loaded = time.perf_counter()
+                images, targets = self.__to_device(data)
+                stats.loss.send(self.compute_loss(images, targets).item())
+                self.__synchronize()
+                end = time.perf_counter()
+                stats.data_time += loaded - start
+                stats.compute_time += end - loaded
+                stats.images += len(images)
+                start = end
+        return stats
+
+    def save_checkpoint(self):
+        checkpoint = {
+            'model': self.model.state_dict(),
+            'optimizer': self.optimizer.state_dict(),
+            'epoch': self.epoch,
+            'best_loss': self.best_loss,
+            'rng': {
+                'torch': torch.get_rng_state(),
+                'cuda': torch.cuda.get_rng_state_all() if torch.cuda.is_available() else None,
+                'numpy': np.random.get_state(),
+                'python': random.getstate()
+            }
+        }
+        # Written to a temporary file first, so a crash while saving keeps the previous checkpoint
+        tmp_path = self.checkpoint_path.with_suffix('.tmp')
+        torch.save(checkpoint, tmp_path)
+        os.replace(tmp_path, self.checkpoint_path)
+
+    def resume(self) -> bool:
+        if not self.checkpoint_path.exists():
+            logger.warning(f'No checkpoint found at {self.checkpoint_path}, starting from scratch')
+            return False
+        checkpoint = torch.load(self.checkpoint_path, map_location='cpu', weights_only=False)
+        self.model.load_state_dict(checkpoint['model'])
+        self.optimizer.load_state_dict(checkpoint['optimizer'])
+        self.epoch = checkpoint['epoch']
+        self.best_loss = checkpoint['best_loss']
+        rng = checkpoint['rng']
+        torch.set_rng_state(rng['torch'])
+        if rng['cuda'] is not None and torch.cuda.is_available():
+            torch.cuda.set_rng_state_all(rng['cuda'])
+        np.random.set_state(rng['numpy'])
+        random.setstate(rng['python'])
+        logger.info(f'Resumed from {self.checkpoint_path} after epoch {self.epoch}')
+        return True
+
+    def save_weights(self):
+        torch.save(self.model.state_dict(), self.weights_path)
+        with open(meta_path(self.weights_path), 'w') as dest:
+            json.dump({'model': self.model_name, 'variant': 'eager', 'format': 'state_dict',
+                       'input_size': self.input_size}, dest, indent=2)
+
+    def fit(self, train_data_loader, num_epoch, valid_data_loader=None):
+        """Trains until num_epoch epochs are done in total, a resumed run continues after its last epoch"""
+        self.checkpoint_dir.mkdir(parents=True, exist_ok=True)
+        while self.epoch < num_epoch:
+            logger.info(f'Epoch: {self.epoch + 1} / {num_epoch}')
+            stats = self.train_epoch(train_data_loader)
+            self.epoch += 1
+            logger.info(f'Epoch: {self.epoch}, Training {stats}')
+            if valid_data_loader is None:
+                self.save_weights()
+            elif self.epoch % self.validate_every == 0 or self.epoch == num_epoch:
+                valid_stats = self.validate(valid_data_loader)
+                logger.info(f'Epoch: {self.epoch}, Validation {valid_stats}')
+                if valid_stats.loss.value < self.best_loss:
+                    self.best_loss = valid_stats.loss.value
+                    self.save_weights()
+            self.save_checkpoint()
+        return self.best_loss
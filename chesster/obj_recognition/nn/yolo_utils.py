@@ -2,6 +2,7 @@ import torch
 import numpy as np
 import tqdm
 from chesster.obj_recognition.nn.utils import DEVICE
+from chesster.obj_recognition.nn.nms import batched_nms, nms_assignment
 
 
 def to_cpu(tensor):
@@ -223,39 +224,33 @@ def non_max_suppression(prediction, conf_thres=0.5, nms_thres=0.4):
     """
     Removes detections with lower object confidence score than 'conf_thres' and performs
     Non-Maximum Suppression to further filter detections.
+    Overlapping boxes of the same class are merged into the kept box, weighted by their object confidence.
     Returns detections with shape:
         (x1, y1, x2, y2, object_conf, class_score, class_pred)
     """
 
     # From (center x, center y, width, height) to (x1, y1, x2, y2)
-    prediction[..., :4] = xywh2xyxy(prediction[..., :4])
+    prediction = torch.cat((xywh2xyxy(prediction[..., :4]), prediction[..., 4:]), -1)
     output = [None for _ in range(len(prediction))]
-    for image_i, image_pred in enumerate(prediction):
-        # Filter out confidence scores below threshold
-        image_pred = image_pred[image_pred[:, 4] >= conf_thres]
-        # If none are remaining => process next image
-        if not image_pred.size(0):
-            continue
-        # Object confidence times class confidence
-        score = image_pred[:, 4] * image_pred[:, 5:].max(1)[0]
-        # Sort by it
-        image_pred = image_pred[(-score).argsort()]
-        class_confs, class_preds = image_pred[:, 5:].max(1, keepdim=True)
-        detections = torch.cat((image_pred[:, :5], class_confs.float(), class_preds.float()), 1)
-        # Perform non-maximum suppression
-        keep_boxes = []
-        while detections.size(0):
-            large_overlap = bbox_iou(detections[0, :4].unsqueeze(0), detections[:, :4]) > nms_thres
-            label_match = detections[0, -1] == detections[:, -1]
-            # Indices of boxes with lower confidence scores, large IOUs and matching labels
-            invalid = large_overlap & label_match
-            weights = detections[invalid, 4:5]
-            # Merge overlapping bboxes by order of confidence
-            detections[0, :4] = (weights * detections[invalid, :4]).sum(0) / weights.sum()
-            keep_boxes += [detections[0]]
-            detections = detections[~invalid]
-        if keep_boxes:
-            output[image_i] = torch.stack(keep_boxes)
+    # Filter out confidence scores below threshold
+    images, rows = (prediction[..., 4] >= conf_thres).nonzero(as_tuple=True)
+    if not images.size(0):
+        return output
+    candidates = prediction[images, rows]
+    class_confs, class_preds = candidates[:, 5:].max(1, keepdim=True)
+    # Object confidence times class confidence
+    score = candidates[:, 4] * class_confs[:, 0]
+    detections = torch.cat((candidates[:, :5], class_confs.float(), class_preds.float()), 1)
+    groups = images * (prediction.size(-1) - 5) + class_preds[:, 0]
+    keep = batched_nms(detections[:, :4], score, groups, nms_thres, pixel_coordinates=True)
+    assignment = nms_assignment(detections[:, :4], groups, keep, nms_thres, pixel_coordinates=True)
+    # Merge overlapping bboxes into the kept box by order of confidence
+    weights = detections[:, 4:5]
+    merged = torch.zeros_like(detections[:, :4]).index_add_(0, assignment, weights * detections[:, :4])
+    merged = merged / torch.zeros_like(weights).index_add_(0, assignment, weights)
+    detections = torch.cat((merged, detections[:, 4:]), 1)
+    for image_i in images[keep].unique().tolist():
+        output[image_i] = detections[keep[images[keep] == image_i]]
 
     return output
 
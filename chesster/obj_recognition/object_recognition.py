@@ -1,5 +1,5 @@
 #from types import NoneType
-from typing import Union, Optional
+from typing import Union, Optional, List
 from pathlib import Path
 import numpy as np
 import logging
@@ -8,16 +8,37 @@ from chesster.master.module import Module
 from chesster.obj_recognition.chessboard_recognition import *
 from chesster.obj_recognition.chessboard import *
 from chesster.obj_recognition.chesspiece import ChessPiece
+from chesster.obj_recognition.change_detector import CascadedChangeDetector
+from chesster.obj_recognition.piece_classifier import PieceHeightClassifier
+from chesster.obj_recognition.board_state_estimator import BoardStateEstimate, BoardStateEstimator
+from chesster.obj_recognition.board_rectifier import BoardRectifier, RectifiedBoardView
 import cv2 as cv
 import copy
 logger = logging.getLogger(__name__)
 
 
 class ObjectRecognition(Module):
-    def __init__(self, promotion_dialog, board_info_path: Union[str, os.PathLike], debug=False):
+    def __init__(self, promotion_dialog, board_info_path: Union[str, os.PathLike], debug=False,
+                 piece_detector_path: Optional[Union[str, os.PathLike]] = None, piece_detector_model='rcnn',
+                 square_classifier_path: Optional[Union[str, os.PathLike]] = None):
         logger.info('Initializing Object recognition module!')
         self.board_info_path = board_info_path
         self.board = ChessBoard.load(Path(self.board_info_path))
+        piece_detector = None
+        if piece_detector_path:
+            from chesster.obj_recognition.nn.detect import Detect
+            logger.info(f'Loading piece detector "{piece_detector_model}" from {piece_detector_path}')
+            piece_detector = Detect(piece_detector_model, Path(piece_detector_path))
+        self.change_detector = CascadedChangeDetector.create(ChessBoard.CHANGE_THRESHOLD, piece_detector,
+                                                             field_thresholds=self.board.field_thresholds)
+        self.piece_classifier = PieceHeightClassifier(self.board.piece_profiles)
+        square_classifier = None
+        if square_classifier_path:
+            from chesster.obj_recognition.nn.square_classifier import SquareClassify
+            logger.info(f'Loading square classifier from {square_classifier_path}')
+            square_classifier = SquareClassify(Path(square_classifier_path))
+        self.state_estimator = BoardStateEstimator(self.piece_classifier, piece_detector, square_classifier)
+        self.rectifier: Optional[BoardRectifier] = None
         self.debug = debug
         self.dumped_coords = None
         self.dumped_extracted = None
@@ -42,13 +63,44 @@ class ObjectRecognition(Module):
         logger.info('Starting Object recognition module!')
         self.board.start(com_color, used_color)
 
-    def determine_changes(self, previous: np.ndarray, current_image: np.ndarray, current_player_color: str):
+    def determine_changes(self, previous: np.ndarray, current_image: np.ndarray, current_player_color: str,
+                          previous_depth: Optional[np.ndarray] = None, current_depth: Optional[np.ndarray] = None):
         self.board_backup = copy.deepcopy(self.board)
         move, failure_flag, self.NoStateChanges = self.board.determine_changes(previous, current_image,
-                                                                               current_player_color, self.debug, self.promotion_dialog)
+                                                                               current_player_color, self.debug, self.promotion_dialog,
+                                                                               previous_depth, current_depth,
+                                                                               self.change_detector,
+                                                                               self.piece_classifier)
         return self.get_chessboard_matrix(), move, failure_flag
 
-    def get_chesspiece_info(self, chessfield: str, depth_map) -> Optional[ChessPiece]:
+    def estimate_board_state(self, image: np.ndarray, depth_map: Optional[np.ndarray] = None) -> BoardStateEstimate:
+        estimate = self.state_estimator.estimate(self.board, image, depth_map, self.rectify(image, depth_map))
+        for field in self.board.fields:
+            field.state = estimate.states[field.position]
+        return estimate
+
+    def verify_board_state(self, depth_map: np.ndarray):
+        profile = self.piece_classifier.profile(self.board.fields, self.board.depth_map, depth_map)
+        return self.board.verify_state(profile, self.piece_classifier)
+
+    def rectify(self, image: np.ndarray, depth_map: Optional[np.ndarray] = None) -> Optional[RectifiedBoardView]:
+        if self.rectifier is None or self.rectifier.camera_shape != tuple(image.shape[:2]):
+            self.rectifier = BoardRectifier.from_board(self.board, image.shape)
+        if self.rectifier is None:
+            return None
+        return self.rectifier.rectify(image, depth_map)
+
+    def get_chesspiece_info(self, chessfield: str, depth_map, view: Optional[RectifiedBoardView] = None) \
+            -> Optional[ChessPiece]:
+        if view is not None:
+            zenith = view.zenith(chessfield)
+            if zenith is not None:
+                zenith, x, y = zenith
+                self.dumped_coords = None
+                self.debug_x = x
+                self.debug_y = y - 5 if chessfield[1] == '8' else y
+                return ChessPiece(chessfield, None, zenith, x, self.debug_y, roi=view.camera_point(chessfield))
+            logger.warning(f'No depth found for {chessfield} in the rectified view, using the camera depth map')
         for field in self.board.fields:
             if field.position == chessfield:
                 width, height = self.board.image.shape[:2]
@@ -62,6 +114,10 @@ class ObjectRecognition(Module):
                 return chesspiece
         return None
 
+    def get_target_info(self, chessfield: str, view: RectifiedBoardView) -> ChessPiece:
+        x, y = view.camera_point(chessfield)
+        return ChessPiece(chessfield, None, None, y, x, roi=(x, y))
+
     def get_chessboard_matrix(self):
         return self.board.current_chess_matrix
 
@@ -78,7 +134,23 @@ class ObjectRecognition(Module):
         return self.board.print_state(flipped)
 
     @staticmethod
-    def create_chessboard_data(image: np.ndarray, depth: np.ndarray, output_path: Path, debug=False):
-        board = ChessboardRecognition.from_image(image, depth_map=depth, debug=debug)
+    def create_chessboard_data(image: np.ndarray, depth: np.ndarray, output_path: Path, debug=False,
+                               empty_images: Optional[List[np.ndarray]] = None,
+                               recognition: Optional[ChessboardRecognition] = None):
+        if recognition is None:
+            board = ChessboardRecognition.from_image(image, depth_map=depth, debug=debug)
+        else:
+            board = recognition.recognize(image, depth_map=depth)
+        if empty_images and board.total_detected_fields() == 64:
+            board.record_statistics(empty_images=empty_images)
+        board.save(output_path)
+        return board
+
+    @staticmethod
+    def record_occupied_statistics(board: ChessBoard, occupied_images: List[np.ndarray], output_path: Path,
+                                   depth: Optional[np.ndarray] = None):
+        board.record_statistics(occupied_images=occupied_images)
+        if depth is not None and board.depth_map is not None:
+            board.learn_piece_profiles(depth)
         board.save(output_path)
         return board
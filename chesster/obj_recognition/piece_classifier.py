@@ -0,0 +1,156 @@
+from __future__ import annotations
+
+__all__ = [
+    'HeightProfile',
+    'PieceHeightClassifier'
+]
+
+import cv2 as cv
+import numpy as np
+import logging
+from typing import Dict, List, Optional, Tuple
+from chesster.obj_recognition.chessboard_field import ChessBoardField
+
+logger = logging.getLogger(__name__)
+
+
+class HeightProfile:
+    """Per field height features of one depth frame, measured over the footprint of every field"""
+
+    def __init__(self, fields: List[ChessBoardField], height_map: np.ndarray, peak: np.ndarray, mean: np.ndarray,
+                 asymmetry: np.ndarray):
+        self.fields = fields
+        self.height_map = height_map
+        self.peak = peak
+        self.mean = mean
+        self.asymmetry = asymmetry
+
+    def index(self, field: ChessBoardField) -> int:
+        return self.fields.index(field)
+
+    def __repr__(self):
+        return str({field.position: (round(float(p), 1), round(float(a), 2))
+                    for field, p, a in zip(self.fields, self.peak, self.asymmetry)})
+
+
+class PieceHeightClassifier:
+    """Classifies the piece type on every field by its height profile above the empty board
+
+    The height map is the difference between the depth map of the empty board recorded at calibration and the current
+    depth map. The peak height separates pawn, rook, knight, bishop, queen and king, the offset of the highest part
+    from the footprint center separates the asymmetric knight. Reference profiles can be learned from the start
+    position, otherwise DEFAULT_PROFILES (depth units of the camera, millimeters for the RealSense) are used.
+    """
+    DEFAULT_PROFILES = {
+        'p': (45.0, 0.05),
+        'r': (50.0, 0.05),
+        'n': (60.0, 0.35),
+        'b': (70.0, 0.05),
+        'q': (85.0, 0.05),
+        'k': (95.0, 0.05)
+    }
+    START_PIECES = {'a': 'r', 'b': 'n', 'c': 'b', 'd': 'q', 'e': 'k', 'f': 'b', 'g': 'n', 'h': 'r'}
+    MIN_HEIGHT = 15.0
+    PEAK_SCALE = 10.0
+    ASYMMETRY_SCALE = 0.15
+    FOOTPRINT_FACTOR = 0.6
+
+    def __init__(self, profiles: Optional[Dict[str, Tuple[float, float]]] = None):
+        self.profiles = dict(profiles) if profiles else dict(PieceHeightClassifier.DEFAULT_PROFILES)
+        self.__cache = {}
+
+    def __footprints(self, fields: List[ChessBoardField], shape) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        key = (tuple(shape[:2]), tuple((f.position, f.shape[:2]) for f in fields))
+        cached = self.__cache.get(key)
+        if cached is not None:
+            return cached
+        width, height = shape[:2]
+        mask = np.zeros((width, height), np.uint8)
+        indices = []
+        centers = []
+        for field in fields:
+            contour = field.rescaled_contour(width, height)
+            center = contour.mean(axis=0)
+            footprint = ((contour - center) * self.FOOTPRINT_FACTOR + center).astype(np.int32)
+            cv.fillConvexPoly(mask, footprint, 255)
+            indices.append(np.flatnonzero(mask))
+            centers.append(center)
+            cv.fillConvexPoly(mask, footprint, 0)
+        labels = np.repeat(np.arange(len(fields)), [len(i) for i in indices])
+        cached = (np.concatenate(indices) if indices else np.zeros(0, np.int64), labels, np.array(centers))
+        self.__cache = {key: cached}
+        return cached
+
+    def profile(self, fields: List[ChessBoardField], empty_depth: np.ndarray, depth: np.ndarray) -> HeightProfile:
+        """Computes the height map and the height features of all fields in one pass"""
+        empty_depth = empty_depth.astype(np.float32)
+        depth = depth.astype(np.float32)
+        valid = (empty_depth > 0) & (depth > 0)
+        height_map = np.where(valid, empty_depth - depth, 0).astype(np.float32)
+        height_map = cv.medianBlur(np.clip(height_map, 0, None), 3)
+        indices, labels, centers = self.__footprints(fields, depth.shape)
+        heights = height_map.reshape(-1)[indices].astype(np.float64)
+        n = len(fields)
+        counts = np.bincount(labels, minlength=n)
+        peak = np.zeros(n)
+        np.maximum.at(peak, labels, heights)
+        mean = np.bincount(labels, weights=heights, minlength=n) / np.maximum(counts, 1)
+        # Centroid of the upper half of the piece relative to the footprint center
+        top = np.clip(heights - peak[labels] / 2, 0, None)
+        ys, xs = np.divmod(indices, depth.shape[1])
+        weight = np.bincount(labels, weights=top, minlength=n)
+        cx = np.bincount(labels, weights=top * xs, minlength=n) / np.maximum(weight, 1e-6)
+        cy = np.bincount(labels, weights=top * ys, minlength=n) / np.maximum(weight, 1e-6)
+        radius = np.sqrt(np.maximum(counts, 1) / np.pi)
+        asymmetry = np.hypot(cx - centers[:, 0], cy - centers[:, 1]) / radius
+        asymmetry[weight <= 0] = 0.0
+        return HeightProfile(fields, height_map, peak, mean, asymmetry)
+
+    def occupied(self, profile: HeightProfile) -> Tuple[np.ndarray, np.ndarray]:
+        occupied = profile.peak > self.MIN_HEIGHT
+        confidence = np.clip(np.abs(profile.peak - self.MIN_HEIGHT) / self.MIN_HEIGHT, 0, 1)
+        return occupied, confidence
+
+    def classify(self, profile: HeightProfile) -> Tuple[List[str], np.ndarray]:
+        """Returns the lower case piece type ('.' for empty fields) and a confidence for every field"""
+        types = list(self.profiles)
+        references = np.array([self.profiles[t] for t in types])
+        distances = np.abs(profile.peak[:, None] - references[None, :, 0]) / self.PEAK_SCALE + \
+            np.abs(profile.asymmetry[:, None] - references[None, :, 1]) / self.ASYMMETRY_SCALE
+        order = np.argsort(distances, axis=1)
+        best = distances[np.arange(len(distances)), order[:, 0]]
+        second = distances[np.arange(len(distances)), order[:, 1]]
+        confidence = np.clip(1 - best / np.maximum(second, 1e-6), 0, 1)
+        occupied, occupied_confidence = self.occupied(profile)
+        pieces = [types[o] if occ else '.' for o, occ in zip(order[:, 0], occupied)]
+        confidence = np.where(occupied, np.minimum(confidence, occupied_confidence), occupied_confidence)
+        return pieces, confidence
+
+    def classify_field(self, profile: HeightProfile, field: ChessBoardField) -> Tuple[str, float]:
+        pieces, confidence = self.classify(profile)
+        i = profile.index(field)
+        return pieces[i], float(confidence[i])
+
+    def mismatches(self, profile: HeightProfile, min_confidence: float = 0.5) -> List[Tuple[ChessBoardField, str]]:
+        """Fields whose bookkept state disagrees with the confidently classified piece"""
+        pieces, confidence = self.classify(profile)
+        ret = []
+        for field, piece, c in zip(profile.fields, pieces, confidence):
+            state = field.state.lower() if field.state not in ('', '.') else '.'
+            if c >= min_confidence and piece != state:
+                ret.append((field, piece))
+        return ret
+
+    def learn(self, profile: HeightProfile) -> Dict[str, Tuple[float, float]]:
+        """Learns the reference profiles from a frame with all pieces at their start position"""
+        samples = {t: [] for t in self.profiles}
+        for i, field in enumerate(profile.fields):
+            if field.row in (2, 7):
+                samples['p'].append(i)
+            elif field.row in (1, 8):
+                samples[self.START_PIECES[field.col]].append(i)
+        for t, index in samples.items():
+            if index:
+                self.profiles[t] = (float(np.median(profile.peak[index])), float(np.median(profile.asymmetry[index])))
+        logger.info(f'Learned piece height profiles: {self.profiles}')
+        return self.profiles
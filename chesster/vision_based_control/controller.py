@@ -119,9 +119,7 @@ class VisualBasedController(Module):
             else:                                           #Case: Conversion to Knight
                 self.__graspArray = self.__conversionKnightPosition.pop(-1)
                 logger.info(f'Grasp Array for knight promotion move: {self.__placeArray}')
-            x = int(np.round(ChessPiece[1].roi[0]*ScalingFactors[0], 0))
-            y = int(np.round(ChessPiece[1].roi[1]*ScalingFactors[1], 0))
-            logger.info(f'Scaling ROI of target chess field from x: {ChessPiece[1].roi[0]}, y: {ChessPiece[1].roi[1]} to x_scaled: {x}, y_scaled: {y}')
+            x, y = self.scaleROI(ChessPiece[1].roi, ScalingFactors)
             self.__placeArray = np.array([x, y, d_img[y,x]])
             logger.info(f'Place Array: {self.__placeArray}')
             self.__flag = 'promotion'
@@ -130,9 +128,7 @@ class VisualBasedController(Module):
             logger.info(f'Setting heights for future z-coords to: {self.__heights}')
         else:
             logger.info('Processing Regular Move...')
-            x = int(np.round(ChessPiece[1].roi[0]*ScalingFactors[0], 0))
-            y = int(np.round(ChessPiece[1].roi[1]*ScalingFactors[1], 0))
-            logger.info(f'Scaling ROI of target chess field from x: {ChessPiece[1].roi[0]}, y: {ChessPiece[1].roi[1]} to x_scaled: {x}, y_scaled: {y}')
+            x, y = self.scaleROI(ChessPiece[1].roi, ScalingFactors)
             self.__graspArray = np.array([ChessPiece[0].y_cimg, ChessPiece[0].x_cimg, ChessPiece[0].zenith])
             logger.info(f'Grasp Array: {self.__graspArray}')
             self.__placeArray = np.array([x, y, d_img[y,x]]) #TBD!
@@ -215,6 +211,18 @@ class VisualBasedController(Module):
         logger.info('Moving Chesspiece.')
         self.__robot.MoveChesspiece(graspPose, placePose, self.__intermediateOrientation, 100)
 
+    @staticmethod
+    def scaleROI(roi, ScalingFactors):
+        """
+        Scales the ROI of the target chess field to camera pixels. Without ScalingFactors the ROI already is in camera pixels (rectified board view).
+        """
+        if ScalingFactors is None:
+            return int(roi[0]), int(roi[1])
+        x = int(np.round(roi[0]*ScalingFactors[0], 0))
+        y = int(np.round(roi[1]*ScalingFactors[1], 0))
+        logger.info(f'Scaling ROI of target chess field from x: {roi[0]}, y: {roi[1]} to x_scaled: {x}, y_scaled: {y}')
+        return x, y
+
     def useVBC(self, Move: str, Pieces: list, d_img: np.ndarray, ScalingFactors: list, lastMove: bool):
         """
         Main method of the Vision Based Controller. This method is the only one that should be called by the user. 
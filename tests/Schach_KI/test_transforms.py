@@ -0,0 +1,223 @@
+import contextlib
+import functools
+import io
+import random
+import chess
+import pandas as pd
+from chesster.Schach_KI.class_chess_gameplay import ChessGameplay
+from chesster.Schach_KI.comparison import FullMatrixComp, Matrixvergleich
+from chesster.Schach_KI.transforms import fen_to_matrix, matrix_to_fen, mirror_fen, mirror_move, mirror_moves
+
+
+@functools.lru_cache(maxsize=None)
+def reference_mirroring_matrix():
+    """pandas table of mirroring_matrix, built once here (mirrored_play built it for every move)"""
+    mirror_image = pd.DataFrame(columns=['Original', 'Mirrored'])
+    for l, (number, number_mirrored) in enumerate(zip(range(8, 0, -1), range(1, 9))):
+        for i, letter in enumerate('abcdefgh'):
+            mirror_image.loc[l * 8 + i] = [letter + str(number), letter + str(number_mirrored)]
+    return mirror_image
+
+
+def reference_mirrored_play(moves_to_mirror):
+    """mirrored_play with the pandas table of mirroring_matrix before the lookup tables"""
+    mirror_image = reference_mirroring_matrix()
+    mirrored_position = []
+    for move in moves_to_mirror:
+        old_position = move[0:2]
+        promotion = move[4] if len(move) == 5 else ''
+        new_position = '' if len(move) == 2 else move[2:4]
+        old_position_mirrored = new_position_mirrored = ''
+        for i in range(0, 64):
+            if mirror_image['Original'][i] == old_position:
+                old_position_mirrored = mirror_image['Mirrored'][i]
+            if mirror_image['Original'][i] == new_position:
+                new_position_mirrored = mirror_image['Mirrored'][i]
+        mirrored_position.append((old_position_mirrored or old_position) + (new_position_mirrored or new_position)
+                                 + promotion)
+    return mirrored_position
+
+
+def reference_expand(fen):
+    for count in range(8, 0, -1):
+        fen = fen.replace(str(count), '.' * count)
+    return fen.replace('/', '')
+
+
+def reference_compress(fen):
+    for count in range(8, 0, -1):
+        fen = fen.replace('.' * count, str(count))
+    return fen
+
+
+def reference_mirror_fen(fen_old):
+    """mirror_fen with the str.replace chains before the lookup tables"""
+    board_desc = reference_expand(fen_old[0:fen_old.index(' ')])
+    mirrored_fen = '/'.join(''.join(board_desc[63 - (8 * i - j)] for j in range(1, 9)) for i in range(1, 9))
+    mirrored_fen = reference_compress(mirrored_fen) + fen_old[fen_old.index(' '):]
+    listing = [i for i, n in enumerate(mirrored_fen) if n == ' ']
+    enpass = mirrored_fen[listing[2] + 1:listing[2] + 3]
+    return mirrored_fen.replace(enpass, reference_mirrored_play([enpass])[0])
+
+
+def reference_compute_matrix_from_fen(fen, player_color):
+    compute_before64 = reference_expand(fen)[0:64]
+    list_black_top = [[compute_before64[8 * row + column] for column in range(8)] for row in range(8)]
+    return list(reversed(list_black_top)) if player_color == 'b' else list_black_top
+
+
+def reference_set_matrix_to_fen(matrix, player_color, player_turn):
+    if player_color == 'b':
+        matrix = list(reversed(matrix))
+    fen_string = reference_compress('/'.join(''.join(str(piece) for piece in row) for row in matrix))
+    rochade = ''
+    if matrix[0][4] == 'K':
+        rochade += ('K' if matrix[0][7] == 'R' else '') + ('Q' if matrix[0][0] == 'R' else '')
+    if matrix[7][4] == 'k':
+        rochade += ('k' if matrix[7][7] == 'r' else '') + ('q' if matrix[7][0] == 'r' else '')
+    return fen_string + ' ' + player_turn + ' ' + (rochade or '-') + ' - 0 1'
+
+
+def reference_piece_notation_comparison(before, after, player_color):
+    """piece_notation_comparison with the pandas DataFrames before the lookup tables (without console output)"""
+    if player_color == 'b':
+        before, after = list(reversed(before)), list(reversed(after))
+    alphabet = 'abcdefgh'
+    move = pd.DataFrame(columns=['from', 'to'])
+    move_from = pd.DataFrame(columns=['from'])
+    move_to = pd.DataFrame(columns=['to'])
+    move_final, beaten = [], []
+    movement_detected = colorchange_detected = 0
+    counts = {(piece, when): 0 for piece in 'QqNn' for when in ('before', 'after')}
+    for i in range(0, 8):
+        for j in range(0, 8):
+            for piece in 'QqNn':
+                counts[piece, 'before'] += before[i][j] == piece
+                counts[piece, 'after'] += after[i][j] == piece
+            if after[i][j] == '.' and before[i][j] != '.':
+                move_from.loc[len(move_from)] = alphabet[j] + str(i + 1)
+                movement_detected += 1
+            if before[i][j] == '.' and after[i][j] != '.':
+                move_to.loc[len(move_to)] = alphabet[j] + str(i + 1)
+                movement_detected += 1
+            if after[i][j] != '.' and before[i][j] != '.':
+                if after[i][j].isupper() != before[i][j].isupper():
+                    move_to.loc[len(move_to)] = alphabet[j] + str(i + 1)
+                    beaten = [alphabet[j] + str(i + 1) + 'xx']
+                    colorchange_detected += 1
+        if i == 0:
+            if (before[0][4] == 'K' and after[0][2] == 'K' and before[0][0] == 'R' and after[0][3] == 'R') \
+                    or (before[0][4] == 'k' and after[0][2] == 'k' and before[0][0] == 'r' and after[0][3] == 'r'):
+                move_final.extend(['e1c1', 'a1d1'])
+            if (before[0][4] == 'K' and after[0][5] == 'R' and before[0][7] == 'R' and after[0][6] == 'K') \
+                    or (before[0][4] == 'k' and after[0][5] == 'r' and before[0][7] == 'r' and after[0][6] == 'k'):
+                move_final.extend(['e1g1', 'h1f1'])
+        if i == 7:
+            if (before[7][4] == 'k' and after[7][2] == 'k' and before[7][0] == 'r' and after[7][3] == 'r') \
+                    or (before[7][4] == 'K' and after[7][2] == 'K' and before[7][0] == 'R' and after[7][3] == 'R'):
+                move_final.extend(['e8c8', 'a8d8'])
+            if (before[7][4] == 'k' and after[7][5] == 'r' and before[7][7] == 'r' and after[7][6] == 'k') \
+                    or (before[7][4] == 'K' and after[7][5] == 'R' and before[7][7] == 'R' and after[7][6] == 'K'):
+                move_final.extend(['e8g8', 'h8f8'])
+    changes = movement_detected + colorchange_detected
+    if changes == 2:
+        move.loc[0] = [move_from['from'][0], move_to['to'][0]]
+        move_final = [move['from'][0] + move['to'][0]]
+        for piece in 'QqNn':
+            if counts[piece, 'after'] > counts[piece, 'before']:
+                move_final = [move['from'][0] + move['to'][0] + piece]
+    if changes == 3:
+        if move_to['to'][0][0:1] == move_from['from'][0][0:1]:
+            move_final = [move_from['from'][1] + move_to['to'][0], move_from['from'][0] + 'xx']
+        if move_to['to'][0][0:1] == move_from['from'][1][0:1]:
+            move_final = [move_from['from'][0] + move_to['to'][0], move_from['from'][1] + 'xx']
+    if changes < 2:
+        move_final = 0
+    if colorchange_detected > 0:
+        move_final.extend(beaten)
+    return move_final, colorchange_detected > 0
+
+
+def random_boards(games=20, plies=120, seed=0):
+    """Positions of random games, including en-passant squares, castling and promotions"""
+    rng = random.Random(seed)
+    for _ in range(games):
+        board = chess.Board()
+        for _ in range(plies):
+            if board.is_game_over():
+                break
+            moves = sorted(board.legal_moves, key=chess.Move.uci)
+            # Bauernzüge bevorzugen, damit Umwandlungen und En-passant vorkommen
+            pawn_moves = [move for move in moves if board.piece_type_at(move.from_square) == chess.PAWN]
+            move = rng.choice(pawn_moves if pawn_moves and rng.random() < 0.5 else moves)
+            yield board.copy(), move
+            board.push(move)
+
+
+def test_mirror_move_matches_pandas_table():
+    moves = [square for square in chess.SQUARE_NAMES] + ['-', 'e7e8q', 'a2a1N', 'e4xx', 'xxe4', 'h8', 'e1g1']
+    moves += [move.uci() for board, move in random_boards(games=3)]
+    assert mirror_moves(moves) == reference_mirrored_play(moves)
+    assert [mirror_move(move) for move in moves] == ChessGameplay.mirrored_play(moves)
+
+
+def test_mirror_fen_matches_replace_chains():
+    fens = [board.fen(en_passant='fen') for board, _ in random_boards()]
+    fens.append('rnbqkbnr/2pppp2/8/8/8/8/2PPPP2/RNBQKBNR w KQkq - 0 1')
+    assert any(fen.split()[3] != '-' for fen in fens)
+    for fen in fens:
+        assert mirror_fen(fen) == reference_mirror_fen(fen)
+        assert mirror_fen(mirror_fen(fen)) == fen
+
+
+def test_matrix_from_and_to_fen_matches_replace_chains():
+    for board, _ in random_boards(games=5):
+        fen = board.fen()
+        for player_color in ('w', 'b'):
+            matrix = fen_to_matrix(fen, player_color)
+            assert matrix == reference_compute_matrix_from_fen(fen, player_color)
+            player_turn = fen.split()[1]
+            assert matrix_to_fen(matrix, player_color, player_turn) == \
+                   reference_set_matrix_to_fen(matrix, player_color, player_turn)
+            assert matrix_to_fen(matrix, player_color, player_turn).split()[0] == fen.split()[0]
+
+
+def test_piece_notation_comparison_matches_dataframes():
+    for board, move in random_boards(games=10):
+        before_fen = board.fen()
+        board.push(move)
+        for player_color in ('w', 'b'):
+            before = fen_to_matrix(before_fen, player_color)
+            after = fen_to_matrix(board.fen(), player_color)
+            try:
+                expected = reference_piece_notation_comparison(before, after, player_color)
+            except (KeyError, AttributeError):
+                continue
+            with contextlib.redirect_stdout(io.StringIO()):
+                assert ChessGameplay.piece_notation_comparison(None, before, after, player_color) == expected
+
+
+def test_comparison_moves():
+    empty = [[0] * 8 for _ in range(8)]
+    before = [row[:] for row in empty]
+    after = [row[:] for row in empty]
+    before[1][4], after[3][4] = 'W', 'W'
+    with contextlib.redirect_stdout(io.StringIO()):
+        assert Matrixvergleich(before, after) == ('e2e4', False)
+        before[3][4], after[3][4] = 'B', 'W'
+        assert Matrixvergleich(before, after) == ('e2e4', True)
+    before = [row[:] for row in empty]
+    after = [row[:] for row in empty]
+    before[3][4], after[4][3] = 'P', 'P'
+    before[4][3] = 'p'
+    with contextlib.redirect_stdout(io.StringIO()):
+        assert FullMatrixComp(before, after, 'b') == (['e4d5', 'd5xx'], True)
+        before[4][3], after[4][3] = 0, 'P'
+        assert FullMatrixComp(before, after, 'b') == ('e4d5', False)
+
+
+if __name__ == '__main__':
+    for name, test in list(globals().items()):
+        if name.startswith('test_'):
+            test()
+            print(f'{name} passed')
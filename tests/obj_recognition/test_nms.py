@@ -0,0 +1,154 @@
+from types import SimpleNamespace
+import torch
+import torch.nn.functional as F
+from chesster.obj_recognition.nn.nms import batched_nms, box_iou, nms_assignment
+from chesster.obj_recognition.nn.ssd import SSD
+from chesster.obj_recognition.nn.ssd_utils import cxcy_to_xy, gcxgcy_to_cxcy, find_jaccard_overlap
+from chesster.obj_recognition.nn.yolo_utils import non_max_suppression, xywh2xyxy, bbox_iou
+
+
+def reference_detect_objects(priors_cxcy, n_classes, predicted_locs, predicted_scores, min_score, max_overlap, top_k):
+    """Per image and class loop of SSD.detect_objects before the batched NMS"""
+    predicted_scores = F.softmax(predicted_scores, dim=2)
+    all_boxes, all_labels, all_scores = [], [], []
+    for i in range(predicted_locs.size(0)):
+        decoded_locs = cxcy_to_xy(gcxgcy_to_cxcy(predicted_locs[i], priors_cxcy))
+        image_boxes, image_labels, image_scores = [], [], []
+        for c in range(1, n_classes):
+            class_scores = predicted_scores[i][:, c]
+            above = class_scores > min_score
+            if above.sum().item() == 0:
+                continue
+            class_scores, sort_ind = class_scores[above].sort(dim=0, descending=True)
+            class_decoded_locs = decoded_locs[above][sort_ind]
+            overlap = find_jaccard_overlap(class_decoded_locs, class_decoded_locs)
+            suppress = torch.zeros(class_scores.size(0), dtype=torch.bool)
+            for box in range(class_decoded_locs.size(0)):
+                if suppress[box]:
+                    continue
+                suppress = suppress | (overlap[box] > max_overlap)
+                suppress[box] = False
+            image_boxes.append(class_decoded_locs[~suppress])
+            image_labels.append(torch.full(((~suppress).sum().item(),), c, dtype=torch.long))
+            image_scores.append(class_scores[~suppress])
+        if len(image_boxes) == 0:
+            image_boxes.append(torch.FloatTensor([[0., 0., 1., 1.]]))
+            image_labels.append(torch.LongTensor([0]))
+            image_scores.append(torch.FloatTensor([0.]))
+        image_boxes, image_labels, image_scores = torch.cat(image_boxes), torch.cat(image_labels), torch.cat(image_scores)
+        if image_scores.size(0) > top_k:
+            image_scores, sort_ind = image_scores.sort(dim=0, descending=True)
+            image_scores = image_scores[:top_k]
+            image_boxes = image_boxes[sort_ind][:top_k]
+            image_labels = image_labels[sort_ind][:top_k]
+        all_boxes.append(image_boxes)
+        all_labels.append(image_labels)
+        all_scores.append(image_scores)
+    return all_boxes, all_labels, all_scores
+
+
+def reference_non_max_suppression(prediction, conf_thres=0.5, nms_thres=0.4):
+    """Per image and box loop of yolo_utils.non_max_suppression before the batched NMS"""
+    prediction = prediction.clone()
+    prediction[..., :4] = xywh2xyxy(prediction[..., :4])
+    output = [None for _ in range(len(prediction))]
+    for image_i, image_pred in enumerate(prediction):
+        image_pred = image_pred[image_pred[:, 4] >= conf_thres]
+        if not image_pred.size(0):
+            continue
+        score = image_pred[:, 4] * image_pred[:, 5:].max(1)[0]
+        image_pred = image_pred[(-score).argsort()]
+        class_confs, class_preds = image_pred[:, 5:].max(1, keepdim=True)
+        detections = torch.cat((image_pred[:, :5], class_confs.float(), class_preds.float()), 1)
+        keep_boxes = []
+        while detections.size(0):
+            large_overlap = bbox_iou(detections[0, :4].unsqueeze(0), detections[:, :4]) > nms_thres
+            label_match = detections[0, -1] == detections[:, -1]
+            invalid = large_overlap & label_match
+            weights = detections[invalid, 4:5]
+            detections[0, :4] = (weights * detections[invalid, :4]).sum(0) / weights.sum()
+            keep_boxes += [detections[0]]
+            detections = detections[~invalid]
+        if keep_boxes:
+            output[image_i] = torch.stack(keep_boxes)
+    return output
+
+
+def random_boxes(n, size=1.0):
+    xy = torch.rand(n, 2) * size
+    wh = torch.rand(n, 2) * size * 0.3 + 0.01
+    return torch.cat([xy, xy + wh], 1)
+
+
+def test_box_iou_matches_pairwise_overlaps():
+    torch.manual_seed(0)
+    a, b = random_boxes(7), random_boxes(5)
+    assert torch.allclose(box_iou(a, b), find_jaccard_overlap(a, b))
+    a, b = a * 400, b * 400
+    expected = torch.stack([bbox_iou(box.unsqueeze(0), b) for box in a])
+    assert torch.allclose(box_iou(a, b, pixel_coordinates=True), expected)
+
+
+def test_batched_nms_keeps_greedy_result_per_group():
+    torch.manual_seed(1)
+    boxes = random_boxes(300, 100)
+    scores = torch.rand(300)
+    groups = torch.randint(0, 4, (300,))
+    keep = batched_nms(boxes, scores, groups, 0.3)
+    assignment = nms_assignment(boxes, groups, keep, 0.3)
+    expected = []
+    for g in range(4):
+        index = torch.nonzero(groups == g)[:, 0]
+        index = index[scores[index].argsort(descending=True)]
+        kept = []
+        for i in index.tolist():
+            if all(box_iou(boxes[k:k + 1], boxes[i:i + 1])[0, 0] <= 0.3 for k in kept):
+                kept.append(i)
+        expected.extend(kept)
+    assert sorted(keep.tolist()) == sorted(expected)
+    assert torch.all(scores[keep][:-1] >= scores[keep][1:])
+    assert torch.equal(assignment[keep], keep)
+    assert torch.equal(groups[assignment], groups)
+
+
+def test_batched_nms_empty():
+    keep = batched_nms(torch.zeros((0, 4)), torch.zeros(0), torch.zeros(0, dtype=torch.long), 0.5)
+    assert keep.numel() == 0
+
+
+def test_ssd_detect_objects_matches_loop():
+    torch.manual_seed(2)
+    n_priors, n_classes = 500, 13
+    priors = torch.cat([torch.rand(n_priors, 2), torch.rand(n_priors, 2) * 0.3 + 0.05], 1)
+    ssd = SimpleNamespace(priors_cxcy=priors, n_classes=n_classes)
+    locs = torch.randn(3, n_priors, 4) * 0.5
+    scores = torch.randn(3, n_priors, n_classes) * 3
+    # The third image has no object above the minimum score
+    scores[2, :, 0] = 20
+    for top_k in (200, 10):
+        result = SSD.detect_objects(ssd, locs, scores, 0.2, 0.45, top_k)
+        expected = reference_detect_objects(priors, n_classes, locs, scores, 0.2, 0.45, top_k)
+        for actual, reference in zip(result, expected):
+            for a, r in zip(actual, reference):
+                assert torch.allclose(a.cpu(), r)
+
+
+def test_yolo_non_max_suppression_matches_loop():
+    torch.manual_seed(3)
+    prediction = torch.cat([torch.rand(4, 600, 2) * 416, torch.rand(4, 600, 2) * 60 + 5, torch.rand(4, 600, 13)], 2)
+    # The last image has no detection above the confidence threshold
+    prediction[3, :, 4] = 0.1
+    result = non_max_suppression(prediction.clone(), 0.5, 0.4)
+    expected = reference_non_max_suppression(prediction, 0.5, 0.4)
+    for actual, reference in zip(result, expected):
+        if reference is None:
+            assert actual is None
+        else:
+            assert torch.allclose(actual, reference, atol=1e-4)
+
+
+if __name__ == '__main__':
+    for name, test in list(globals().items()):
+        if name.startswith('test_'):
+            test()
+            print(f'{name} passed')